@@ -13,6 +13,16 @@ class Recipe(object):
         self.options = options
 
     def install(self):
+        self.configure(incremental=False)
+
+    def update(self):
+        self.configure(incremental=True)
+
+    def configure(self, incremental):
+        """
+        Produce the configuration files, regenerating only the ones whose
+        inputs changed when incremental.
+        """
         staging = self.buildout['transform']['staging']
         buildout_directory = self.buildout['buildout']['directory']
 
@@ -24,7 +34,5 @@ class Recipe(object):
             if not os.path.exists(path):
                 os.makedirs(path)
 
-        server.main(self.buildout, buildout_directory, staging)
-
-    def update(self):
-        return self.install()
+        server.main(self.buildout, buildout_directory, staging, incremental,
+                    self.options)
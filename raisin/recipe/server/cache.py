@@ -0,0 +1,147 @@
+"""
+Keep the response cache of the restish server within its size, removing
+the expired responses first, then the least recently used ones.
+
+The responses of a project are cached in a folder named after it, below
+folders named after the first characters of the digest of their key, so
+that no folder holds too many files:
+
+  cache/Test/3f/a2/3fa2...
+
+Run it with:
+
+  $ ./bin/raisin-cache-eviction --config etc/restish/cache.ini
+"""
+
+import os
+import sys
+import time
+import hashlib
+import logging
+import optparse
+import ConfigParser
+
+logger = logging.getLogger('raisin.recipe.server.cache')
+
+# The folder of the responses not related to a project
+NO_PROJECT = '_'
+
+
+def cache_path(root, project, key, levels=2):
+    """
+    Return the path of the cached response of a key.
+    """
+    digest = hashlib.sha1(key).hexdigest()
+    folders = [digest[2 * level:2 * level + 2] for level in range(levels)]
+    return os.path.join(root, project or NO_PROJECT, *(folders + [digest]))
+
+
+def read_config(path):
+    """
+    Return the cache settings and the TTLs of the projects written in
+    cache.ini.
+    """
+    parser = ConfigParser.RawConfigParser()
+    parser.optionxform = str
+    parser.read([path])
+    settings = dict(parser.items('cache'))
+    for key in ['max_size', 'ttl', 'levels']:
+        settings[key] = int(settings[key])
+    ttls = {}
+    if parser.has_section('ttl'):
+        for project, ttl in parser.items('ttl'):
+            ttls[project] = int(ttl)
+    return settings, ttls
+
+
+def list_responses(root):
+    """
+    Return a list of tuples containing the project, the time of the last
+    use, the modification time, the size and the path of every cached
+    response.
+    """
+    responses = []
+    for folder, folders, files in os.walk(root):
+        for name in files:
+            path = os.path.join(folder, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Removed by the server in the meantime
+                continue
+            project = os.path.relpath(path, root).split(os.sep)[0]
+            responses.append((project, max(stat.st_atime, stat.st_mtime),
+                              stat.st_mtime, stat.st_size, path))
+    return responses
+
+
+def remove(path):
+    """
+    Remove a cached response, unless the server already did.
+    """
+    try:
+        os.remove(path)
+    except OSError:
+        return False
+    return True
+
+
+def evict(root, max_size, ttl, ttls=None, now=None):
+    """
+    Remove the responses older than the TTL of their project, then the
+    least recently used ones until the cache is within its maximum size.
+
+    Return the number of responses removed and the size of the cache left.
+    """
+    if ttls is None:
+        ttls = {}
+    if now is None:
+        now = time.time()
+    removed = 0
+    kept = []
+    for response in list_responses(root):
+        project, used, modified, size, path = response
+        if now - modified > ttls.get(project, ttl):
+            removed += remove(path)
+        else:
+            kept.append(response)
+    size = sum([response[3] for response in kept])
+    if size > max_size:
+        kept.sort(key=lambda response: response[1])
+        for project, used, modified, length, path in kept:
+            if size <= max_size:
+                break
+            removed += remove(path)
+            size -= length
+    return removed, size
+
+
+def main(argv=None):
+    """
+    Evict the responses of the cache configured in cache.ini, once or
+    periodically.
+    """
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--config', default='etc/restish/cache.ini',
+                      help='cache configuration [%default]')
+    parser.add_option('--interval', type='int', default=0,
+                      help='seconds between evictions, 0 to evict once '
+                           '[%default]')
+    options = parser.parse_args(argv)[0]
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    while True:
+        settings, ttls = read_config(options.config)
+        if settings['backend'] == 'file' and os.path.isdir(settings['path']):
+            removed, size = evict(settings['path'], settings['max_size'],
+                                  settings['ttl'], ttls)
+            logger.info('Removed %s responses, keeping %s bytes' % (removed,
+                                                                   size))
+        if options.interval <= 0:
+            break
+        time.sleep(options.interval)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
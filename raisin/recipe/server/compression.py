@@ -0,0 +1,365 @@
+"""
+Compress the responses of the servers, and serve the static files of the
+restish server from the copies compressed once when configuring it.
+
+The static files are compressed next to themselves, with gzip and, when
+the brotli module is available, with brotli:
+
+  etc/restish/raisin.restish/public/raisin.js
+  etc/restish/raisin.restish/public/raisin.js.gz
+  etc/restish/raisin.restish/public/raisin.js.br
+"""
+
+import os
+import gzip
+import time
+import zlib
+import logging
+import calendar
+import mimetypes
+import cStringIO
+import email.utils
+from raisin.recipe.server.middleware import ClosingIterator
+from raisin.recipe.server.output import write_file
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger('raisin.recipe.server.compression')
+
+# The content types compressed, unless the types setting says otherwise
+TYPES = ('application/json', 'application/javascript', 'text/css',
+         'text/csv', 'text/html', 'text/plain', 'image/svg+xml')
+
+# The extensions of the static files compressed in advance
+EXTENSIONS = ('.css', '.csv', '.html', '.js', '.json', '.svg', '.txt')
+
+# The smallest response compressed, in bytes
+MIN_SIZE = 1024
+
+# The compressed copies of a file, by encoding, the preferred one first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# The size of the blocks the static files are sent by, in bytes
+BLOCK_SIZE = 64 * 1024
+
+
+def gzip_data(data, level=6):
+    """
+    Return data compressed with gzip, always the same for the same data.
+    """
+    buffer = cStringIO.StringIO()
+    compressed = gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=level,
+                               mtime=0)
+    try:
+        compressed.write(data)
+    finally:
+        compressed.close()
+    return buffer.getvalue()
+
+
+def accepted_encodings(header):
+    """
+    Return the set of the content codings accepted by the Accept-Encoding
+    header, leaving out the ones with a q of 0.
+    """
+    encodings = set()
+    for item in (header or '').split(','):
+        parts = [part.strip() for part in item.split(';')]
+        if not parts[0]:
+            continue
+        rejected = False
+        for parameter in parts[1:]:
+            if parameter.replace(' ', '').startswith('q='):
+                try:
+                    rejected = float(parameter.split('=', 1)[1]) == 0
+                except ValueError:
+                    rejected = True
+        if not rejected:
+            encodings.add(parts[0].lower())
+    return encodings
+
+
+def is_current(copy, stat):
+    """
+    Return True if the compressed copy of a file has its modification time,
+    to the second, as some file systems do not keep more.
+    """
+    return os.path.isfile(copy) and \
+        int(os.stat(copy).st_mtime) == int(stat.st_mtime)
+
+
+def precompress(root, min_size=MIN_SIZE, extensions=EXTENSIONS, level=9):
+    """
+    Compress the static files below root whose compressed copies are
+    missing or older than them, and remove the copies of the files gone.
+    Only the copies of files with one of the extensions are removed, so
+    that archives like data.tar.gz are kept.
+
+    The copies get the modification time of their file, so that nginx with
+    gzip_static, or the static application, can tell they are current.
+    Return the number of copies written and removed.
+    """
+    written = 0
+    removed = 0
+    if not os.path.isdir(root):
+        return written, removed
+    suffixes = [suffix for encoding, suffix in ENCODINGS
+                if encoding == 'gzip' or brotli is not None]
+    for folder, folders, files in os.walk(root):
+        for name in files:
+            path = os.path.join(folder, name)
+            source, suffix = os.path.splitext(path)
+            if suffix in ('.gz', '.br'):
+                if os.path.splitext(source)[1].lower() in extensions and \
+                   not os.path.exists(source):
+                    logger.info('Removing compressed copy: %s' % path)
+                    os.remove(path)
+                    removed += 1
+                continue
+            if os.path.splitext(name)[1].lower() not in extensions:
+                continue
+            stat = os.stat(path)
+            if stat.st_size < min_size:
+                continue
+            data = None
+            for suffix in suffixes:
+                copy = path + suffix
+                if is_current(copy, stat):
+                    continue
+                if data is None:
+                    data = open(path, 'rb').read()
+                if suffix == '.gz':
+                    compressed = gzip_data(data, level)
+                else:
+                    compressed = brotli.compress(data)
+                write_file(copy, compressed)
+                os.utime(copy, (stat.st_atime, stat.st_mtime))
+                written += 1
+    return written, removed
+
+
+class CompressionMiddleware(object):
+    """
+    Compress with gzip the successful responses of the allowed content
+    types, at least min_size bytes long, for the clients accepting it.
+
+    The body is compressed as it is produced, once its first min_size bytes
+    are, so that large responses are neither held in memory nor delayed.
+    """
+
+    def __init__(self, app, min_size=MIN_SIZE, types=TYPES, level=6):
+        self.app = app
+        self.min_size = min_size
+        self.types = tuple(types)
+        self.level = level
+
+    def compressible(self, status, headers):
+        """
+        Return True if a response may be compressed, given its status and
+        headers.
+        """
+        if not status.startswith('200'):
+            return False
+        names = dict([(name.lower(), value) for name, value in headers])
+        if 'content-encoding' in names:
+            return False
+        content_type = names.get('content-type', '').split(';')[0].strip()
+        if content_type.lower() not in self.types:
+            return False
+        length = names.get('content-length')
+        return not (length and length.isdigit() and
+                    int(length) < self.min_size)
+
+    def __call__(self, environ, start_response):
+        if 'gzip' not in accepted_encodings(
+                environ.get('HTTP_ACCEPT_ENCODING')):
+            return self.app(environ, start_response)
+        response = {}
+        pending = []
+
+        def compressing_start_response(status, headers, exc_info=None):
+            response['compress'] = self.compressible(status, headers)
+            if not response['compress']:
+                if exc_info is None:
+                    return start_response(status, headers)
+                return start_response(status, headers, exc_info)
+            response['status'] = status
+            response['headers'] = headers
+            response['exc_info'] = exc_info
+            return pending.append
+
+        result = self.app(environ, compressing_start_response)
+        if response.get('compress') is False:
+            return result
+        return ClosingIterator(result, lambda failed: None,
+                               self.stream(result, response, pending,
+                                           start_response))
+
+    def stream(self, result, response, pending, start_response):
+        """
+        Yield the body of a response, holding back its first chunks until
+        min_size bytes of it are known to be compressed, and sending the
+        shorter bodies as they are.
+        """
+        compressor = None
+        size = sum([len(chunk) for chunk in pending])
+        for chunk in result:
+            if not response.get('compress'):
+                yield chunk
+                continue
+            if compressor is None:
+                pending.append(chunk)
+                size += len(chunk)
+                if size < self.min_size:
+                    continue
+                compressor = zlib.compressobj(self.level, zlib.DEFLATED,
+                                              16 + zlib.MAX_WBITS)
+                self.start(response, start_response, True)
+                chunk = ''.join(pending)
+                del pending[:]
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        if not response.get('compress'):
+            return
+        if compressor is None:
+            data = ''.join(pending)
+            self.start(response, start_response, False, len(data))
+            yield data
+        else:
+            yield compressor.flush()
+
+    def start(self, response, start_response, compressed, length=None):
+        """
+        Start a response held back, compressed with gzip or of the given
+        length.
+        """
+        headers = [(name, value) for name, value in response['headers']
+                   if name.lower() != 'content-length']
+        headers.append(('Vary', 'Accept-Encoding'))
+        if compressed:
+            headers.append(('Content-Encoding', 'gzip'))
+            headers = [(name, name.lower() == 'etag' and
+                        value.endswith('"') and value[:-1] + '-gzip"' or
+                        value) for name, value in headers]
+        else:
+            headers.append(('Content-Length', str(length)))
+        if response['exc_info'] is None:
+            start_response(response['status'], headers)
+        else:
+            start_response(response['status'], headers, response['exc_info'])
+
+
+class FileIterator(object):
+    """
+    Stream a file by blocks, closing it with the response.
+    """
+
+    def __init__(self, path, size=BLOCK_SIZE):
+        self.file = open(path, 'rb')
+        self.size = size
+
+    def __iter__(self):
+        while True:
+            block = self.file.read(self.size)
+            if not block:
+                return
+            yield block
+
+    def close(self):
+        """
+        Close the file.
+        """
+        self.file.close()
+
+
+def is_modified(stat, header):
+    """
+    Return False if the file was not modified since the date of the
+    If-Modified-Since header.
+    """
+    if not header:
+        return True
+    date = email.utils.parsedate(header.split(';')[0])
+    if date is None:
+        return True
+    return int(stat.st_mtime) > calendar.timegm(date)
+
+
+class PrecompressedStatic(object):
+    """
+    Serve the static files below a document root, sending their compressed
+    copy, if current, to the clients accepting its encoding, and answering
+    the requests whose If-Modified-Since is not older than the file with
+    304 Not Modified.
+
+    Missing files are answered with 404 Not Found, so that a cascade tries
+    the next application.
+    """
+
+    def __init__(self, document_root):
+        self.document_root = os.path.abspath(document_root)
+
+    def __call__(self, environ, start_response):
+        if environ.get('REQUEST_METHOD', 'GET') not in ('GET', 'HEAD'):
+            return self.not_found(start_response)
+        path = os.path.normpath(os.path.join(
+            self.document_root, environ.get('PATH_INFO', '').lstrip('/')))
+        if path != self.document_root and \
+           not path.startswith(self.document_root + os.sep):
+            return self.not_found(start_response)
+        if os.path.isdir(path):
+            path = os.path.join(path, 'index.html')
+        if not os.path.isfile(path):
+            return self.not_found(start_response)
+        stat = os.stat(path)
+        content_type = mimetypes.guess_type(path)[0] or \
+            'application/octet-stream'
+        modified = time.strftime('%a, %d %b %Y %H:%M:%S GMT',
+                                 time.gmtime(stat.st_mtime))
+        headers = [('Content-Type', content_type),
+                   ('Last-Modified', modified),
+                   ('Vary', 'Accept-Encoding')]
+        if not is_modified(stat, environ.get('HTTP_IF_MODIFIED_SINCE')):
+            start_response('304 Not Modified', headers[1:])
+            return []
+        accepted = accepted_encodings(environ.get('HTTP_ACCEPT_ENCODING'))
+        for encoding, suffix in ENCODINGS:
+            copy = path + suffix
+            if encoding in accepted and is_current(copy, stat):
+                path = copy
+                headers.append(('Content-Encoding', encoding))
+                break
+        headers.append(('Content-Length', str(os.path.getsize(path))))
+        start_response('200 OK', headers)
+        if environ.get('REQUEST_METHOD', 'GET') != 'GET':
+            return []
+        if 'wsgi.file_wrapper' in environ:
+            return environ['wsgi.file_wrapper'](open(path, 'rb'), BLOCK_SIZE)
+        return FileIterator(path)
+
+    def not_found(self, start_response):
+        """
+        Answer that the file does not exist.
+        """
+        start_response('404 Not Found', [('Content-Type', 'text/plain')])
+        return ['Not Found']
+
+
+def make_filter(app, global_conf, min_size=str(MIN_SIZE), types='',
+                level='6'):
+    """
+    Paste entry point of the compression filter.
+    """
+    return CompressionMiddleware(app, int(min_size),
+                                 types.split() or TYPES, int(level))
+
+
+def make_static(global_conf, document_root):
+    """
+    Paste entry point of the static application.
+    """
+    return PrecompressedStatic(document_root)
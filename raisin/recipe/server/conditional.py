@@ -0,0 +1,149 @@
+"""
+Answer the requests for the resources of a project with strong ETags and
+Cache-Control headers derived from the data version of the project, and
+with 304 Not Modified when the client already has the current version,
+without asking the server.
+
+The data versions are read from etc/projects/versions.ini:
+
+  [versions]
+  Test = 0123456789abcdef
+
+which is read again when it changes, so that the ETags of a project only
+change when its profiles are staged again.
+
+The responses are marked private when the server only shows the projects
+to their users, so that shared caches do not keep them.
+"""
+
+import os
+import time
+import hashlib
+import threading
+import ConfigParser
+
+# The request headers selecting the representation of a resource
+REPRESENTATION_HEADERS = ('HTTP_ACCEPT', 'HTTP_ACCEPT_ENCODING')
+
+
+def read_versions(path):
+    """
+    Return the data version of each project of versions.ini.
+    """
+    parser = ConfigParser.RawConfigParser()
+    parser.optionxform = str
+    parser.read([path])
+    if not parser.has_section('versions'):
+        return {}
+    return dict(parser.items('versions'))
+
+
+def get_project(path):
+    """
+    Return the project of the path of a request, if any.
+    """
+    parts = path.split('/')
+    if len(parts) < 3 or parts[0] or parts[1] != 'project' or not parts[2]:
+        return None
+    return parts[2]
+
+
+def get_etag(version, environ):
+    """
+    Return the strong ETag of the resource requested, made of the data
+    version of its project and a digest of its path, query and the
+    representation asked for.
+    """
+    key = [environ.get('PATH_INFO', ''), environ.get('QUERY_STRING', '')]
+    key.extend([environ.get(name, '') for name in REPRESENTATION_HEADERS])
+    digest = hashlib.sha1('\n'.join(key)).hexdigest()
+    return '"%s-%s"' % (version, digest[:16])
+
+
+def etag_matches(etag, header):
+    """
+    Return True if the If-None-Match header lists the ETag.
+    """
+    if header is None:
+        return False
+    return etag in [tag.strip() for tag in header.split(',')]
+
+
+class ConditionalMiddleware(object):
+    """
+    Add ETags and Cache-Control headers to the successful responses for the
+    resources of the projects, and answer the conditional requests.
+    """
+
+    def __init__(self, app, path, max_age=300, check=5, private=False):
+        self.app = app
+        self.path = path
+        self.max_age = max_age
+        self.check = check
+        self.cache_control = 'max-age=%s' % max_age
+        if private:
+            self.cache_control = 'private, ' + self.cache_control
+        self.modified = None
+        self.checked = 0
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def get_versions(self):
+        """
+        Return the data versions, reading versions.ini again when it was
+        modified, checking at most every few seconds.
+        """
+        now = time.time()
+        if now - self.checked < self.check:
+            return self.versions
+        self.lock.acquire()
+        try:
+            self.checked = now
+            try:
+                modified = os.stat(self.path).st_mtime
+            except OSError:
+                modified = None
+            if modified != self.modified:
+                self.modified = modified
+                self.versions = read_versions(self.path)
+            return self.versions
+        finally:
+            self.lock.release()
+
+    def __call__(self, environ, start_response):
+        if environ.get('REQUEST_METHOD', 'GET') not in ('GET', 'HEAD'):
+            return self.app(environ, start_response)
+        project = get_project(environ.get('PATH_INFO', ''))
+        version = self.get_versions().get(project)
+        if version is None:
+            return self.app(environ, start_response)
+        etag = get_etag(version, environ)
+        cache_control = self.cache_control
+        if etag_matches(etag, environ.get('HTTP_IF_NONE_MATCH')):
+            start_response('304 Not Modified', [('ETag', etag),
+                                                ('Cache-Control',
+                                                 cache_control)])
+            return []
+
+        def caching_start_response(status, headers, exc_info=None):
+            if status.startswith('200'):
+                names = [name.lower() for name, value in headers]
+                headers = list(headers)
+                if 'etag' not in names:
+                    headers.append(('ETag', etag))
+                if 'cache-control' not in names:
+                    headers.append(('Cache-Control', cache_control))
+            if exc_info is None:
+                return start_response(status, headers)
+            return start_response(status, headers, exc_info)
+
+        return self.app(environ, caching_start_response)
+
+
+def make_filter(app, global_conf, versions, max_age='300', check='5',
+                private='false'):
+    """
+    Paste entry point of the conditional filter.
+    """
+    return ConditionalMiddleware(app, versions, int(max_age), int(check),
+                                 private.lower() in ('true', 'yes', 'on', '1'))
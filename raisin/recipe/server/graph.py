@@ -0,0 +1,139 @@
+"""
+Run tasks depending on each other, running the independent ones at the
+same time on a pool of threads.
+"""
+
+import sys
+import Queue
+import threading
+
+
+def run_task(name, function, results):
+    """
+    Run a task, putting its name and the exception it raised, if any, on
+    the results queue.
+    """
+    try:
+        function()
+    except Exception:  # pylint: disable=W0703
+        results.put((name, sys.exc_info()))
+    else:
+        results.put((name, None))
+
+
+def work(tasks, results):
+    """
+    Run the tasks put on the tasks queue until getting None.
+    """
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        run_task(task[0], task[1], results)
+
+
+def run_graph(graph, jobs=1):
+    """
+    Run every task of a graph as soon as the tasks it requires are done,
+    with at most jobs tasks running at the same time.
+
+    The graph is a dictionary mapping the name of each task to the list of
+    names of the tasks it requires and the function running it. The first
+    exception raised by a task is raised again once the running tasks are
+    finished, and no other task is started after it.
+    """
+    for name, (requires, function) in graph.items():
+        for required in requires:
+            if required not in graph:
+                raise KeyError('%s requires unknown task %s' % (name,
+                                                                 required))
+    pending = dict(graph)
+    done = set()
+    tasks = Queue.Queue()
+    results = Queue.Queue()
+    workers = []
+    if jobs > 1:
+        for _ in range(min(jobs, len(graph))):
+            worker = threading.Thread(target=work, args=(tasks, results))
+            worker.setDaemon(True)
+            worker.start()
+            workers.append(worker)
+    running = 0
+    error = None
+    try:
+        while pending or running:
+            if error is None:
+                ready = [name for name, (requires, function)
+                         in pending.items()
+                         if done.issuperset(requires)]
+                ready.sort()
+                if not workers:
+                    # Without threads, run one task at a time so that none
+                    # is started after an error
+                    ready = ready[:1]
+                for name in ready:
+                    requires, function = pending.pop(name)
+                    if workers:
+                        tasks.put((name, function))
+                    else:
+                        run_task(name, function, results)
+                    running += 1
+            if not running:
+                if error is None:
+                    raise ValueError('Circular requirements between: %s' %
+                                     ', '.join(sorted(pending.keys())))
+                break
+            name, exc_info = results.get()
+            running -= 1
+            if exc_info is not None and error is None:
+                error = exc_info
+            done.add(name)
+    finally:
+        for worker in workers:
+            tasks.put(None)
+        for worker in workers:
+            worker.join()
+    if error is not None:
+        raise error[0], error[1], error[2]
+
+
+def map_threads(function, items, jobs=1):
+    """
+    Return the list of the results of calling the function on every item,
+    with at most jobs calls running at the same time.
+
+    The first exception raised by a call is raised again once the running
+    calls are finished, and no other call is started after it.
+    """
+    items = list(items)
+    if jobs <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    results = [None] * len(items)
+    errors = []
+    tasks = Queue.Queue()
+    for task in enumerate(items):
+        tasks.put(task)
+
+    def work():
+        """Call the function on the items left, until an error."""
+        while not errors:
+            try:
+                index, item = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[index] = function(item)
+            except Exception:  # pylint: disable=W0703
+                errors.append(sys.exc_info())
+
+    workers = []
+    for _ in range(min(jobs, len(items))):
+        worker = threading.Thread(target=work)
+        worker.setDaemon(True)
+        worker.start()
+        workers.append(worker)
+    for worker in workers:
+        worker.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return results
@@ -0,0 +1,146 @@
+"""
+Index the files available for download for each project, so that the
+servers can list them without walking the download folders.
+"""
+
+import os
+import json
+import hashlib
+import logging
+from raisin.recipe.server.graph import map_threads
+from raisin.recipe.server.output import read_file
+from raisin.recipe.server.output import write_file
+
+logger = logging.getLogger('raisin.recipe.server.index')
+
+# Where the indexes are written, relative to the buildout directory
+INDEX = 'etc/projects/downloads'
+
+
+def checksum(path, algorithm):
+    """
+    Return the hex digest of the content of a file.
+    """
+    digest = hashlib.new(algorithm)
+    content = open(path, 'rb')
+    try:
+        while True:
+            chunk = content.read(1024 * 1024)
+            if not chunk:
+                break
+            digest.update(chunk)
+    finally:
+        content.close()
+    return digest.hexdigest()
+
+
+def list_files(folder):
+    """
+    Return a sorted list of tuples containing the path relative to the
+    folder, the size and the modification time of every file below it.
+    """
+    files = []
+    for root, _, names in os.walk(folder):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Broken link, or removed in the meantime
+                continue
+            files.append((os.path.relpath(path, folder),
+                          stat.st_size,
+                          stat.st_mtime))
+    files.sort()
+    return files
+
+
+def read_index(path):
+    """
+    Return the files of an existing index by relative path, or an empty
+    dictionary if there is none.
+    """
+    content = read_file(path)
+    if content is None:
+        return {}
+    try:
+        index = json.loads(content)
+    except ValueError:
+        logger.info('Ignoring unreadable index: %s' % path)
+        return {}
+    files = {}
+    for relative_path, size, mtime, algorithm, digest in index['files']:
+        files[relative_path] = (size, mtime, algorithm, digest)
+    return files
+
+
+def index_project(index_path, project, folder, url, algorithm, jobs):
+    """
+    Write the index of the files of a project.
+
+    The checksums of the files whose size and modification time are the
+    same as in the previous index are kept, and only the others are read,
+    on at most jobs threads.
+    """
+    previous = read_index(index_path)
+    files = list_files(folder)
+    changed = []
+    checksums = {}
+    for relative_path, size, mtime in files:
+        known = previous.get(relative_path)
+        if known and known[0] == size and known[1] == mtime \
+           and known[2] == algorithm:
+            checksums[relative_path] = known[3]
+        else:
+            changed.append(relative_path)
+    digests = map_threads(lambda p: checksum(os.path.join(folder, p),
+                                             algorithm),
+                          changed,
+                          jobs)
+    checksums.update(zip(changed, digests))
+    if changed:
+        logger.info('Checksummed %s files for project %s' % (len(changed),
+                                                            project))
+    index = {'project': project,
+             'path': folder,
+             'url': url,
+             'files': [(relative_path, size, mtime, algorithm,
+                        checksums[relative_path])
+                       for relative_path, size, mtime in files]}
+    write_file(index_path, json.dumps(index, sort_keys=True,
+                                      separators=(',', ':')))
+
+
+def download_index(buildout_directory, project_downloads, algorithm='md5',
+                   jobs=8):
+    """
+    Write the index of the files available for download of every project
+    next to downloads.ini:
+
+    etc/projects/downloads/Test.json
+
+    Like this:
+
+    {"files": [["bam/sample.bam", 1024, 1352419200.0, "md5", "0123..."]],
+     "path": "/downloads/Test", "project": "Test",
+     "url": "http://localhost/downloads/Test/"}
+
+    The index of a project whose download folder is missing is kept as it
+    is, and the indexes of projects without downloads are removed.
+    """
+    folder = os.path.join(buildout_directory, INDEX)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    indexed = set()
+    for project, path, url, db, commondb in project_downloads:
+        index_path = os.path.join(folder, '%s.json' % project)
+        indexed.add(os.path.basename(index_path))
+        if not os.path.isdir(path):
+            logger.warning('Keeping the index of project %s, its download '
+                           'folder is missing: %s' % (project, path))
+            continue
+        index_project(index_path, project, path, url, algorithm, jobs)
+    for name in os.listdir(folder):
+        if name.endswith('.json') and name not in indexed:
+            logger.info('Removing index: %s' % name)
+            os.remove(os.path.join(folder, name))
@@ -0,0 +1,113 @@
+"""
+Logging handlers used by the servers in production.
+"""
+
+import Queue
+import random
+import logging
+import threading
+import logging.handlers
+
+
+class QueueHandler(logging.handlers.MemoryHandler):
+    """
+    Queue the records, and write them to the target handler from a thread
+    of its own, as soon as they come, so that the requests never wait on
+    the log files.
+
+    When capacity records are waiting, the records below the flush level
+    are dropped, and a warning tells how many once the queue is written.
+    The other records wait for room in the queue.
+
+    It is a memory handler only so that logging.config gives it a target.
+    """
+
+    def __init__(self, capacity, flushLevel=logging.ERROR, target=None):
+        logging.handlers.MemoryHandler.__init__(self, capacity, flushLevel,
+                                                target)
+        self.queue = Queue.Queue(capacity)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.listen)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def emit(self, record):
+        if record.levelno >= self.flushLevel:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+
+    def listen(self):
+        """
+        Write the records queued to the target, until given None.
+        """
+        while True:
+            records = [self.queue.get()]
+            try:
+                while True:
+                    records.append(self.queue.get_nowait())
+            except Queue.Empty:
+                pass
+            try:
+                self.write([record for record in records
+                            if record is not None])
+            finally:
+                for record in records:
+                    self.queue.task_done()
+            if None in records:
+                return
+
+    def write(self, records):
+        """
+        Write records to the target, with a warning about the records
+        dropped since the last ones, if any.
+        """
+        target = self.target
+        if target is None:
+            return
+        dropped = self.dropped
+        if dropped:
+            self.dropped -= dropped
+            records.append(logging.LogRecord(
+                'raisin.recipe.server.logs', logging.WARNING, __file__, 0,
+                'Dropped %s records, the log was too busy', (dropped,), None))
+        for record in records:
+            target.handle(record)
+        target.flush()
+
+    def flush(self):
+        """
+        Wait for the records queued to be written.
+        """
+        if self.thread.isAlive():
+            self.queue.join()
+
+    def close(self):
+        """
+        Write the records queued, and stop the thread writing them.
+        """
+        if self.thread.isAlive():
+            self.queue.put(None)
+            self.thread.join(5)
+        logging.handlers.MemoryHandler.close(self)
+
+
+class SamplingHandler(QueueHandler):
+    """
+    Queue a random sample of the records, and write them to the target
+    handler, so that busy servers do not wait on their access log.
+
+    Errors are always kept.
+    """
+
+    def __init__(self, capacity, rate, flushLevel=logging.ERROR, target=None):
+        QueueHandler.__init__(self, capacity, flushLevel, target)
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno < self.flushLevel and random.random() >= self.rate:
+            return 0
+        return QueueHandler.filter(self, record)
@@ -0,0 +1,146 @@
+"""
+Keep track of the inputs and outputs of the configuration generators, so
+that an update only runs the generators whose inputs or outputs changed.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import pkg_resources
+from raisin.recipe.server.output import write_file
+
+logger = logging.getLogger('raisin.recipe.server.manifest')
+
+# Where the manifest is stored, relative to the buildout directory
+MANIFEST = 'var/raisin.recipe.server/manifest.json'
+
+try:
+    VERSION = pkg_resources.get_distribution('raisin.recipe.server').version
+except pkg_resources.DistributionNotFound:
+    VERSION = None
+
+
+def file_digest(path):
+    """
+    Return the SHA1 hex digest of the content of a file, an empty string
+    for a directory, and None if the path does not exist.
+    """
+    if os.path.isdir(path):
+        return ''
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha1()
+    content = open(path, 'rb')
+    try:
+        while True:
+            chunk = content.read(1024 * 1024)
+            if not chunk:
+                break
+            digest.update(chunk)
+    finally:
+        content.close()
+    return digest.hexdigest()
+
+
+def section_digest(section):
+    """
+    Return the SHA1 hex digest of the options of a buildout section, or
+    None if the section is missing.
+    """
+    if section is None:
+        return None
+    items = list(section.items())
+    items.sort()
+    return hashlib.sha1(json.dumps(items)).hexdigest()
+
+
+class Manifest(object):
+    """
+    The digests of the inputs and outputs of every generator at the time it
+    was last run.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data = self.load()
+
+    def load(self):
+        """
+        Read the manifest, starting afresh if it is missing, unreadable or
+        was written by another version of the recipe.
+        """
+        empty = {'version': VERSION, 'files': {}, 'generators': {}}
+        if not os.path.exists(self.path):
+            return empty
+        try:
+            data = json.load(open(self.path, 'r'))
+        except ValueError:
+            logger.info('Ignoring unreadable manifest: %s' % self.path)
+            return empty
+        if data.get('version') != VERSION:
+            return empty
+        return data
+
+    def save(self):
+        """
+        Write the manifest.
+        """
+        write_file(self.path, json.dumps(self.data, indent=1, sort_keys=True))
+
+    def fingerprint(self, path):
+        """
+        Return the digest of a large input file, only reading its content
+        again when its size or modification time changed.
+        """
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        known = self.data['files'].get(path)
+        if known and known['size'] == stat.st_size \
+           and known['mtime'] == stat.st_mtime:
+            return known['digest']
+        digest = file_digest(path)
+        self.data['files'][path] = {'size': stat.st_size,
+                                    'mtime': stat.st_mtime,
+                                    'digest': digest}
+        return digest
+
+    def is_current(self, name, key, paths):
+        """
+        Check whether a generator was last run with the same inputs, and
+        its output files are still as it left them.
+        """
+        generator = self.data['generators'].get(name)
+        if generator is None or generator['inputs'] != key:
+            return False
+        outputs = generator['outputs']
+        for path in paths:
+            if path not in outputs or outputs[path] != file_digest(path):
+                return False
+        return True
+
+    def outputs(self, name):
+        """
+        Return the output files of a generator when it was last run.
+        """
+        generator = self.data['generators'].get(name)
+        if generator is None:
+            return []
+        return generator['outputs'].keys()
+
+    def record(self, name, key, paths):
+        """
+        Remember the inputs and the outputs of a generator that was run.
+        """
+        outputs = {}
+        for path in paths:
+            outputs[path] = file_digest(path)
+        self.data['generators'][name] = {'inputs': key, 'outputs': outputs}
+
+
+def inputs_key(digests):
+    """
+    Combine the digests of the inputs of a generator into a single key.
+    """
+    return hashlib.sha1(json.dumps([VERSION, digests])).hexdigest()
@@ -0,0 +1,384 @@
+"""
+Measure the requests of the servers in production: the number of requests
+and their latency by route, project and status, the requests in flight,
+the share of the threads of the worker they use, and the hits of the
+response cache.
+
+The metrics of a worker are either served on a local admin port, at
+http://127.0.0.1:<port of the worker + offset>/metrics, or pushed to a
+statsd server over UDP.
+"""
+
+import os
+import time
+import socket
+import logging
+import threading
+import ConfigParser
+import BaseHTTPServer
+from raisin.recipe.server.middleware import ClosingIterator
+
+logger = logging.getLogger('raisin.recipe.server.metrics')
+
+# The upper bounds of the latency buckets, in milliseconds
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# The label of the requests outside the projects of projects.ini
+NO_PROJECT = '_'
+
+# The first parts of the paths labelled as routes of their own, besides
+# project, unless the routes setting says otherwise
+ROUTES = ('static',)
+
+# The label of the requests outside the known routes
+OTHER_ROUTE = '/:other'
+
+# The most parts of a path after the project labelled apart
+MAX_PARTS = 3
+
+# The largest UDP packet pushed to statsd
+PACKET_SIZE = 1432
+
+
+def read_projects(path):
+    """
+    Return the set of the projects of projects.ini.
+    """
+    parser = ConfigParser.RawConfigParser()
+    parser.optionxform = str
+    parser.read([path])
+    return set(parser.sections())
+
+
+def get_labels(path, projects, routes=ROUTES):
+    """
+    Return the route and the project of the path of a request.
+
+    The route keeps the first part of the path when it is one of the known
+    routes, replacing the project and the parts after it, so that whatever
+    the paths requested, there are few routes. Projects not in projects.ini
+    are not labelled.
+    """
+    parts = [part for part in path.split('/') if part]
+    if not parts:
+        return '/', NO_PROJECT
+    if parts[0] != 'project' or len(parts) < 2:
+        if parts[0] in routes or parts == ['project']:
+            return '/%s' % parts[0], NO_PROJECT
+        return OTHER_ROUTE, NO_PROJECT
+    project = parts[1]
+    if project not in projects:
+        project = NO_PROJECT
+    return '/project/:project' + '/:part' * min(len(parts) - 2,
+                                                MAX_PARTS), project
+
+
+class Metrics(object):
+    """
+    The counters, latency histograms and gauges of a worker.
+    """
+
+    def __init__(self, threads, buckets=BUCKETS):
+        self.threads = threads
+        self.buckets = tuple(buckets)
+        self.requests = {}
+        self.histograms = {}
+        self.cache = {}
+        self.in_flight = 0
+        self.busy = 0.0
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def begin(self):
+        """
+        Count a request in flight.
+        """
+        self.lock.acquire()
+        try:
+            self.in_flight += 1
+        finally:
+            self.lock.release()
+
+    def end(self, route, project, status, seconds, cache=None):
+        """
+        Record a request once answered.
+        """
+        milliseconds = seconds * 1000
+        self.lock.acquire()
+        try:
+            self.in_flight -= 1
+            self.busy += seconds
+            key = (route, project, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            key = (route, project)
+            if key not in self.histograms:
+                self.histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            histogram = self.histograms[key]
+            for index, bound in enumerate(self.buckets):
+                if milliseconds <= bound:
+                    break
+            else:
+                index = len(self.buckets)
+            histogram[index] += 1
+            histogram[-1] += milliseconds
+            if cache is not None:
+                key = (project, cache)
+                self.cache[key] = self.cache.get(key, 0) + 1
+        finally:
+            self.lock.release()
+
+    def utilisation(self, now=None):
+        """
+        Return the share of the time of the threads spent on requests since
+        the worker started.
+        """
+        if now is None:
+            now = time.time()
+        elapsed = max(now - self.started, 1e-6)
+        return min(1.0, self.busy / (elapsed * self.threads))
+
+    def text(self, service):
+        """
+        Return the metrics in the text format of Prometheus, the latency
+        buckets being cumulative.
+        """
+        self.lock.acquire()
+        try:
+            lines = []
+            lines.append('# TYPE raisin_requests_total counter')
+            for (route, project, status), count in sorted(
+                    self.requests.items()):
+                lines.append('raisin_requests_total{service="%s",route="%s",'
+                             'project="%s",status="%s"} %s' % (
+                                 service, route, project, status, count))
+            lines.append('# TYPE raisin_request_milliseconds histogram')
+            for (route, project), histogram in sorted(
+                    self.histograms.items()):
+                labels = 'service="%s",route="%s",project="%s"' % (
+                    service, route, project)
+                total = 0
+                for bound, count in zip(self.buckets + ('+Inf',),
+                                        histogram[:-1]):
+                    total += count
+                    lines.append('raisin_request_milliseconds_bucket{%s,'
+                                 'le="%s"} %s' % (labels, bound, total))
+                lines.append('raisin_request_milliseconds_sum{%s} %.3f' % (
+                    labels, histogram[-1]))
+                lines.append('raisin_request_milliseconds_count{%s} %s' % (
+                    labels, total))
+            lines.append('# TYPE raisin_cache_responses_total counter')
+            for (project, cache), count in sorted(self.cache.items()):
+                lines.append('raisin_cache_responses_total{service="%s",'
+                             'project="%s",cache="%s"} %s' % (
+                                 service, project, cache, count))
+            lines.append('# TYPE raisin_in_flight gauge')
+            lines.append('raisin_in_flight{service="%s"} %s' % (
+                service, self.in_flight))
+            lines.append('# TYPE raisin_utilisation gauge')
+            lines.append('raisin_utilisation{service="%s"} %.4f' % (
+                service, self.utilisation()))
+            return '\n'.join(lines) + '\n'
+        finally:
+            self.lock.release()
+
+
+class StatsdClient(object):
+    """
+    Push metrics to statsd over UDP, several to a packet, never waiting for
+    the server nor failing when it is down.
+    """
+
+    def __init__(self, host, port, prefix):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.lines = []
+        self.lock = threading.Lock()
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(0)
+
+    def add(self, name, value, kind):
+        """
+        Add a metric to the next packets, like requests.Test:1|c.
+        """
+        line = '%s.%s:%s|%s' % (self.prefix, name, value, kind)
+        self.lock.acquire()
+        try:
+            self.lines.append(line)
+        finally:
+            self.lock.release()
+
+    def flush(self):
+        """
+        Send the metrics added, and return the number of packets sent.
+        """
+        self.lock.acquire()
+        try:
+            lines = self.lines
+            self.lines = []
+        finally:
+            self.lock.release()
+        packets = []
+        packet = []
+        size = 0
+        for line in lines:
+            if packet and size + len(line) + 1 > PACKET_SIZE:
+                packets.append('\n'.join(packet))
+                packet = []
+                size = 0
+            packet.append(line)
+            size += len(line) + 1
+        if packet:
+            packets.append('\n'.join(packet))
+        for packet in packets:
+            try:
+                self.socket.sendto(packet, self.address)
+            except socket.error, error:
+                logger.debug('Could not push metrics: %s' % error)
+        return len(packets)
+
+
+def statsd_name(value):
+    """
+    Return a value usable in the name of a statsd metric.
+    """
+    for char in '.:|@/ ':
+        value = value.replace(char, '_')
+    return value.strip('_') or NO_PROJECT
+
+
+class MetricsMiddleware(object):
+    """
+    Measure every request, and push the metrics to statsd now and then when
+    given a client.
+
+    The body of the responses is streamed, and a request is only measured
+    once the server closed its response.
+    """
+
+    def __init__(self, app, metrics, projects, service, statsd=None,
+                 interval=10, routes=ROUTES):
+        self.app = app
+        self.routes = tuple(routes)
+        self.metrics = metrics
+        self.projects = projects
+        self.service = service
+        self.statsd = statsd
+        self.interval = interval
+        self.pushed = time.time()
+
+    def __call__(self, environ, start_response):
+        route, project = get_labels(environ.get('PATH_INFO', ''),
+                                    self.projects, self.routes)
+        response = {}
+
+        def measured_start_response(status, headers, exc_info=None):
+            response['status'] = status.split(' ', 1)[0]
+            for name, value in headers:
+                if name.lower() == 'x-cache':
+                    response['cache'] = value.split()[0].lower()
+            if exc_info is None:
+                return start_response(status, headers)
+            return start_response(status, headers, exc_info)
+
+        start = time.time()
+
+        def measure(failed):
+            """Record the request, its body being sent or not."""
+            if failed:
+                response['status'] = '500'
+            seconds = time.time() - start
+            self.metrics.end(route, project, response.get('status', '500'),
+                             seconds, response.get('cache'))
+            if self.statsd is not None:
+                self.push(route, project, response, seconds)
+
+        self.metrics.begin()
+        try:
+            result = self.app(environ, measured_start_response)
+        except Exception:
+            measure(True)
+            raise
+        return ClosingIterator(result, measure)
+
+    def push(self, route, project, response, seconds):
+        """
+        Add the metrics of a request to the next packets to statsd, sending
+        them when the interval elapsed.
+        """
+        name = '%s.%s' % (statsd_name(route), statsd_name(project))
+        self.statsd.add('requests.%s.%s' % (name,
+                                            response.get('status', '500')),
+                        1, 'c')
+        self.statsd.add('latency.%s' % name, int(seconds * 1000), 'ms')
+        if 'cache' in response:
+            self.statsd.add('cache.%s.%s' % (statsd_name(project),
+                                             statsd_name(response['cache'])),
+                            1, 'c')
+        now = time.time()
+        if now - self.pushed >= self.interval:
+            self.pushed = now
+            self.statsd.add('in_flight', self.metrics.in_flight, 'g')
+            self.statsd.add('utilisation',
+                            int(self.metrics.utilisation(now) * 100), 'g')
+            self.statsd.flush()
+
+
+def serve_metrics(metrics, service, port, host='127.0.0.1'):
+    """
+    Serve the metrics of the worker at /metrics on an admin port, from a
+    daemon thread.
+    """
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        """Answer the metrics."""
+
+        def do_GET(self):  # pylint: disable=C0103
+            """Answer a request."""
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            text = metrics.text(service)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(text)))
+            self.end_headers()
+            self.wfile.write(text)
+
+        def log_message(self, *args):
+            """Do not log the requests."""
+
+    server = BaseHTTPServer.HTTPServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    return server
+
+
+def make_filter(app, global_conf, projects, export='admin', threads='4',
+                port_offset='1000', statsd='127.0.0.1:8125', interval='10',
+                buckets='', routes=None):
+    """
+    Paste entry point of the metrics filter, labelling the metrics with the
+    supervisord program of the worker.
+
+    The admin port is the port of the worker, given in the http_port
+    variable, plus the offset.
+    """
+    service = os.environ.get('SUPERVISOR_GROUP_NAME', 'server')
+    metrics = Metrics(int(threads), [int(bucket) for bucket in
+                                     buckets.split()] or BUCKETS)
+    client = None
+    if export == 'statsd':
+        host, port = statsd.rsplit(':', 1)
+        client = StatsdClient(host, int(port), 'raisin.%s' % service)
+    elif export == 'admin':
+        port = int(global_conf['http_port']) + int(port_offset)
+        serve_metrics(metrics, service, port)
+    else:
+        raise ValueError('Unknown metrics export: %s' % export)
+    if routes is None:
+        routes = ROUTES
+    else:
+        routes = routes.split()
+    return MetricsMiddleware(app, metrics, read_projects(projects), service,
+                             client, int(interval), routes)
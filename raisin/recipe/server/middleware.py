@@ -0,0 +1,43 @@
+"""
+Helpers shared by the WSGI filters of the servers.
+"""
+
+
+class ClosingIterator(object):
+    """
+    Stream the body of a response, calling back once the server closed it,
+    with True if producing the body failed.
+
+    The chunks are taken from the iterable when given, or else from the
+    response itself, which is closed in any case.
+    """
+
+    def __init__(self, result, callback, iterable=None):
+        self.result = result
+        self.callback = callback
+        if iterable is None:
+            iterable = result
+        self.iterable = iterable
+        self.failed = False
+        self.closed = False
+
+    def __iter__(self):
+        try:
+            for chunk in self.iterable:
+                yield chunk
+        except Exception:
+            self.failed = True
+            raise
+
+    def close(self):
+        """
+        Close the response, then call back, only once.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if hasattr(self.result, 'close'):
+                self.result.close()
+        finally:
+            self.callback(self.failed)
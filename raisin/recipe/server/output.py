@@ -0,0 +1,110 @@
+"""
+Write the generated files atomically, and only when their content changed.
+"""
+
+import os
+import shutil
+import logging
+import threading
+from raisin.recipe.server.report import count
+
+logger = logging.getLogger('raisin.recipe.server.output')
+
+# The paths written since track_changes was called, if tracking
+changes = None
+changes_lock = threading.Lock()
+
+
+def track_changes():
+    """
+    Start recording the paths of the files written.
+    """
+    global changes  # pylint: disable=W0603
+    changes = set()
+
+
+def stop_tracking():
+    """
+    Stop recording the paths of the files written, and return them.
+    """
+    global changes  # pylint: disable=W0603
+    changes_lock.acquire()
+    try:
+        written, changes = changes or set(), None
+    finally:
+        changes_lock.release()
+    return written
+
+
+def read_file(path):
+    """
+    Return the content of a file, or None if it does not exist.
+    """
+    if not os.path.isfile(path):
+        return None
+    existing = open(path, 'rb')
+    try:
+        return existing.read()
+    finally:
+        existing.close()
+
+
+def is_identical(path, content):
+    """
+    Check whether a file already has the given content.
+    """
+    if not os.path.isfile(path) or os.path.getsize(path) != len(content):
+        return False
+    return read_file(path) == content
+
+
+def write_file(path, content):
+    """
+    Write the content rendered in memory to a file.
+
+    Nothing is written when the file already has this content, so that its
+    modification time only changes along with the content. Otherwise the
+    content goes to a temporary file in the same folder that is renamed
+    over the old file, so readers never see a partially written file.
+
+    Return True if the file was written.
+    """
+    count('files')
+    if is_identical(path, content):
+        logger.info('Unchanged: %s' % path)
+        return False
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        try:
+            os.makedirs(folder)
+        except OSError:
+            # Another generator may have made it in the meantime
+            if not os.path.isdir(folder):
+                raise
+    temporary = os.path.join(folder, '.%s.%s.tmp' % (os.path.basename(path),
+                                                     os.getpid()))
+    try:
+        output = open(temporary, 'wb')
+        try:
+            output.write(content)
+            output.flush()
+            os.fsync(output.fileno())
+        finally:
+            output.close()
+        if os.path.exists(path):
+            shutil.copymode(path, temporary)
+        os.rename(temporary, path)
+    except Exception:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    count('written')
+    count('bytes', len(content))
+    changes_lock.acquire()
+    try:
+        if changes is not None:
+            changes.add(path)
+    finally:
+        changes_lock.release()
+    logger.info('Writing: %s' % path)
+    return True
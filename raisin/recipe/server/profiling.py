@@ -0,0 +1,150 @@
+"""
+Profile a sample of the requests of the servers in production, to find out
+why a resource got slow without reproducing its load elsewhere.
+
+The profiles of the requests are added up, and dumped now and then to
+var/profiles/<process>-<time>-<number>.prof, keeping the most recent files
+only. Read them with:
+
+  $ python -m pstats var/profiles/restish_00-20121109-120000.000-000001.prof
+"""
+
+import os
+import time
+import random
+import pstats
+import atexit
+import logging
+import cProfile
+import threading
+from raisin.recipe.server.middleware import ClosingIterator
+
+logger = logging.getLogger('raisin.recipe.server.profiling')
+
+
+class ProfilingMiddleware(object):
+    """
+    Profile the requests whose path starts with one of the prefixes, and a
+    random share of the others given by the rate.
+    """
+
+    def __init__(self, app, folder, name, rate=0.01, prefixes=(),
+                 interval=60, keep=24):
+        self.app = app
+        self.folder = folder
+        self.name = name
+        self.rate = rate
+        self.prefixes = tuple(prefixes)
+        self.interval = interval
+        self.keep = keep
+        self.stats = None
+        self.requests = 0
+        self.dumps = 0
+        self.dumped = time.time()
+        self.lock = threading.Lock()
+
+    def sampled(self, environ):
+        """
+        Return True if a request is to be profiled.
+        """
+        path = environ.get('PATH_INFO', '')
+        if self.prefixes and path.startswith(self.prefixes):
+            return True
+        return random.random() < self.rate
+
+    def __call__(self, environ, start_response):
+        if not self.sampled(environ):
+            return self.app(environ, start_response)
+        profile = cProfile.Profile()
+        try:
+            result = profile.runcall(self.app, environ, start_response)
+        except Exception:
+            self.add(profile)
+            raise
+        return ClosingIterator(result, lambda failed: self.add(profile),
+                               profiled(profile, result))
+
+    def add(self, profile):
+        """
+        Add the profile of a request to the others, dumping them all when
+        the interval elapsed.
+        """
+        self.lock.acquire()
+        try:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+            self.requests += 1
+            if time.time() - self.dumped >= self.interval:
+                self.dump()
+        finally:
+            self.lock.release()
+
+    def dump(self):
+        """
+        Dump the profiles added since the last dump, and remove the oldest
+        dumps of this process beyond the ones to keep.
+        """
+        self.dumped = time.time()
+        if self.stats is None:
+            return None
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        # The number keeps apart the dumps made within a millisecond
+        self.dumps += 1
+        path = os.path.join(self.folder, '%s-%s.%03d-%06d.prof' % (
+            self.name, time.strftime('%Y%m%d-%H%M%S',
+                                     time.localtime(self.dumped)),
+            self.dumped * 1000 % 1000, self.dumps))
+        self.stats.dump_stats(path)
+        logger.info('Dumped the profiles of %s requests to %s' % (
+            self.requests, path))
+        self.stats = None
+        self.requests = 0
+        dumps = [name for name in os.listdir(self.folder)
+                 if name.startswith(self.name + '-') and
+                 name.endswith('.prof')]
+        dumps.sort()
+        for name in dumps[:max(0, len(dumps) - self.keep)]:
+            os.remove(os.path.join(self.folder, name))
+        return path
+
+    def close(self):
+        """
+        Dump the profiles left.
+        """
+        self.lock.acquire()
+        try:
+            self.dump()
+        finally:
+            self.lock.release()
+
+
+def profiled(profile, result):
+    """
+    Yield the chunks of the body of a response, profiling the code that
+    produces them, but not the server sending them.
+    """
+    chunks = iter(result)
+    while True:
+        try:
+            chunk = profile.runcall(chunks.next)
+        except StopIteration:
+            return
+        yield chunk
+
+
+def make_filter(app, global_conf, folder, name=None, rate='0.01',
+                prefixes='', interval='60', keep='24'):
+    """
+    Paste entry point of the profiling filter, named after the supervisord
+    process of the worker unless given a name.
+    """
+    if name is None:
+        name = os.environ.get('SUPERVISOR_PROCESS_NAME', 'server')
+    middleware = ProfilingMiddleware(app, folder, name, float(rate),
+                                     prefixes.split(), int(interval),
+                                     int(keep))
+    atexit.register(middleware.close)
+    return middleware
@@ -0,0 +1,199 @@
+"""
+Reload only the services whose configuration files changed, through the
+XML-RPC interface of supervisord, without stopping all their workers at
+once.
+"""
+
+import os
+import re
+import time
+import socket
+import fnmatch
+import logging
+import xmlrpclib
+
+logger = logging.getLogger('raisin.recipe.server.reload')
+
+# The XML-RPC interface of supervisord, unless the supervisor-url option of
+# the server part says otherwise
+SUPERVISOR_URL = 'http://127.0.0.1:9001'
+
+# The services reading the files below each path, relative to the buildout
+# directory, the first matching path winning. The shared services are
+# restish and pyramid, and the services of the groups of projects match
+# restish_* and pyramid_*
+SERVICE_PATHS = (('etc/restish/warm.json', ()),
+                 ('etc/projects/versions.ini', ()),
+                 ('etc/restish/raisin.restish/public/', ()),
+                 ('etc/databases/indexes/', ()),
+                 ('etc/bundle.json', ('pyramid', 'pyramid_*',
+                                      'restish', 'restish_*')),
+                 ('etc/pyramid/production.ini', ('pyramid',)),
+                 ('etc/pyramid/projects.ini', ('pyramid',)),
+                 ('etc/pyramid/', ('pyramid', 'pyramid_*')),
+                 ('etc/restish/production.ini', ('restish',)),
+                 ('etc/restish/', ('restish', 'restish_*')),
+                 ('etc/connections/', ('restish', 'restish_*')),
+                 ('etc/databases/databases.ini', ('restish',)),
+                 ('etc/projects/projects.ini', ('pyramid', 'pyramid_*',
+                                                'restish', 'restish_*')),
+                 ('etc/projects/', ('restish', 'restish_*')),
+                 ('etc/misc/', ('restish', 'restish_*')))
+
+# The files only read by the services of a group of projects
+GROUP_PATHS = (re.compile(r'^etc/groups/([^/]+)/'),
+               re.compile(r'^etc/(?:restish|pyramid)/production-(.+)\.ini$'))
+
+# The files of the programs this recipe cannot reload itself
+MANUAL_PATHS = ('etc/supervisor/', 'etc/nginx/', 'etc/haproxy/')
+
+# The seconds a restarted worker has to accept connections before the next
+# one is restarted
+READY_TIMEOUT = 30
+
+# The ways of reloading a service: restarting its workers one after the
+# other. The servers have no hang up handler, so signalling them would stop
+# them all at once.
+MODES = ('rolling',)
+
+
+def check_mode(mode):
+    """
+    Check that a service can be reloaded in the given way.
+    """
+    if mode not in MODES:
+        raise ValueError('The reload option must be one of %s: %s' % (
+            ', '.join(MODES), mode))
+
+
+def get_group(relative):
+    """
+    Return the group of projects whose services alone read a file, if any.
+    """
+    for pattern in GROUP_PATHS:
+        match = pattern.match(relative)
+        if match:
+            return match.group(1)
+    return None
+
+
+def get_services(buildout_directory, paths):
+    """
+    Return the sorted list of the patterns of the services reading any of
+    the given files.
+
+    The files of a group of projects are only read by the services of the
+    group, like restish_group1.
+    """
+    services = set()
+    for path in paths:
+        relative = os.path.relpath(path, buildout_directory)
+        group = get_group(relative)
+        if group is not None:
+            services.update(['pyramid_%s' % group, 'restish_%s' % group])
+            continue
+        for prefix, names in SERVICE_PATHS:
+            if relative == prefix or \
+               (prefix.endswith('/') and relative.startswith(prefix)):
+                services.update(names)
+                break
+    services = list(services)
+    services.sort()
+    return services
+
+
+def get_workers(infos, service):
+    """
+    Return the sorted names of the running processes of a service, given
+    the information supervisord has about every process.
+    """
+    workers = []
+    for info in infos:
+        if info['group'] == service and info['statename'] == 'RUNNING':
+            workers.append('%s:%s' % (info['group'], info['name']))
+    workers.sort()
+    return workers
+
+
+def wait_ready(worker, timeout=READY_TIMEOUT, host='127.0.0.1'):
+    """
+    Wait for a worker, named after its port like restish:restish_6465, to
+    accept connections. Return False if it still does not after the
+    timeout.
+    """
+    match = re.search(r'_(\d+)$', worker)
+    if match is None or not timeout:
+        return True
+    deadline = time.time() + timeout
+    while True:
+        try:
+            connection = socket.create_connection((host,
+                                                   int(match.group(1))), 1)
+        except socket.error:
+            if time.time() >= deadline:
+                logger.warning('%s does not accept connections after %s '
+                               'seconds' % (worker, timeout))
+                return False
+            time.sleep(0.1)
+        else:
+            connection.close()
+            return True
+
+
+def reload_service(supervisor, infos, service, mode, timeout=READY_TIMEOUT):
+    """
+    Reload the running workers of a service, in the given mode. Each worker
+    is only stopped once the previous one accepts connections again, so
+    that the proxy always has workers to send the requests to.
+
+    The restart is not graceful: the requests a worker is answering when it
+    is stopped fail.
+    """
+    check_mode(mode)
+    workers = get_workers(infos, service)
+    for worker in workers:
+        supervisor.stopProcess(worker, True)
+        supervisor.startProcess(worker, True)
+        wait_ready(worker, timeout)
+    logger.info('Reloaded %s workers of %s' % (len(workers), service))
+    return workers
+
+
+def reload_services(buildout_directory, paths, mode='rolling',
+                    url=SUPERVISOR_URL, proxy=None, timeout=READY_TIMEOUT):
+    """
+    Reload the services reading any of the files written, leaving the other
+    services alone.
+
+    Nothing is done when supervisord is not running. Return the sorted list
+    of the services reloaded.
+    """
+    check_mode(mode)
+    for path in sorted(paths):
+        relative = os.path.relpath(path, buildout_directory)
+        for prefix in MANUAL_PATHS:
+            if relative.startswith(prefix):
+                logger.warning('Changed %s, its program must be reloaded '
+                               'by hand' % relative)
+    services = get_services(buildout_directory, paths)
+    if not services:
+        return []
+    if proxy is None:
+        proxy = xmlrpclib.ServerProxy(url.rstrip('/') + '/RPC2')
+    supervisor = proxy.supervisor
+    try:
+        supervisor.getState()
+    except socket.error:
+        logger.info('Not reloading %s, supervisord is not running at %s' % (
+            ', '.join(services), url))
+        return []
+    infos = supervisor.getAllProcessInfo()
+    names = list(set([info['group'] for info in infos]))
+    names.sort()
+    reloaded = []
+    for name in names:
+        if [pattern for pattern in services
+            if fnmatch.fnmatchcase(name, pattern)]:
+            reload_service(supervisor, infos, name, mode, timeout)
+            reloaded.append(name)
+    return reloaded
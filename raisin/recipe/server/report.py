@@ -0,0 +1,119 @@
+"""
+Measure the wall time, and the files and rows processed, of every stage
+run by server.main.
+"""
+
+import os
+import time
+import json
+import logging
+import threading
+
+logger = logging.getLogger('raisin.recipe.server.report')
+
+# Where the report is written, relative to the buildout directory
+REPORT = 'var/log/server-report.json'
+
+# The stage measured in each thread, if any
+current = threading.local()
+
+
+def count(name, value=1):
+    """
+    Add to a counter of the stage running in the current thread, if it is
+    being measured.
+    """
+    stage = getattr(current, 'stage', None)
+    if stage is not None:
+        stage[name] += value
+
+
+class Report(object):
+    """
+    The measures of the stages run so far.
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def begin(self, name):
+        """
+        Start measuring a stage in the current thread.
+        """
+        current.stage = {'seconds': time.time(),
+                         'files': 0,
+                         'written': 0,
+                         'bytes': 0,
+                         'rows': 0}
+        current.name = name
+
+    def end(self):
+        """
+        Stop measuring the stage of the current thread.
+        """
+        stage = current.stage
+        stage['seconds'] = time.time() - stage['seconds']
+        self.lock.acquire()
+        try:
+            self.stages[current.name] = stage
+        finally:
+            self.lock.release()
+        current.stage = None
+
+    def measure(self, name, function):
+        """
+        Return a function running the given function as a measured stage.
+        """
+        def measured():
+            """Run the function, measuring it."""
+            self.begin(name)
+            try:
+                return function()
+            finally:
+                self.end()
+        return measured
+
+    def summary(self):
+        """
+        Return the measures of every stage and their totals.
+        """
+        totals = {'seconds': time.time() - self.start,
+                  'files': 0,
+                  'written': 0,
+                  'bytes': 0,
+                  'rows': 0}
+        for stage in self.stages.values():
+            for key in ['files', 'written', 'bytes', 'rows']:
+                totals[key] += stage[key]
+        return {'start': self.start, 'stages': self.stages, 'totals': totals}
+
+    def log(self):
+        """
+        Log the measures of the stages, the slowest first.
+        """
+        summary = self.summary()
+        names = self.stages.keys()
+        names.sort(key=lambda n: self.stages[n]['seconds'], reverse=True)
+        line = '%-30s %8.3fs %5d files %5d written %10d bytes %9d rows'
+        for name in names + ['total']:
+            if name == 'total':
+                stage = summary['totals']
+            else:
+                stage = self.stages[name]
+            logger.info(line % (name, stage['seconds'], stage['files'],
+                                stage['written'], stage['bytes'],
+                                stage['rows']))
+
+    def save(self, path):
+        """
+        Write the measures as JSON.
+        """
+        folder = os.path.dirname(path)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        report = open(path, 'w')
+        json.dump(self.summary(), report, indent=1, sort_keys=True)
+        report.close()
+        logger.info('Writing: %s' % path)
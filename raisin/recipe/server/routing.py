@@ -0,0 +1,95 @@
+"""
+Assign the databases of the projects to the MySQL connections, so that
+the statistics queries are spread over several servers and their read
+replicas.
+"""
+
+import bisect
+import hashlib
+
+# The points of each connection on the hash ring
+POINTS = 160
+
+
+def hash_key(key):
+    """
+    Return the position of a key on the hash ring.
+    """
+    return int(hashlib.md5(key).hexdigest()[:8], 16)
+
+
+class HashRing(object):
+    """
+    Consistent hashing of keys to connections, so that adding or removing
+    a connection only moves the keys of its share of the ring.
+    """
+
+    def __init__(self, connections, points=POINTS):
+        self.ring = []
+        for connection in connections:
+            for point in range(points):
+                self.ring.append((hash_key('%s-%s' % (connection, point)),
+                                  connection))
+        self.ring.sort()
+        self.keys = [key for key, connection in self.ring]
+
+    def get(self, key):
+        """
+        Return the connection of a key.
+        """
+        if not self.ring:
+            raise ValueError('No connection to assign %s to' % key)
+        index = bisect.bisect(self.keys, hash_key(key)) % len(self.ring)
+        return self.ring[index][1]
+
+
+def get_connections(section):
+    """
+    Return a dictionary mapping the write connections to the sorted list
+    of their read replicas, from the database_connections section.
+    """
+    connections = {}
+    for connection, replicas in section.items():
+        replicas = replicas.split()
+        replicas.sort()
+        connections[connection] = replicas
+    return connections
+
+
+def get_routes(dbs, connections, projects=None):
+    """
+    Return a dictionary mapping the name of every database stanza of
+    databases.ini, the project_id and the project_id followed by Common, to
+    its write and read connections.
+
+    A stanza is assigned to the connection the projects mapping gives for
+    its name, or else for its project, or else to the connection its name
+    hashes to. Its reads go to one of the replicas of the connection, if
+    any, also chosen by hashing its name.
+    """
+    if projects is None:
+        projects = {}
+    for name, connection in projects.items():
+        if connection not in connections:
+            raise ValueError('Unknown connection for %s: %s' % (name,
+                                                                 connection))
+    writes = HashRing(sorted(connections.keys()))
+    replicas = {}
+    for connection, names in connections.items():
+        if names:
+            replicas[connection] = HashRing(names)
+    routes = {}
+    for project_id, db, commondb in dbs:
+        for name in [project_id, '%sCommon' % project_id]:
+            if name in projects:
+                write = projects[name]
+            elif project_id in projects:
+                write = projects[project_id]
+            else:
+                write = writes.get(name)
+            if write in replicas:
+                read = replicas[write].get(name)
+            else:
+                read = write
+            routes[name] = (write, read)
+    return routes
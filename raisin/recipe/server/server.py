@@ -4,11 +4,73 @@ Produce server configurations for raisin.
 
 import csv
 import os
+import sys
+import glob
+import json
+import shutil
+import hashlib
 import logging
+import urllib
+import marshal
 import urlparse
+import multiprocessing
+from raisin.recipe.server.graph import run_graph
+from raisin.recipe.server.index import INDEX
+from raisin.recipe.server.index import download_index
+from raisin.recipe.server.manifest import MANIFEST
+from raisin.recipe.server.manifest import Manifest
+from raisin.recipe.server.manifest import inputs_key
+from raisin.recipe.server.manifest import section_digest
+from raisin.recipe.server.output import read_file
+from raisin.recipe.server.output import write_file
+from raisin.recipe.server.output import track_changes
+from raisin.recipe.server.output import stop_tracking
+from raisin.recipe.server.report import REPORT
+from raisin.recipe.server.report import Report
+from raisin.recipe.server.report import count
+from raisin.recipe.server.reload import SUPERVISOR_URL
+from raisin.recipe.server.reload import check_mode
+from raisin.recipe.server.reload import reload_services
+from raisin.recipe.server.routing import get_connections
+from raisin.recipe.server.routing import get_routes
+from raisin.recipe.server.sql import INDEXES
+from raisin.recipe.server.sql import TABLE
+from raisin.recipe.server.sql import indexes_sql
+from raisin.recipe.server.compression import TYPES
+from raisin.recipe.server.compression import MIN_SIZE
+from raisin.recipe.server.compression import precompress
 
 logger = logging.getLogger('raisin.recipe.server.server')
 
+# The only columns of profiles.csv needed for configuring the servers
+PROFILE_COLUMNS = ('project_id', 'DB', 'COMMONDB')
+
+# Where the parsed profiles are cached, relative to the buildout directory,
+# and the version of the layout of the cache
+PROFILES_CACHE = 'var/raisin.recipe.server/profiles.cache'
+PROFILES_CACHE_FORMAT = 3
+
+# The sums of the digests of the profiles of a project are modulo the range
+# of md5, and its data version keeps this many hexadecimal digits
+VERSION_MODULUS = 2 ** 128
+VERSION_LENGTH = 16
+
+# Where the data versions of the projects are written, relative to the
+# buildout directory
+VERSIONS = 'etc/projects/versions.ini'
+
+# The static files of the restish server, relative to the buildout
+# directory, and the application serving them
+PUBLIC = 'etc/restish/raisin.restish/public'
+STATIC = 'egg:Paste#static'
+
+# Where the configuration of the groups of projects is written, relative to
+# the buildout directory, and the smallest gap between the ports of the
+# services of two groups, the gap being a multiple of it large enough for
+# the workers
+GROUPS = 'etc/groups'
+GROUP_PORTS = 100
+
 
 def make_path(buildout_directory, folder):
     """
@@ -16,7 +78,12 @@ def make_path(buildout_directory, folder):
     """
     path = os.path.join(buildout_directory, folder)
     if not os.path.exists(path):
-        os.makedirs(path)
+        try:
+            os.makedirs(path)
+        except OSError:
+            # Another generator may have made it in the meantime
+            if not os.path.isdir(path):
+                raise
 
 
 def read_csv(file_name):
@@ -28,7 +95,8 @@ def read_csv(file_name):
                                             skipinitialspace=True)]
 
 
-def projects_ini(buildout_directory, projects):
+def projects_ini(buildout_directory, projects,
+                 path='etc/projects/projects.ini'):
     """
     Produce a projects.ini file:
 
@@ -42,21 +110,21 @@ def projects_ini(buildout_directory, projects):
         RNAseqPipeline = db
         RNAseqPipelineCommon = dbcommon
     """
-    make_path(buildout_directory, 'etc/projects')
-    path = os.path.join(buildout_directory, 'etc/projects/projects.ini')
-    ini = open(path, 'w')
+    path = os.path.join(buildout_directory, path)
+    make_path(buildout_directory, os.path.dirname(path))
+    ini = []
     for project in projects:
-        ini.write('[%s]\n' % project)
-        ini.write('projects = %s,\n' % project)
-        ini.write('    [[dbs]]\n')
-        ini.write('    RNAseqPipeline = %s\n' % project)
-        ini.write('    RNAseqPipelineCommon = %sCommon\n' % project)
-        ini.write('\n')
-    ini.close()
-    logger.info('Writing :%s' % path)
+        ini.append('[%s]\n' % project)
+        ini.append('projects = %s,\n' % project)
+        ini.append('    [[dbs]]\n')
+        ini.append('    RNAseqPipeline = %s\n' % project)
+        ini.append('    RNAseqPipelineCommon = %sCommon\n' % project)
+        ini.append('\n')
+    write_file(path, ''.join(ini))
 
 
-def databases_ini(buildout_directory, dbs):
+def databases_ini(buildout_directory, dbs, routes=None,
+                  path='etc/databases/databases.ini'):
     """
     Produce a databases.ini file:
 
@@ -73,29 +141,83 @@ def databases_ini(buildout_directory, dbs):
     connection = raisin
     db = Test_RNAseqPipelineCommon
     description = Contains all the statistics results
+
+    Given the routes of the stanzas, each one gets its write connection and
+    its read connection, and connection is the write connection.
     """
-    make_path(buildout_directory, 'etc/databases')
-    path = os.path.join(buildout_directory, 'etc/databases/databases.ini')
-    ini = open(path, 'w')
-    projects = []
-    for project_id, db, commondb in dbs:
-        if project_id in projects:
-            print "Ignoring project", project_id, db, commondb
-            continue
+    path = os.path.join(buildout_directory, path)
+    make_path(buildout_directory, os.path.dirname(path))
+    ini = []
+
+    def add_connection(name):
+        """Add the connections of a stanza."""
+        if routes is None:
+            ini.append('connection = raisin\n')
         else:
-            projects.append(project_id)
-        ini.write('[%s]\n' % project_id)
-        ini.write('connection = raisin\n')
-        ini.write('db = %s\n' % db)
-        ini.write('description = Contains the meta data\n')
-        ini.write('\n')
-        ini.write('[%sCommon]\n' % project_id)
-        ini.write('connection = raisin\n')
-        ini.write('db = %s\n' % commondb)
-        ini.write('description = Contains all the statistics results\n')
-        ini.write('\n')
-    ini.close()
-    logger.info('Writing :%s' % path)
+            write, read = routes[name]
+            ini.append('connection = %s\n' % write)
+            ini.append('read_connection = %s\n' % read)
+            ini.append('write_connection = %s\n' % write)
+
+    for project_id, db, commondb in get_registry(dbs):
+        ini.append('[%s]\n' % project_id)
+        add_connection(project_id)
+        ini.append('db = %s\n' % db)
+        ini.append('description = Contains the meta data\n')
+        ini.append('\n')
+        ini.append('[%sCommon]\n' % project_id)
+        add_connection('%sCommon' % project_id)
+        ini.append('db = %s\n' % commondb)
+        ini.append('description = Contains all the statistics results\n')
+        ini.append('\n')
+    write_file(path, ''.join(ini))
+
+
+def versions_ini(buildout_directory, versions):
+    """
+    Produce the versions.ini file read by the conditional filter of the
+    servers:
+
+    etc/projects/versions.ini
+
+    Like this:
+
+    [versions]
+    Test = 0123456789abcdef
+    """
+    make_path(buildout_directory, 'etc/projects')
+    path = os.path.join(buildout_directory, VERSIONS)
+    ini = ['[versions]\n']
+    for project in sorted(versions.keys()):
+        ini.append('%s = %s\n' % (project, versions[project]))
+    write_file(path, ''.join(ini))
+
+
+def get_routed_connections(buildout):
+    """
+    Return the sorted names of the connections of the database_connections
+    section, with their read replicas.
+    """
+    names = set()
+    for connection, replicas in get_connections(
+            buildout.get('database_connections') or {}).items():
+        names.add(connection)
+        names.update(replicas)
+    return sorted(names)
+
+
+def get_database_routes(buildout, dbs):
+    """
+    Return the write and read connections of every database stanza, or
+    None if the buildout declares no database_connections section, in
+    which case every database uses the raisin connection.
+    """
+    section = buildout.get('database_connections')
+    if not section:
+        return None
+    return get_routes(get_registry(dbs),
+                      get_connections(section),
+                      dict(buildout.get('database_projects') or {}))
 
 
 def get_profiles(staging):
@@ -107,6 +229,112 @@ def get_profiles(staging):
     return profiles
 
 
+def iter_profiles(staging, columns=PROFILE_COLUMNS):
+    """
+    Stream the profiles from staging, yielding one tuple per row holding
+    only the values of the given columns.
+    """
+    for values, row in iter_profile_rows(staging, columns):
+        yield values
+
+
+def iter_profile_rows(staging, columns=PROFILE_COLUMNS):
+    """
+    Stream the profiles from staging, yielding for each row the tuple of
+    the values of the given columns, and the list of all its values.
+    """
+    profiles = open(os.path.join(staging, 'profiles.csv'), 'r')
+    reader = csv.reader(profiles, delimiter='\t', skipinitialspace=True)
+    try:
+        header = next(reader)
+        indexes = [header.index(column) for column in columns]
+        width = max(indexes) + 1
+        for row in reader:
+            if not row:
+                continue
+            values = row
+            if len(row) < width:
+                # Missing values are None, as with csv.DictReader
+                values = row + [None] * (width - len(row))
+            yield tuple([values[index] for index in indexes]), row
+    finally:
+        profiles.close()
+        count('rows', max(reader.line_num - 1, 0))
+
+
+def scan_profiles(staging):
+    """
+    Return the sorted list of unique projects, the sorted list of tuples
+    containing the project and its DB and COMMONDB, a dictionary of the
+    number of profiles of each project, and a dictionary of the data version
+    of each project, reading profiles.csv in a single pass.
+
+    Only the distinct (project_id, DB, COMMONDB) tuples are kept in memory,
+    so the memory used does not grow with the number of rows.
+    """
+    dbs = set()
+    counts = {}
+    sums = {}
+    for values, row in iter_profile_rows(staging):
+        dbs.add(values)
+        project = values[0]
+        counts[project] = counts.get(project, 0) + 1
+        digest = int(hashlib.md5('\t'.join(row)).hexdigest(), 16)
+        sums[project] = (sums.get(project, 0) + digest) % VERSION_MODULUS
+    projects = counts.keys()
+    projects.sort()
+    dbs = list(dbs)
+    dbs.sort()
+    return projects, dbs, counts, get_versions(dbs, sums)
+
+
+def get_versions(dbs, sums):
+    """
+    Return the data version of each project, a digest of the sum of the
+    digests of its profiles and of its DB and COMMONDB names.
+
+    Summing the digests of the rows keeps the version unchanged when the
+    profiles are only reordered, and needs no memory per row.
+    """
+    names = {}
+    for project, db, commondb in dbs:
+        names.setdefault(project, []).append('%s\t%s' % (db, commondb))
+    versions = {}
+    for project, total in sums.items():
+        digest = hashlib.sha1('%s\n%x\n%s' % (project, total,
+                                               '\n'.join(names[project])))
+        versions[project] = digest.hexdigest()[:VERSION_LENGTH]
+    return versions
+
+
+def load_profiles(staging, cache_path, fingerprint):
+    """
+    Return the projects, dbs, counts and versions of the profiles as
+    scan_profiles does.
+
+    The result is kept in a cache along with the fingerprint of
+    profiles.csv, a tuple of its size, modification time and digest. As
+    long as the digest is unchanged, the profiles are read from the cache
+    instead of being parsed again. Otherwise the cache is replaced.
+    """
+    cached = read_file(cache_path)
+    if cached is not None:
+        try:
+            cache_format, cache_fingerprint, profiles = marshal.loads(cached)
+        except (ValueError, EOFError, TypeError):
+            logger.info('Ignoring unreadable cache: %s' % cache_path)
+        else:
+            if cache_format == PROFILES_CACHE_FORMAT and \
+               cache_fingerprint[2] == fingerprint[2]:
+                logger.info('Reading cached profiles: %s' % cache_path)
+                return profiles
+    profiles = scan_profiles(staging)
+    write_file(cache_path, marshal.dumps((PROFILES_CACHE_FORMAT,
+                                          tuple(fingerprint),
+                                          profiles)))
+    return profiles
+
+
 def get_projects(profiles):
     """
     Return a sorted list of unique projects.
@@ -132,7 +360,65 @@ def get_dbs(profiles):
     return dbs
 
 
-def pyramid_projects_ini(buildout_directory, projects, project_users):
+class ProjectRegistry(object):
+    """
+    The projects with their DB and COMMONDB, indexed by project.
+
+    A project mapped to more than one DB and COMMONDB keeps the first pair
+    found, and the other pairs are recorded as conflicts.
+    """
+
+    def __init__(self, dbs):
+        self.projects = []
+        self.dbs = {}
+        self.conflicts = []
+        ignored = {}
+        for project_id, db, commondb in dbs:
+            known = self.dbs.get(project_id)
+            if known is None:
+                self.projects.append(project_id)
+                self.dbs[project_id] = (db, commondb)
+            elif known != (db, commondb):
+                ignored.setdefault(project_id, []).append((db, commondb))
+        for project_id in self.projects:
+            if project_id in ignored:
+                db, commondb = self.dbs[project_id]
+                self.conflicts.append({'project_id': project_id,
+                                       'DB': db,
+                                       'COMMONDB': commondb,
+                                       'ignored': ignored[project_id]})
+                pairs = ', '.join(['%s/%s' % pair
+                                   for pair in ignored[project_id]])
+                logger.warning('Conflicting DB/COMMONDB for project %s: '
+                               'using %s/%s, ignoring %s' % (project_id, db,
+                                                             commondb, pairs))
+
+    def __iter__(self):
+        """
+        Iterate over the tuples of the projects and their DB and COMMONDB.
+        """
+        for project_id in self.projects:
+            db, commondb = self.dbs[project_id]
+            yield project_id, db, commondb
+
+    def __contains__(self, project_id):
+        return project_id in self.dbs
+
+    def __len__(self):
+        return len(self.projects)
+
+
+def get_registry(dbs):
+    """
+    Return the registry of the projects in dbs, unless it is one already.
+    """
+    if isinstance(dbs, ProjectRegistry):
+        return dbs
+    return ProjectRegistry(dbs)
+
+
+def pyramid_projects_ini(buildout_directory, projects, project_users,
+                         path='etc/pyramid/projects.ini'):
     """
     Produce a projects.ini file for pyramid:
 
@@ -143,15 +429,14 @@ def pyramid_projects_ini(buildout_directory, projects, project_users):
     [Test]
     users = "raisin",
     """
-    make_path(buildout_directory, 'etc/pyramid')
-    path = os.path.join(buildout_directory, 'etc/pyramid/projects.ini')
-    ini = open(path, 'w')
+    path = os.path.join(buildout_directory, path)
+    make_path(buildout_directory, os.path.dirname(path))
+    ini = []
     for project in projects:
-        ini.write('[%s]\n' % project)
-        ini.write('users = %s,\n' % ','.join(project_users[project]))
-        ini.write('\n')
-    ini.close()
-    logger.info('Writing :%s' % path)
+        ini.append('[%s]\n' % project)
+        ini.append('users = %s,\n' % ','.join(project_users[project]))
+        ini.append('\n')
+    write_file(path, ''.join(ini))
 
 
 def get_parameters(buildout):
@@ -186,19 +471,18 @@ def misc_parameters_ini(buildout_directory, parameters):
     """
     make_path(buildout_directory, 'etc/misc')
     path = os.path.join(buildout_directory, 'etc/misc/parameters.ini')
-    ini = open(path, 'w')
+    ini = []
     keys = parameters.keys()
     keys.sort()
     for key in keys:
         parameter = parameters[key]
-        ini.write('[%s]\n' % key)
-        ini.write('title = %s\n' % parameter['title'])
-        ini.write('category = %s\n' % parameter['category'])
-        ini.write('type = %s\n' % parameter['type'])
-        ini.write('column = %s\n' % parameter['column'])
-        ini.write('\n')
-    ini.close()
-    logger.info('Writing :%s' % path)
+        ini.append('[%s]\n' % key)
+        ini.append('title = %s\n' % parameter['title'])
+        ini.append('category = %s\n' % parameter['category'])
+        ini.append('type = %s\n' % parameter['type'])
+        ini.append('column = %s\n' % parameter['column'])
+        ini.append('\n')
+    write_file(path, ''.join(ini))
 
 
 def get_project_users(buildout, projects):
@@ -248,34 +532,111 @@ def misc_project_parameters_ini(buildout_directory, project_parameters):
     """
     make_path(buildout_directory, 'etc/misc')
     path = os.path.join(buildout_directory, 'etc/misc/project_parameters.ini')
-    ini = open(path, 'w')
+    ini = []
     keys = project_parameters.keys()
     keys.sort()
     for key in keys:
         parameters = project_parameters[key]
-        ini.write('[%s]\n' % key)
+        ini.append('[%s]\n' % key)
         value = ['"%s"' % p for p in parameters]
-        ini.write('parameters = %s,\n' % ', '.join(value))
-        ini.write('\n')
-    ini.close()
-    logger.info('Writing :%s' % path)
+        ini.append('parameters = %s,\n' % ', '.join(value))
+        ini.append('\n')
+    write_file(path, ''.join(ini))
+
 
+def connections_mysql_ini(buildout_directory, pool=None, section=None,
+                          connections=()):
+    """
+    Create the mysql connection file.
 
-def connections_mysql_ini(buildout_directory):
-    """Create the mysql connection file"""
+    Given the default pool settings, and the buildout section overriding
+    them, the pool settings of every connection are set, keeping the rest
+    of an existing file as it is. The given connections the databases are
+    routed to, missing from the file, are added with their pool settings,
+    their server being left to set.
+    """
     make_path(buildout_directory, 'etc/connections')
     path = os.path.join(buildout_directory, 'etc/connections/mysql.ini')
-    if os.path.exists(path):
+    existing = read_file(path)
+    if existing is not None and pool is None:
         logger.info('Keeping existing configuration file: %s' % path)
-    else:
-        ini = open(path, 'w')
-        ini.write("[raisin]\n")
-        ini.write("port = 3306\n")
-        ini.write("server = 127.0.0.1\n")
-        ini.write("user = raisin\n")
-        ini.write("password = raisin\n")
-        ini.close()
-        logger.info('Writing: %s' % path)
+        return
+    if existing is None:
+        ini = []
+        ini.append("[raisin]\n")
+        ini.append("port = 3306\n")
+        ini.append("server = 127.0.0.1\n")
+        ini.append("user = raisin\n")
+        ini.append("password = raisin\n")
+        existing = ''.join(ini)
+    if pool is not None:
+        existing = set_pool_settings(existing, pool, section or {},
+                                     connections)
+    write_file(path, existing)
+
+
+def get_pool(pool, section, connection):
+    """
+    Return the pool settings of a connection, the options of the section
+    named after the connection, like raisin.pool_size, overriding the
+    options for all the connections, like pool_size, which override the
+    defaults.
+    """
+    settings = {}
+    for key in POOL_OPTIONS:
+        name = '%s.%s' % (connection, key)
+        if name not in section:
+            name = key
+        settings[key] = get_int(section, name, pool[key], 0)
+    return settings
+
+
+def set_pool_settings(ini, pool, section, connections=()):
+    """
+    Return the content of mysql.ini with the pool settings of every
+    connection, replacing the ones already there, and adding the given
+    connections missing. The other lines, comments included, are kept.
+    """
+    lines = []
+    connection = None
+    found = set()
+
+    def add_pool():
+        """Add the pool settings at the end of the current connection."""
+        if connection is None:
+            return
+        blank = []
+        while lines and not lines[-1].strip():
+            blank.append(lines.pop())
+        settings = get_pool(pool, section, connection)
+        for key in POOL_OPTIONS:
+            lines.append('%s = %s\n' % (key, settings[key]))
+        lines.extend(blank)
+
+    for line in ini.splitlines(True):
+        stripped = line.strip()
+        if stripped.startswith('[') and stripped.endswith(']'):
+            add_pool()
+            connection = stripped[1:-1].strip()
+            found.add(connection)
+        elif connection is not None and '=' in stripped \
+             and stripped.split('=', 1)[0].strip() in POOL_OPTIONS:
+            continue
+        if not line.endswith('\n'):
+            line += '\n'
+        lines.append(line)
+    add_pool()
+    for connection in connections:
+        if connection in found:
+            continue
+        logger.warning('Adding connection %s to mysql.ini, its server, '
+                       'port, user and password must be set' % connection)
+        if lines and lines[-1].strip():
+            lines.append('\n')
+        lines.append('[%s]\n' % connection)
+        lines.append('# Set the server, port, user and password\n')
+        add_pool()
+    return ''.join(lines)
 
 
 def pyramid_development_ini(buildout_directory):
@@ -287,8 +648,7 @@ def pyramid_development_ini(buildout_directory):
     if os.path.exists(path):
         logger.info('Keeping existing configuration file: %s' % path)
     else:
-        ini = open(path, 'w')
-        ini.write("""[app:main]
+        write_file(path, """[app:main]
 use = egg:raisin.pyramid
 
 pyramid.reload_templates = true
@@ -334,8 +694,210 @@ formatter = generic
 format = %(asctime)s %(levelname)-5.5s [%(name)s][%(threadName)s] %(message)s
 
 # End logging configuration""")
-        ini.close()
-        logger.info('Writing: %s' % path)
+
+
+def waitress_server(host, port, settings):
+    """
+    Return the server section of a paste configuration running waitress
+    with the given settings.
+    """
+    return """[server:main]
+use = egg:waitress#main
+host = %s
+port = %s
+threads = %s
+connection_limit = %s
+channel_timeout = %s
+backlog = %s
+""" % (host, port, settings['threads'], settings['connection_limit'],
+       settings['channel_timeout'], settings['backlog'])
+
+
+def pyramid_production_ini(buildout_directory, settings,
+                           app_settings=None, group=None, log=None,
+                           filters=None):
+    """
+    Write production.ini for the Pyramid server, without template reloading
+    nor debugging, and with the given waitress settings and additional
+    application settings, or production-<group>.ini for a group of
+    projects.
+
+    The log settings and the WSGI filters the requests go through are
+    described in logging_ini and wsgi_pipeline.
+
+    Each worker is started with its port in the http_port variable.
+    """
+    make_path(buildout_directory, 'etc/pyramid')
+    path = os.path.join(buildout_directory,
+                        'etc/pyramid/%s.ini' % production_name(group))
+    app = []
+    if app_settings:
+        for key in sorted(app_settings.keys()):
+            app.append('%s = %s\n' % (key, app_settings[key]))
+        app.append('\n')
+    name = 'main'
+    if filters:
+        name = 'raisin'
+        app.append(wsgi_pipeline(private_filters(filters), name))
+    write_file(path, """[app:%s]
+use = egg:raisin.pyramid
+
+pyramid.reload_templates = false
+pyramid.debug_authorization = false
+pyramid.debug_notfound = false
+pyramid.debug_routematch = false
+pyramid.debug_templates = false
+pyramid.default_locale_name = en
+
+%s%s
+# Begin logging configuration
+
+%s[formatter_generic]
+format = %%(asctime)s %%(levelname)-5.5s [%%(name)s]"""
+               """[%%(threadName)s] %%(message)s
+
+# End logging configuration""" % (name, ''.join(app),
+                                 waitress_server('127.0.0.1', '%(http_port)s',
+                                                 settings),
+                                 logging_ini(buildout_directory, 'pyramid',
+                                             'raisin', log)))
+
+
+def wsgi_pipeline(filters, app):
+    """
+    Return the configuration of the main WSGI pipeline, passing the
+    requests through the filters, the outermost first, before the app.
+
+    The filters are a list of tuples containing the name of each filter and
+    the list of its settings, the first one being use.
+    """
+    ini = []
+    for name, settings in filters:
+        ini.append('[filter:%s]\n' % name)
+        for key, value in settings:
+            ini.append('%s = %s\n' % (key, value))
+        ini.append('\n')
+    ini.append('[pipeline:main]\n')
+    ini.append('pipeline =\n')
+    for name in [name for name, settings in filters] + [app]:
+        ini.append('    %s\n' % name)
+    ini.append('\n')
+    return ''.join(ini)
+
+
+def private_filters(filters):
+    """
+    Return the filters, the conditional filter marking the responses as
+    private, for the Pyramid server only shows the projects to their users.
+    """
+    return [(name, name == 'conditional' and settings + [('private', 'true')]
+             or settings) for name, settings in filters]
+
+
+def logging_ini(buildout_directory, service, logger, log=None):
+    """
+    Return the loggers and handlers of the logging configuration of a
+    service, up to its formatter.
+
+    Without log settings, the root and the logger of the service log
+    warnings to stderr. Otherwise, the levels of the loggers are given by
+    the log settings. When logging to files, the records are queued, and
+    written by a thread of their own to var/log/<process>.log, rotated by
+    size. With an access log sampling
+    rate, the given share of the requests logged by the wsgi logger go to
+    var/log/<process>-access.log.
+    """
+    if log is None:
+        log = {'levels': {}, 'files': False, 'sampling': None}
+    levels = log['levels']
+    loggers = [logger] + sorted([name for name in levels.keys()
+                                 if name not in ['root', logger]])
+    handlers = ['console']
+    target = 'console'
+    if log['files']:
+        handlers.extend(['file', 'buffer'])
+        target = 'buffer'
+    if log['sampling'] is not None:
+        loggers.append('wsgi')
+        if log['files']:
+            handlers.append('access_file')
+        handlers.append('access')
+    ini = []
+    ini.append('[loggers]\n')
+    ini.append('keys = root, %s\n' % ', '.join(loggers))
+    ini.append('\n')
+    ini.append('[handlers]\n')
+    ini.append('keys = %s\n' % ', '.join(handlers))
+    ini.append('\n')
+    ini.append('[formatters]\n')
+    ini.append('keys = generic\n')
+    ini.append('\n')
+    ini.append('[logger_root]\n')
+    ini.append('level = %s\n' % levels.get('root', 'WARN'))
+    ini.append('handlers = %s\n' % target)
+    ini.append('\n')
+    for name in loggers:
+        ini.append('[logger_%s]\n' % name)
+        if name == 'wsgi':
+            ini.append('level = INFO\n')
+            ini.append('handlers = access\n')
+            ini.append('qualname = wsgi\n')
+            ini.append('propagate = 0\n')
+        else:
+            ini.append('level = %s\n' % levels.get(name, 'WARN'))
+            ini.append('handlers =\n')
+            ini.append('qualname = %s\n' % name)
+        ini.append('\n')
+    ini.append('[handler_console]\n')
+    ini.append('class = StreamHandler\n')
+    ini.append('args = (sys.stderr,)\n')
+    ini.append('level = NOTSET\n')
+    ini.append('formatter = generic\n')
+    ini.append('\n')
+    folder = os.path.join(buildout_directory, 'var/log')
+    if log['files']:
+        ini.extend(log_file_handler('file', folder, service, '', log))
+        ini.append('[handler_buffer]\n')
+        ini.append('class = raisin.recipe.server.logs.QueueHandler\n')
+        ini.append('args = (%s, ERROR)\n' % log['buffer'])
+        ini.append('level = NOTSET\n')
+        ini.append('target = file\n')
+        ini.append('\n')
+    if log['sampling'] is not None:
+        if log['files']:
+            ini.extend(log_file_handler('access_file', folder, service,
+                                        '-access', log))
+        if log['sampling'] < 1:
+            ini.append('[handler_access]\n')
+            ini.append('class = raisin.recipe.server.logs.SamplingHandler\n')
+            ini.append('args = (%s, %r)\n' % (log['buffer'],
+                                               log['sampling']))
+        else:
+            ini.append('[handler_access]\n')
+            ini.append('class = raisin.recipe.server.logs.QueueHandler\n')
+            ini.append('args = (%s, ERROR)\n' % log['buffer'])
+        ini.append('level = NOTSET\n')
+        ini.append('target = %s\n' % (log['files'] and 'access_file' or
+                                      'console'))
+        ini.append('\n')
+    return ''.join(ini)
+
+
+def log_file_handler(name, folder, service, suffix, log):
+    """
+    Return the lines of a handler writing to a log file rotated by size,
+    named after the supervisord process of the worker, so that the workers
+    never rotate the same file.
+    """
+    return ['[handler_%s]\n' % name,
+            'class = handlers.RotatingFileHandler\n',
+            "args = (os.path.join(%r, os.environ.get("
+            "'SUPERVISOR_PROCESS_NAME', %r) + %r), 'a', %s, %s)\n" % (
+                folder, service, '%s.log' % suffix, log['max_bytes'],
+                log['backups']),
+            'level = NOTSET\n',
+            'formatter = generic\n',
+            '\n']
 
 
 def restish_development_ini(buildout_directory):
@@ -347,8 +909,7 @@ def restish_development_ini(buildout_directory):
     if os.path.exists(path):
         logger.info('Keeping existing configuration file: %s' % path)
     else:
-        ini = open(path, 'w')
-        ini.write("""[DEFAULT]
+        write_file(path, """[DEFAULT]
 ; Application id used to prefix logs, errors, etc with something unique to this
 ; instance.
 APP_ID = raisin.restish@localhost
@@ -413,8 +974,292 @@ formatter = generic
 [formatter_generic]
 format = %(asctime)s,%(msecs)03d %(levelname)-5.5s [%(name)s] %(message)s
 datefmt = %H:%M:%S""")
-        ini.close()
-        logger.info('Writing: %s' % path)
+
+
+def restish_production_ini(buildout_directory, settings, cache=False,
+                           group=None, log=None, filters=None,
+                           static=STATIC):
+    """
+    Write production.ini for the restish server, served by waitress with
+    the given settings, and pointing to the cache configuration if asked,
+    or production-<group>.ini for a group of projects, pointing to the
+    projects and databases of the group.
+
+    The static files of the public folder are served by the given
+    application.
+
+    The log settings and the WSGI filters the requests go through are
+    described in logging_ini and wsgi_pipeline.
+
+    Each worker is started with its port in the http_port variable.
+    """
+    make_path(buildout_directory, 'etc/restish')
+    path = os.path.join(buildout_directory,
+                        'etc/restish/%s.ini' % production_name(group))
+    projects = '../projects/projects.ini'
+    databases = '../databases/databases.ini'
+    if group is not None:
+        projects = '../groups/%s/projects.ini' % group
+        databases = '../groups/%s/databases.ini' % group
+    config = ''
+    if cache:
+        config = 'cache_config = %(here)s/cache.ini\n'
+    name = 'main'
+    pipeline = ''
+    if filters:
+        name = 'raisin'
+        pipeline = wsgi_pipeline(filters, name)
+    write_file(path, """[DEFAULT]
+; Application id used to prefix logs, errors, etc with something unique to this
+; instance.
+APP_ID = raisin.restish@localhost
+; Email settings.
+SMTP_SERVER = localhost
+ERROR_EMAIL_FROM = %%(APP_ID)s
+ERROR_EMAIL_TO = %%(APP_ID)s
+
+CACHE_DIR = %%(here)s/cache
+%s
+use_sql_database = True
+mysql_connections = %%(here)s/../connections/mysql.ini
+mysql_databases = %%(here)s/%s
+projects = %%(here)s/%s
+downloads = %%(here)s/../projects/downloads.ini
+parameters = %%(here)s/../misc/parameters.ini
+project_parameters = %%(here)s/../misc/project_parameters.ini
+sqlite3_database = %%(here)s/../../etl/database/database.db
+
+[composite:%s]
+use = egg:Paste#cascade
+app1 = public
+app2 = raisin.restish
+
+[app:raisin.restish]
+use = config:raisin.restish.ini#raisin.restish
+
+[app:public]
+use = %s
+document_root = %%(here)s/raisin.restish/public
+
+%s%s
+# Logging configuration
+%s[formatter_generic]
+format = %%(asctime)s,%%(msecs)03d %%(levelname)-5.5s [%%(name)s] %%(message)s
+datefmt = %%H:%%M:%%S""" % (config, databases, projects, name, static,
+                            pipeline,
+                            waitress_server('127.0.0.1', '%(http_port)s',
+                                            settings),
+                            logging_ini(buildout_directory, 'restish',
+                                        'raisin.restish', log)))
+
+
+def production_name(group=None):
+    """
+    Return the name of the production configuration of the servers of a
+    group of projects, or of the shared servers.
+    """
+    if group is None:
+        return 'production'
+    return 'production-%s' % group
+
+
+def group_configs(buildout_directory, groups, dbs, routes, project_users,
+                  services, settings, app_settings=None, cache=False,
+                  log=None, filters=None, static=STATIC):
+    """
+    Write the configuration of the servers of every group of projects,
+    with the subsets of the projects and databases of the group:
+
+    etc/groups/<group>/projects.ini
+    etc/groups/<group>/databases.ini
+    etc/groups/<group>/pyramid.ini
+    etc/restish/production-<group>.ini
+    etc/pyramid/production-<group>.ini
+
+    The configuration of the groups no longer defined is removed.
+    """
+    registry = get_registry(dbs)
+    folder = os.path.join(buildout_directory, GROUPS)
+    names = set()
+    for group, projects in groups:
+        names.add(group)
+        path = os.path.join(GROUPS, group)
+        projects_ini(buildout_directory, projects,
+                     os.path.join(path, 'projects.ini'))
+        databases_ini(buildout_directory,
+                      [(project_id, db, commondb)
+                       for project_id, db, commondb in registry
+                       if project_id in projects],
+                      routes, os.path.join(path, 'databases.ini'))
+        pyramid_projects_ini(buildout_directory, projects, project_users,
+                             os.path.join(path, 'pyramid.ini'))
+        restish_production_ini(buildout_directory, settings, cache, group,
+                               log, filters, static)
+        group_settings = dict(app_settings or {})
+        group_settings['raisin.projects'] = \
+            '%%(here)s/../groups/%s/pyramid.ini' % group
+        group_settings['raisin.restish'] = 'http://127.0.0.1:%s' % (
+            services['restish_%s' % group]['port'])
+        pyramid_production_ini(buildout_directory, settings, group_settings,
+                               group, log, filters)
+    if not os.path.isdir(folder):
+        return
+    for group in os.listdir(folder):
+        if group in names:
+            continue
+        logger.info('Removing the configuration of group: %s' % group)
+        shutil.rmtree(os.path.join(folder, group))
+        for service in ['restish', 'pyramid']:
+            path = os.path.join(buildout_directory, 'etc', service,
+                                '%s.ini' % production_name(group))
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def get_groups(buildout, options, projects, counts):
+    """
+    Return the sorted list of the groups of projects served by their own
+    servers, with their projects.
+
+    The project_groups section maps groups to their projects. The
+    projects left are partitioned into as many groups as the project-groups
+    option says, group1, group2 and so on, each project going to the group
+    with the fewest profiles so far, the projects with the most profiles
+    first.
+    """
+    section = buildout.get('project_groups') or {}
+    known = set(projects)
+    grouped = set()
+    groups = {}
+    for group, members in section.items():
+        members = [project for project in members.split()
+                   if project in known and project not in grouped]
+        grouped.update(members)
+        groups[group] = members
+    number = get_int(options, 'project-groups', 0, 0)
+    if number:
+        left = [project for project in projects if project not in grouped]
+        left.sort(key=lambda project: (-counts.get(project, 0), project))
+        sizes = [0] * number
+        members = [[] for _ in range(number)]
+        for project in left:
+            smallest = sizes.index(min(sizes))
+            sizes[smallest] += counts.get(project, 0)
+            members[smallest].append(project)
+        for index in range(number):
+            if members[index]:
+                groups['group%s' % (index + 1)] = members[index]
+    for group in groups.keys():
+        if not groups[group]:
+            del groups[group]
+        else:
+            groups[group].sort()
+    return sorted(groups.items())
+
+
+def cache_ini(buildout_directory, cache, ttls):
+    """
+    Write the configuration of the response cache of the restish server,
+    with the TTL of the projects overriding the default one:
+
+    etc/restish/cache.ini
+
+    Like this:
+
+    [cache]
+    backend = file
+    path = /buildout/etc/restish/cache
+    max_size = 1073741824
+    ttl = 3600
+    levels = 2
+
+    [ttl]
+    Test = 600
+    """
+    make_path(buildout_directory, 'etc/restish')
+    path = os.path.join(buildout_directory, 'etc/restish/cache.ini')
+    ini = []
+    ini.append('[cache]\n')
+    for key in ['backend', 'path', 'max_size', 'ttl', 'levels']:
+        ini.append('%s = %s\n' % (key, cache[key]))
+    ini.append('\n')
+    ini.append('[ttl]\n')
+    projects = ttls.keys()
+    projects.sort()
+    for project in projects:
+        ini.append('%s = %s\n' % (project, ttls[project]))
+    write_file(path, ''.join(ini))
+
+
+def bin_script(buildout_directory, name, module):
+    """
+    Write an executable script in the bin folder running the main function
+    of a module of this package with the current Python.
+    """
+    make_path(buildout_directory, 'bin')
+    path = os.path.join(buildout_directory, 'bin', name)
+    package = os.path.dirname(os.path.abspath(__file__))
+    location = os.path.dirname(os.path.dirname(os.path.dirname(package)))
+    write_file(path, """#!%s
+
+import sys
+sys.path[0:0] = [
+    %r,
+    ]
+
+import %s
+
+if __name__ == '__main__':
+    sys.exit(%s.main())
+""" % (sys.executable, location, module, module))
+    os.chmod(path, 0755)
+
+
+def get_warming_paths(projects, project_parameters, templates,
+                      priorities=None):
+    """
+    Return the paths of the resources requested to warm the cache, the
+    resources of the projects with the highest priority first, then in the
+    order of the projects and of the templates.
+
+    The templates are paths with the project in %(project)s and its
+    parameters, joined with dashes, in %(parameters)s.
+    """
+    if priorities is None:
+        priorities = {}
+    order = list(projects)
+    order.sort(key=lambda project: (-priorities.get(project, 0), project))
+    paths = []
+    for project in order:
+        values = {'project': urllib.quote(project),
+                  'parameters': urllib.quote(
+                      '-'.join(project_parameters.get(project, [])))}
+        for template in templates:
+            paths.append(template % values)
+    return paths
+
+
+def warm_json(buildout_directory, paths, base, jobs, max_errors):
+    """
+    Write the resources requested by bin/raisin-cache-warming:
+
+    etc/restish/warm.json
+
+    Like this:
+
+    {"base": "http://127.0.0.1:6464", "jobs": 4, "max_errors": 10,
+     "paths": ["/project/Test", "/project/Test/read_length"],
+     "timeout": 300, "wait": 120}
+    """
+    make_path(buildout_directory, 'etc/restish')
+    path = os.path.join(buildout_directory, 'etc/restish/warm.json')
+    write_file(path, json.dumps({'base': base,
+                                 'jobs': jobs,
+                                 'max_errors': max_errors,
+                                 'paths': paths,
+                                 'timeout': WARMING_TIMEOUT,
+                                 'wait': WARMING_WAIT},
+                                indent=1, sort_keys=True))
 
 
 def restish_raisin_restish_ini(buildout_directory):
@@ -426,12 +1271,9 @@ def restish_raisin_restish_ini(buildout_directory):
     if os.path.exists(path):
         logger.info('Keeping existing configuration file: %s' % path)
     else:
-        ini = open(path, 'w')
-        ini.write("""[app:raisin.restish]
+        write_file(path, """[app:raisin.restish]
 use = egg:raisin.restish
 cache_dir = %(CACHE_DIR)s""")
-        ini.close()
-        logger.info('Writing: %s' % path)
 
 
 def pyramid_users_ini(buildout_directory):
@@ -443,72 +1285,334 @@ def pyramid_users_ini(buildout_directory):
     if os.path.exists(path):
         logger.info('Keeping existing configuration file: %s' % path)
         return
-    ini = open(path, 'w')
-    ini.write('''[raisin]
+    write_file(path, '''[raisin]
 password = "raisin"''')
-    ini.close()
-    logger.info('Writing: %s' % path)
 
 
-def supervisord_conf(buildout_directory, mode):
+def supervisord_conf(buildout_directory, mode, services=None, tasks=None):
     """
     Write configuration for the Supervisord server.
+
+    Without services, a single restish and Pyramid process is started, and
+    an existing configuration is kept. Otherwise, as many processes as the
+    workers of each service are started, listening on the ports following
+    the port of the service, and the configuration is regenerated.
+
+    The tasks are the name, the command and the additional settings of the
+    other programs to start after the servers.
     """
     make_path(buildout_directory, 'etc/supervisor')
-    path = os.path.join(buildout_directory, 'etc/supervisor/%s.conf' % mode)
-    if os.path.exists(path):
-        logger.info('Keeping existing configuration file: %s' % path)
+    conf_path = os.path.join(buildout_directory,
+                             'etc/supervisor/%s.conf' % mode)
+    if services is None and os.path.exists(conf_path):
+        logger.info('Keeping existing configuration file: %s' % conf_path)
         return
-    conf = open(path, 'w')
-    conf.write("""[supervisord]\n""")
+    conf = []
+    conf.append("""[supervisord]\n""")
     path = os.path.join(buildout_directory, "var/log")
-    conf.write("""childlogdir = %s\n""" % path)
+    conf.append("""childlogdir = %s\n""" % path)
     path = os.path.join(buildout_directory, "var/log/supervisord.log")
-    conf.write("""logfile = %s\n""" % path)
-    conf.write("""logfile_maxbytes = 50MB\n""")
-    conf.write("""logfile_backups = 10\n""")
-    conf.write("""loglevel = info\n""")
+    conf.append("""logfile = %s\n""" % path)
+    conf.append("""logfile_maxbytes = 50MB\n""")
+    conf.append("""logfile_backups = 10\n""")
+    conf.append("""loglevel = info\n""")
     path = os.path.join(buildout_directory, "var/supervisord.pid")
-    conf.write("""pidfile = %s\n""" % path)
-    conf.write("""umask = 022\n""")
-    conf.write("""nodaemon = false\n""")
-    conf.write("""nocleanup = false\n""")
-    conf.write("""\n""")
-    conf.write("""[inet_http_server]\n""")
-    conf.write("""port = 127.0.0.1:9001\n""")
-    conf.write("""username = \n""")
-    conf.write("""password = \n""")
-    conf.write("""\n""")
-    conf.write("""[supervisorctl]\n""")
-    conf.write("""serverurl = http://127.0.0.1:9001\n""")
-    conf.write("""username = \n""")
-    conf.write("""password = \n""")
-    conf.write("""\n""")
-    conf.write("""[rpcinterface:supervisor]\n""")
-    conf.write("""supervisor.rpcinterface_factory=""")
-    conf.write("""supervisor.rpcinterface:make_main_rpcinterface\n""")
-    conf.write("""\n""")
-    conf.write("""[program:restish]\n""")
-    path = os.path.join(buildout_directory, "bin/pserve")
-    ini = "etc/restish/%s.ini" % mode
-    config_file = os.path.join(buildout_directory, ini)
-    conf.write("""command = %s %s\n""" % (path, config_file))
-    conf.write("""process_name = restish\n""")
-    conf.write("""directory = %s\n""" % buildout_directory)
-    conf.write("""priority = 10\n""")
-    conf.write("""redirect_stderr = false\n""")
-    conf.write("""\n""")
-    conf.write("""[program:pyramid]\n""")
-    path = os.path.join(buildout_directory, "bin/pserve")
-    ini = "etc/pyramid/%s.ini" % mode
-    config_file = os.path.join(buildout_directory, ini)
-    conf.write("""command = %s %s\n""" % (path, config_file))
-    conf.write("""process_name = pyramid\n""")
-    conf.write("""directory = %s\n""" % buildout_directory)
-    conf.write("""priority = 20\n""")
-    conf.write("""redirect_stderr = false\n""")
-    conf.close()
-    logger.info('Writing: %s' % path)
+    conf.append("""pidfile = %s\n""" % path)
+    conf.append("""umask = 022\n""")
+    conf.append("""nodaemon = false\n""")
+    conf.append("""nocleanup = false\n""")
+    conf.append("""\n""")
+    conf.append("""[inet_http_server]\n""")
+    conf.append("""port = 127.0.0.1:9001\n""")
+    conf.append("""username = \n""")
+    conf.append("""password = \n""")
+    conf.append("""\n""")
+    conf.append("""[supervisorctl]\n""")
+    conf.append("""serverurl = http://127.0.0.1:9001\n""")
+    conf.append("""username = \n""")
+    conf.append("""password = \n""")
+    conf.append("""\n""")
+    conf.append("""[rpcinterface:supervisor]\n""")
+    conf.append("""supervisor.rpcinterface_factory=""")
+    conf.append("""supervisor.rpcinterface:make_main_rpcinterface\n""")
+    conf.append("""\n""")
+    programs = []
+    names = ['restish', 'pyramid']
+    if services is not None:
+        names = get_service_names(services)
+    for name in names:
+        kind, group = split_service_name(name)
+        priority = {'restish': 10, 'pyramid': 20}[kind]
+        program = []
+        program.append("""[program:%s]\n""" % name)
+        path = os.path.join(buildout_directory, "bin/pserve")
+        ini = "etc/%s/%s.ini" % (kind, mode)
+        if group is not None:
+            ini = "etc/%s/%s.ini" % (kind, production_name(group))
+        config_file = os.path.join(buildout_directory, ini)
+        if services is None:
+            program.append("""command = %s %s\n""" % (path, config_file))
+            program.append("""process_name = %s\n""" % name)
+        else:
+            # One process per worker, listening on its process number
+            service = services[name]
+            program.append("""command = %s %s http_port=%%(process_num)s\n"""
+                           % (path, config_file))
+            program.append("""process_name = """
+                           """%(program_name)s_%(process_num)s\n""")
+            program.append("""numprocs = %s\n""" % service['workers'])
+            program.append("""numprocs_start = %s\n""" % (service['port'] + 1))
+        program.append("""directory = %s\n""" % buildout_directory)
+        program.append("""priority = %s\n""" % priority)
+        program.append("""redirect_stderr = false\n""")
+        programs.append(''.join(program))
+    for name, command, settings in tasks or []:
+        program = []
+        program.append("""[program:%s]\n""" % name)
+        program.append("""command = %s\n""" % command)
+        program.append("""directory = %s\n""" % buildout_directory)
+        for key, value in settings:
+            program.append("""%s = %s\n""" % (key, value))
+        program.append("""redirect_stderr = false\n""")
+        programs.append(''.join(program))
+    conf.append('\n'.join(programs))
+    write_file(conf_path, ''.join(conf))
+
+
+def get_service_names(services):
+    """
+    Return the names of the services, the shared restish and Pyramid
+    services first, then the services of the groups of projects.
+    """
+    names = ['restish', 'pyramid']
+    others = [name for name in services.keys() if name not in names]
+    others.sort(key=lambda name: split_service_name(name)[::-1])
+    return names + others
+
+
+def split_service_name(name):
+    """
+    Return the kind of a service, restish or pyramid, and its group of
+    projects, if any.
+    """
+    if '_' not in name:
+        return name, None
+    kind, group = name.split('_', 1)
+    return kind, group
+
+
+def get_project_locations(project):
+    """
+    Return the exact and prefix paths of the resources of a project, used
+    to route them to the servers of its group.
+    """
+    return '/project/%s' % project, '/project/%s/' % project
+
+
+def get_worker_ports(service):
+    """
+    Return the ports the workers of a service listen on.
+    """
+    return range(service['port'] + 1, service['port'] + 1 + service['workers'])
+
+
+def nginx_conf(buildout_directory, services, settings, includes=None):
+    """
+    Write the nginx configuration spreading the requests to each service
+    over its workers:
+
+    etc/nginx/raisin.conf
+
+    It is meant to be included in the http block of the nginx
+    configuration. The includes map services to the files included in
+    their server block.
+    """
+    if includes is None:
+        includes = {}
+    make_path(buildout_directory, 'etc/nginx')
+    path = os.path.join(buildout_directory, 'etc/nginx/raisin.conf')
+    conf = []
+    names = get_service_names(services)
+    for name in names:
+        service = services[name]
+        conf.append('upstream raisin_%s {\n' % name)
+        conf.append('    least_conn;\n')
+        for port in get_worker_ports(service):
+            conf.append('    server 127.0.0.1:%s;\n' % port)
+        conf.append('    keepalive %s;\n' % settings['threads'])
+        conf.append('}\n')
+        conf.append('\n')
+        conf.append('server {\n')
+        conf.append('    listen %s:%s;\n' % (service['host'], service['port']))
+        conf.append('\n')
+        for include in includes.get(name, []):
+            conf.append('    include %s;\n' % include)
+            conf.append('\n')
+        # Route the projects of the groups to the servers of their group
+        for other in names:
+            kind, group = split_service_name(other)
+            if kind != name or group is None:
+                continue
+            for project in services[other]['projects']:
+                for location in get_project_locations(project):
+                    modifier = location.endswith('/') and ' ' or ' = '
+                    conf.append('    location%s%s {\n' % (modifier, location))
+                    conf.extend(nginx_proxy(other, settings))
+                    conf.append('    }\n')
+                    conf.append('\n')
+        conf.append('    location / {\n')
+        conf.extend(nginx_proxy(name, settings))
+        conf.append('    }\n')
+        conf.append('}\n')
+        conf.append('\n')
+    write_file(path, ''.join(conf))
+
+
+def nginx_proxy(name, settings):
+    """
+    Return the lines of an nginx location passing the requests to the
+    workers of a service.
+    """
+    return ['        proxy_pass http://raisin_%s;\n' % name,
+            '        proxy_http_version 1.1;\n',
+            '        proxy_set_header Connection "";\n',
+            '        proxy_set_header Host $http_host;\n',
+            '        proxy_set_header X-Forwarded-For '
+            '$proxy_add_x_forwarded_for;\n',
+            '        proxy_read_timeout %ss;\n' % settings['channel_timeout']]
+
+
+def haproxy_cfg(buildout_directory, services, settings, includes=None):
+    """
+    Write the haproxy configuration spreading the requests to each service
+    over its workers:
+
+    etc/haproxy/haproxy.cfg
+
+    haproxy only balances the requests, so it cannot include the nginx
+    configuration of other features.
+    """
+    if includes:
+        raise ValueError('The proxy option must be nginx to include: %s' %
+                         ', '.join(sorted(sum(includes.values(), []))))
+    make_path(buildout_directory, 'etc/haproxy')
+    path = os.path.join(buildout_directory, 'etc/haproxy/haproxy.cfg')
+    conf = []
+    conf.append('global\n')
+    conf.append('    maxconn %s\n' % sum([settings['connection_limit'] *
+                                          service['workers']
+                                          for service in services.values()]))
+    conf.append('\n')
+    conf.append('defaults\n')
+    conf.append('    mode http\n')
+    conf.append('    option forwardfor\n')
+    conf.append('    option http-server-close\n')
+    conf.append('    timeout connect 5s\n')
+    conf.append('    timeout client %ss\n' % settings['channel_timeout'])
+    conf.append('    timeout server %ss\n' % settings['channel_timeout'])
+    names = get_service_names(services)
+    for name in names:
+        service = services[name]
+        conf.append('\n')
+        conf.append('frontend %s\n' % name)
+        conf.append('    bind %s:%s\n' % (service['host'], service['port']))
+        # Route the projects of the groups to the servers of their group
+        for other in names:
+            kind, group = split_service_name(other)
+            if kind != name or group is None:
+                continue
+            for project in services[other]['projects']:
+                exact, prefix = get_project_locations(project)
+                conf.append('    acl %s path %s\n' % (group, exact))
+                conf.append('    acl %s path_beg %s\n' % (group, prefix))
+            conf.append('    use_backend %s_workers if %s\n' % (other, group))
+        conf.append('    default_backend %s_workers\n' % name)
+        conf.append('\n')
+        conf.append('backend %s_workers\n' % name)
+        conf.append('    balance leastconn\n')
+        for port in get_worker_ports(service):
+            conf.append('    server %s_%s 127.0.0.1:%s check maxconn %s\n' %
+                        (name, port, port, settings['connection_limit']))
+    write_file(path, ''.join(conf))
+
+
+# The proxies that can spread the requests over the workers of the services
+PROXIES = {'nginx': nginx_conf,
+           'haproxy': haproxy_cfg}
+
+
+def proxy_conf(buildout_directory, services, settings, proxy,
+               includes=None):
+    """
+    Write the configuration of the proxy in front of the workers.
+    """
+    if proxy not in PROXIES:
+        raise ValueError('The proxy option must be one of %s: %s' % (
+            ', '.join(sorted(PROXIES.keys())), proxy))
+    PROXIES[proxy](buildout_directory, services, settings, includes)
+
+
+def get_proxy_includes(buildout_directory, options):
+    """
+    Return the nginx configuration files to include in the server block of
+    each service, according to the options of the server part.
+    """
+    includes = {}
+    if get_flag(options, 'download-sendfile'):
+        path = os.path.join(buildout_directory, 'etc/nginx/downloads.conf')
+        includes.setdefault('pyramid', []).append(path)
+    return includes
+
+
+def get_sendfile_location(options):
+    """
+    Return the location under which nginx serves the downloads for the
+    Pyramid server, or None if the Pyramid server serves them itself.
+    """
+    if not get_flag(options, 'download-sendfile'):
+        return None
+    location = options.get('download-location', SENDFILE_LOCATION)
+    return '/%s/' % location.strip('/')
+
+
+def nginx_downloads_conf(buildout_directory, project_downloads, location):
+    """
+    Write the internal nginx locations serving the files available for
+    download of every project, once the Pyramid server has authorized the
+    request by answering with an X-Accel-Redirect header:
+
+    etc/nginx/downloads.conf
+
+    Like this:
+
+    location /raisin-downloads/Test/ {
+        internal;
+        alias "/downloads/Test/";
+    }
+    """
+    make_path(buildout_directory, 'etc/nginx')
+    path = os.path.join(buildout_directory, 'etc/nginx/downloads.conf')
+    conf = []
+    for project, folder, url, db, commondb in project_downloads:
+        conf.append('location %s%s/ {\n' % (location, project))
+        conf.append('    internal;\n')
+        conf.append('    alias "%s/";\n' % folder.rstrip('/'))
+        conf.append('}\n')
+        conf.append('\n')
+    write_file(path, ''.join(conf))
+
+
+def get_pyramid_settings(options):
+    """
+    Return the settings of the Pyramid application in production that
+    depend on the options of the server part.
+    """
+    settings = {}
+    location = get_sendfile_location(options)
+    if location is not None:
+        settings['raisin.downloads.sendfile_header'] = 'X-Accel-Redirect'
+        settings['raisin.downloads.sendfile_location'] = location
+    return settings
 
 
 def var_log_folder(buildout_directory):
@@ -518,19 +1622,19 @@ def var_log_folder(buildout_directory):
     make_path(buildout_directory, 'var/log')
 
 
-def downloads(buildout, buildout_directory, dbs):
+def get_project_downloads(buildout, dbs):
     """
-    Create the downloads configuration.
+    Return a list of tuples containing the project, its downloads path and
+    url, and its DB and COMMONDB, for the projects not excluded from the
+    downloads.
     """
-    make_path(buildout_directory, 'etc/projects')
-    path = os.path.join(buildout_directory, 'etc/projects/downloads.ini')
-    conf = open(path, 'w')
     project_downloads = buildout['project_downloads']
     downloads_path = project_downloads['path']
     downloads_url = project_downloads['url']
     exclude_projects = project_downloads['exclude_projects'].split('\n')
     downloads_folders = buildout['project_downloads_folder']
-    for project, db, commondb in dbs:
+    results = []
+    for project, db, commondb in get_registry(dbs):
         if project in exclude_projects:
             continue
         # Add project to downloads path
@@ -541,35 +1645,1015 @@ def downloads(buildout, buildout_directory, dbs):
             # Add folder to downloads path
             path = os.path.join(path, folder)
             url = urlparse.urljoin(url, "%s/" % folder)
-        conf.write("""[%s]\n""" % project)
-        conf.write("""path = %s\n""" % path)
-        conf.write("""url = %s\n""" % url)
-        conf.write("""DB = %s\n""" % db)
-        conf.write("""COMMONDB = %s\n\n""" % commondb)
-    conf.close()
+        results.append((project, path, url, db, commondb))
+    return results
+
+
+def downloads(buildout, buildout_directory, dbs):
+    """
+    Create the downloads configuration.
+    """
+    make_path(buildout_directory, 'etc/projects')
+    conf_path = os.path.join(buildout_directory, 'etc/projects/downloads.ini')
+    conf = []
+    for project, path, url, db, commondb in get_project_downloads(buildout,
+                                                                  dbs):
+        conf.append("""[%s]\n""" % project)
+        conf.append("""path = %s\n""" % path)
+        conf.append("""url = %s\n""" % url)
+        conf.append("""DB = %s\n""" % db)
+        conf.append("""COMMONDB = %s\n\n""" % commondb)
+    write_file(conf_path, ''.join(conf))
+
+
+def get_bundle(dbs, project_users, project_parameters, parameters,
+               project_downloads):
+    """
+    Return the content of all the project configuration files as a single
+    dictionary, with lookup tables by project and by parameter.
+    """
+    download_paths = {}
+    for project, path, url, db, commondb in project_downloads:
+        download_paths[project] = {'path': path, 'url': url}
+    projects = {}
+    for project, db, commondb in get_registry(dbs):
+        projects[project] = {'dbs': {'RNAseqPipeline': db,
+                                     'RNAseqPipelineCommon': commondb},
+                             'users': project_users[project],
+                             'parameters': project_parameters[project],
+                             'download': download_paths.get(project)}
+    columns = {}
+    for key, parameter in parameters.items():
+        columns[key] = parameter['column']
+    return {'format': BUNDLE_FORMAT,
+            'projects': projects,
+            'parameters': parameters,
+            'columns': columns}
+
+
+def bundle_json(buildout_directory, bundle):
+    """
+    Write the bundle of the project configuration, so that the servers
+    can load it with a single read instead of parsing the ini files:
+
+    etc/bundle.json
+
+    Its digest is the SHA1 of the bundle without the digest, so it only
+    changes along with the content.
+    """
+    make_path(buildout_directory, 'etc')
+    path = os.path.join(buildout_directory, 'etc/bundle.json')
+    content = json.dumps(bundle, sort_keys=True, separators=(',', ':'))
+    bundle = dict(bundle)
+    bundle['digest'] = hashlib.sha1(content).hexdigest()
+    write_file(path, json.dumps(bundle, sort_keys=True, separators=(',', ':')))
+
+
+class Context(object):
+    """
+    The values needed by the generators, computed from the buildout and the
+    staging area.
+    """
+
+    def __init__(self, buildout, buildout_directory, staging, options,
+                 manifest):
+        self.buildout = buildout
+        self.buildout_directory = buildout_directory
+        self.staging = staging
+        self.options = options
+        self.manifest = manifest
+        self.values = {}
+
+    def profiles_fingerprint(self):
+        """
+        Return the size, modification time and digest of profiles.csv.
+        """
+        path = os.path.join(self.staging, 'profiles.csv')
+        digest = self.manifest.fingerprint(path)
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime, digest
+
+    def __getitem__(self, name):
+        return self.values[name]
+
+    def compute(self, name):
+        """
+        Compute a value, once the values it requires are computed.
+        """
+        self.values[name] = VALUES[name][1](self)
+
+
+# The values computed by main, with the values they require
+VALUES = {
+    'profiles': ([],
+                 lambda c: load_profiles(c.staging,
+                                         os.path.join(c.buildout_directory,
+                                                      PROFILES_CACHE),
+                                         c.profiles_fingerprint())),
+    'profile_counts': (['profiles'],
+                       lambda c: c['profiles'][2]),
+    'versions': (['profiles'],
+                 lambda c: c['profiles'][3]),
+    'groups': (['projects', 'profile_counts'],
+               lambda c: get_groups(c.buildout, c.options, c['projects'],
+                                    c['profile_counts'])),
+    'registry': (['profiles'],
+                 lambda c: ProjectRegistry(c['profiles'][1])),
+    'projects': (['registry'],
+                 lambda c: c['registry'].projects),
+    'project_users': (['projects'],
+                      lambda c: get_project_users(c.buildout, c['projects'])),
+    'waitress': ([],
+                 lambda c: get_waitress_settings(c.options)),
+    'project_downloads': (['registry'],
+                          lambda c: get_project_downloads(c.buildout,
+                                                          c['registry'])),
+    'bundle': (['registry', 'project_users', 'project_parameters',
+                'parameters', 'project_downloads'],
+               lambda c: get_bundle(c['registry'],
+                                    c['project_users'],
+                                    c['project_parameters'],
+                                    c['parameters'],
+                                    c['project_downloads'])),
+    'services': (['groups'],
+                 lambda c: get_services(c.options, groups=c['groups'])),
+    'cache': ([],
+              lambda c: get_cache_settings(c.buildout_directory, c.options)),
+    'tasks': (['cache'],
+              lambda c: get_tasks(c.buildout_directory, c['cache'],
+                                  get_flag(c.options, 'cache-warming'))),
+    'log': ([],
+            lambda c: get_log_settings(c.buildout, c.options)),
+    'filters': (['log', 'waitress'],
+                lambda c: get_filters(c.buildout_directory, c.options,
+                                      c['log'], c['waitress'])),
+    'pool': (['services', 'waitress'],
+             lambda c: get_pool_settings(c['services'], c['waitress'],
+                                         c.buildout.get('mysql_pool'))),
+    'parameters': ([],
+                   lambda c: get_parameters(c.buildout)),
+    'project_parameters': (['projects'],
+                           lambda c: get_project_parameters(c.buildout,
+                                                            c['projects'])),
+    }
+
+# The generators run by main, with the values they require, the inputs their
+# output depends on, being either profiles.csv or buildout sections, and the
+# paths they produce, possibly as patterns when they depend on the groups.
+GENERATORS = [
+    ('projects_ini',
+     ['projects'],
+     ['profiles.csv'],
+     ['etc/projects/projects.ini'],
+     lambda c: projects_ini(c.buildout_directory, c['projects'])),
+    ('versions_ini',
+     ['versions'],
+     ['profiles.csv'],
+     [VERSIONS],
+     lambda c: versions_ini(c.buildout_directory, c['versions'])),
+    ('databases_ini',
+     ['registry'],
+     ['profiles.csv', 'database_connections', 'database_projects'],
+     ['etc/databases/databases.ini'],
+     lambda c: databases_ini(c.buildout_directory, c['registry'],
+                             get_database_routes(c.buildout,
+                                                 c['registry']))),
+    ('pyramid_projects_ini',
+     ['projects', 'project_users'],
+     ['profiles.csv', 'project_users'],
+     ['etc/pyramid/projects.ini'],
+     lambda c: pyramid_projects_ini(c.buildout_directory,
+                                    c['projects'],
+                                    c['project_users'])),
+    ('misc_parameters_ini',
+     ['parameters'],
+     ['parameter_vocabulary', 'parameter_categories', 'parameter_types',
+      'parameter_columns'],
+     ['etc/misc/parameters.ini'],
+     lambda c: misc_parameters_ini(c.buildout_directory, c['parameters'])),
+    ('misc_project_parameters_ini',
+     ['project_parameters'],
+     ['profiles.csv', 'project_parameters'],
+     ['etc/misc/project_parameters.ini'],
+     lambda c: misc_project_parameters_ini(c.buildout_directory,
+                                           c['project_parameters'])),
+    ('connections_mysql_ini',
+     ['pool'],
+     ['options', 'mysql_pool', 'profiles.csv', 'project_groups',
+      'database_connections'],
+     ['etc/connections/mysql.ini'],
+     lambda c: connections_mysql_ini(c.buildout_directory, c['pool'],
+                                     c.buildout.get('mysql_pool'),
+                                     get_routed_connections(c.buildout))),
+    ('pyramid_development_ini',
+     [],
+     [],
+     ['etc/pyramid/development.ini'],
+     lambda c: pyramid_development_ini(c.buildout_directory)),
+    ('pyramid_production_ini',
+     ['waitress', 'log', 'filters'],
+     ['options', 'log_levels'],
+     ['etc/pyramid/production.ini'],
+     lambda c: pyramid_production_ini(c.buildout_directory, c['waitress'],
+                                      get_pyramid_settings(c.options),
+                                      log=c['log'], filters=c['filters'])),
+    ('restish_production_ini',
+     ['waitress', 'log', 'filters'],
+     ['options', 'log_levels'],
+     ['etc/restish/production.ini'],
+     lambda c: restish_production_ini(c.buildout_directory, c['waitress'],
+                                      True, log=c['log'],
+                                      filters=c['filters'],
+                                      static=get_static(c.options))),
+    ('cache_ini',
+     ['cache'],
+     ['options', 'project_cache_ttl'],
+     ['etc/restish/cache.ini', 'bin/raisin-cache-eviction'],
+     lambda c: (cache_ini(c.buildout_directory, c['cache'],
+                          get_cache_ttls(c.buildout)),
+                bin_script(c.buildout_directory, 'raisin-cache-eviction',
+                           'raisin.recipe.server.cache'))),
+    ('restish_development_ini',
+     [],
+     [],
+     ['etc/restish/development.ini'],
+     lambda c: restish_development_ini(c.buildout_directory)),
+    ('restish_raisin_restish_ini',
+     [],
+     [],
+     ['etc/restish/raisin.restish.ini'],
+     lambda c: restish_raisin_restish_ini(c.buildout_directory)),
+    ('pyramid_users_ini',
+     [],
+     [],
+     ['etc/pyramid/users.ini'],
+     lambda c: pyramid_users_ini(c.buildout_directory)),
+    ('supervisord_conf_development',
+     [],
+     [],
+     ['etc/supervisor/development.conf'],
+     lambda c: supervisord_conf(c.buildout_directory, "development")),
+    ('supervisord_conf_production',
+     ['services', 'tasks'],
+     ['options', 'profiles.csv', 'project_groups'],
+     ['etc/supervisor/production.conf'],
+     lambda c: supervisord_conf(c.buildout_directory, "production",
+                                c['services'], c['tasks'])),
+    ('proxy_conf',
+     ['services', 'waitress'],
+     ['options', 'profiles.csv', 'project_groups'],
+     ['etc/nginx/raisin.conf', 'etc/haproxy/haproxy.cfg'],
+     lambda c: proxy_conf(c.buildout_directory, c['services'], c['waitress'],
+                          c.options.get('proxy', 'nginx'),
+                          get_proxy_includes(c.buildout_directory,
+                                             c.options))),
+    ('group_configs',
+     ['groups', 'registry', 'project_users', 'services', 'waitress', 'log',
+      'filters'],
+     ['profiles.csv', 'project_groups', 'project_users',
+      'database_connections', 'database_projects', 'options', 'log_levels'],
+     [GROUPS, GROUPS + '/*/*.ini', 'etc/pyramid/production-*.ini',
+      'etc/restish/production-*.ini'],
+     lambda c: group_configs(c.buildout_directory, c['groups'],
+                             c['registry'],
+                             get_database_routes(c.buildout, c['registry']),
+                             c['project_users'], c['services'],
+                             c['waitress'],
+                             get_pyramid_settings(c.options), True,
+                             c['log'], c['filters'],
+                             get_static(c.options))),
+    ('nginx_downloads_conf',
+     ['project_downloads'],
+     ['profiles.csv', 'project_downloads', 'project_downloads_folder',
+      'options'],
+     ['etc/nginx/downloads.conf'],
+     lambda c: nginx_downloads_conf(c.buildout_directory,
+                                    c['project_downloads'],
+                                    get_sendfile_location(c.options))),
+    ('var_log_folder',
+     [],
+     [],
+     ['var/log'],
+     lambda c: var_log_folder(c.buildout_directory)),
+    ('downloads',
+     ['registry'],
+     ['profiles.csv', 'project_downloads', 'project_downloads_folder'],
+     ['etc/projects/downloads.ini'],
+     lambda c: downloads(c.buildout, c.buildout_directory, c['registry'])),
+    ('bundle_json',
+     ['bundle'],
+     ['profiles.csv', 'project_users', 'project_parameters',
+      'parameter_vocabulary', 'parameter_categories', 'parameter_types',
+      'parameter_columns', 'project_downloads', 'project_downloads_folder'],
+     ['etc/bundle.json'],
+     lambda c: bundle_json(c.buildout_directory, c['bundle'])),
+    ('indexes_sql',
+     ['registry', 'parameters', 'project_parameters'],
+     ['profiles.csv', 'parameter_vocabulary', 'parameter_categories',
+      'parameter_types', 'parameter_columns', 'project_parameters',
+      'options'],
+     [INDEXES],
+     lambda c: indexes_sql(c.buildout_directory, c['registry'],
+                           c['parameters'], c['project_parameters'],
+                           c.options.get('index-table', TABLE))),
+    ('warm_json',
+     ['projects', 'project_parameters', 'services'],
+     ['profiles.csv', 'project_parameters', 'project_warming', 'options'],
+     ['etc/restish/warm.json', 'bin/raisin-cache-warming'],
+     lambda c: (warm_json(c.buildout_directory,
+                          get_warming_paths(c['projects'],
+                                            c['project_parameters'],
+                                            get_warming_templates(c.options),
+                                            get_warming_priorities(
+                                                c.buildout)),
+                          'http://127.0.0.1:%s' %
+                          c['services']['restish']['port'],
+                          get_int(c.options, 'cache-warming-jobs', 4),
+                          get_int(c.options, 'cache-warming-errors', 10)),
+                bin_script(c.buildout_directory, 'raisin-cache-warming',
+                           'raisin.recipe.server.warm'))),
+    ('precompress_public',
+     [],
+     ['public files', 'options'],
+     [PUBLIC],
+     lambda c: precompress_public(c.buildout_directory, c.options)),
+    ('download_index',
+     ['project_downloads'],
+     ['download folders', 'options', 'project_downloads',
+      'project_downloads_folder', 'profiles.csv'],
+     [INDEX],
+     lambda c: download_index(c.buildout_directory,
+                              c['project_downloads'],
+                              c.options.get('download-checksum', 'md5'),
+                              get_int(c.options, 'download-index-threads',
+                                      DOWNLOAD_INDEX_THREADS))),
+    ]
+
+# The generators only run when an option of the server part is true
+OPTIONAL_GENERATORS = {'download_index': 'download-index',
+                       'nginx_downloads_conf': 'download-sendfile',
+                       'warm_json': 'cache-warming',
+                       'precompress_public': 'compression'}
+
+# The inputs that are not tracked by the manifest, so that the generators
+# depending on them always run
+UNTRACKED_INPUTS = ['download folders', 'public files']
+
+# The number of files checksummed at the same time when indexing downloads
+DOWNLOAD_INDEX_THREADS = 8
+
+# The internal nginx location of the downloads, unless the download-location
+# option of the server part says otherwise
+SENDFILE_LOCATION = '/raisin-downloads/'
+
+# The version of the layout of etc/bundle.json
+BUNDLE_FORMAT = 1
+
+# The host and port of the services, before the ports of their workers
+SERVICES = {'restish': ('127.0.0.1', 6464),
+            'pyramid': ('0.0.0.0', 7777)}
+
+# The backends of the response cache of the restish server
+CACHE_BACKENDS = ('file', 'dbm', 'memory')
+
+# The paths of the resources requested to warm the cache, unless the
+# cache-warming-resources option of the server part says otherwise
+WARMING_TEMPLATES = ('/project/%(project)s',
+                     '/project/%(project)s/%(parameters)s')
+
+# The seconds bin/raisin-cache-warming waits for the restish server to start,
+# and for each resource
+WARMING_WAIT = 120
+WARMING_TIMEOUT = 300
+
+# The multipliers of the units of sizes
+SIZE_UNITS = {'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+
+# Where the profiles of the requests are dumped, relative to the buildout
+# directory
+PROFILES = 'var/profiles'
+
+# The share of the requests profiled, unless the profiling-rate option of
+# the server part says otherwise
+PROFILING_RATE = 0.01
+
+# The seconds the clients may use a response for a project without asking
+# again, unless the http-max-age option of the server part says otherwise
+HTTP_MAX_AGE = 300
+
+# The ways of exporting the metrics of the workers
+METRICS_EXPORTS = ('admin', 'statsd')
+
+# The admin port of each worker is its port plus this offset, unless the
+# metrics-port-offset option of the server part says otherwise
+METRICS_PORT_OFFSET = 1000
+
+# The statsd server the metrics are pushed to, unless the metrics-statsd
+# option of the server part says otherwise
+METRICS_STATSD = '127.0.0.1:8125'
+
+# The levels of the loggers in the log_levels section
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARN', 'WARNING', 'ERROR', 'CRITICAL')
+
+# The pool settings of each MySQL connection in mysql.ini
+POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_recycle', 'connect_timeout')
+
+# The connections MySQL accepts, unless the max_connections option of the
+# mysql_pool section says otherwise
+MAX_CONNECTIONS = 151
+
+# The number of generators run at the same time, unless the jobs option of
+# the server part says otherwise
+JOBS = 4
+
+
+def input_digest(manifest, context, name):
+    """
+    Return the digest of an input of a generator: profiles.csv, the options
+    of the server part together with the number of CPUs, or a buildout
+    section.
+    """
+    if name in UNTRACKED_INPUTS:
+        return None
+    if name == 'profiles.csv':
+        return manifest.fingerprint(os.path.join(context.staging, name))
+    if name == 'options':
+        options = dict(context.options)
+        options[' cpus'] = str(get_cpu_count())
+        return section_digest(options)
+    return section_digest(context.buildout.get(name))
+
+
+def get_int(options, name, default, minimum=1):
+    """
+    Return the value of an integer option.
+    """
+    value = options.get(name)
+    if value is None or not value.strip():
+        return default
+    value = int(value)
+    if value < minimum:
+        raise ValueError('The %s option must be at least %s: %s' % (name,
+                                                                    minimum,
+                                                                    value))
+    return value
+
+
+def get_jobs(options):
+    """
+    Return the number of generators to run at the same time.
+    """
+    return get_int(options, 'jobs', JOBS)
+
+
+def get_cpu_count():
+    """
+    Return the number of CPUs of the machine.
+    """
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def get_services(options, cpus=None, groups=None):
+    """
+    Return the host, port and number of workers of the restish and Pyramid
+    services used in production.
+
+    The proxy listens on the port of each service, and spreads the requests
+    over the workers. The number of workers defaults to the number of CPUs.
+
+    Each group of projects has its own restish and Pyramid services, like
+    restish_group1, only listening locally on the port of the shared
+    service plus a multiple of the gap between groups, with the projects of
+    the group.
+
+    The ports of the services, of their workers and of the admin ports of
+    the workers must all differ.
+    """
+    if cpus is None:
+        cpus = get_cpu_count()
+    workers = get_int(options, 'workers', cpus)
+    services = {}
+    for name, (host, port) in SERVICES.items():
+        services[name] = {'host': host,
+                          'port': get_int(options, '%s-port' % name, port),
+                          'workers': get_int(options, '%s-workers' % name,
+                                             workers)}
+    for name in SERVICES.keys():
+        group_workers = get_int(options, 'group-workers',
+                                services[name]['workers'])
+        gap = GROUP_PORTS * (max(services[name]['workers'],
+                                 group_workers) // GROUP_PORTS + 1)
+        for index, (group, projects) in enumerate(groups or []):
+            services['%s_%s' % (name, group)] = {
+                'host': '127.0.0.1',
+                'port': services[name]['port'] + gap * (index + 1),
+                'workers': group_workers,
+                'projects': projects}
+    check_ports(services, get_admin_offset(options))
+    return services
+
+
+def get_admin_offset(options):
+    """
+    Return the offset of the admin ports of the workers from their ports,
+    or None when the workers have no admin port.
+    """
+    if options.get('metrics', '').strip() != 'admin':
+        return None
+    return get_int(options, 'metrics-port-offset', METRICS_PORT_OFFSET)
+
+
+def check_ports(services, offset=None):
+    """
+    Check that the services, their workers and the admin ports of the
+    workers, when given their offset, all listen on different ports.
+    """
+    used = {}
+    for name in sorted(services.keys()):
+        service = services[name]
+        ports = [(service['port'], 'service %s' % name)]
+        for port in get_worker_ports(service):
+            ports.append((port, 'worker %s:%s' % (name, port)))
+            if offset is not None:
+                ports.append((port + offset, 'admin port of worker %s:%s' % (
+                    name, port)))
+        for port, user in ports:
+            if port in used:
+                raise ValueError('Port %s is used by both the %s and the %s, '
+                                 'change the ports, workers or '
+                                 'metrics-port-offset options' % (
+                                     port, used[port], user))
+            used[port] = user
+
+
+def get_waitress_settings(options, cpus=None):
+    """
+    Return the settings of the waitress servers used in production, scaled
+    to the number of CPUs unless given by the options of the server part.
+    """
+    if cpus is None:
+        cpus = get_cpu_count()
+    threads = get_int(options, 'threads', max(4, 2 * cpus))
+    return {'threads': threads,
+            'connection_limit': get_int(options, 'connection-limit',
+                                        max(100, 25 * threads)),
+            'channel_timeout': get_int(options, 'channel-timeout', 60),
+            'backlog': get_int(options, 'backlog', max(1024, 256 * cpus))}
+
+
+def get_pool_settings(services, settings, section=None):
+    """
+    Return the default pool settings of the MySQL connections.
+
+    Each worker keeps a connection per thread, with as many more in bursts,
+    as long as all the workers together stay within the connections MySQL
+    accepts. Only the restish workers connect to MySQL.
+    """
+    if section is None:
+        section = {}
+    workers = sum([service['workers'] for name, service in services.items()
+                   if name.split('_')[0] == 'restish'])
+    connections = get_int(section, 'max_connections', MAX_CONNECTIONS)
+    share = max(1, connections // max(1, workers))
+    threads = settings['threads']
+    pool_size = min(threads, share)
+    return {'pool_size': pool_size,
+            'max_overflow': max(0, min(threads, share - pool_size)),
+            'pool_recycle': 3600,
+            'connect_timeout': 10}
+
+
+def get_size(options, name, default):
+    """
+    Return the value of a size option in bytes, given in bytes or with one
+    of the KB, MB and GB units.
+    """
+    value = options.get(name)
+    if value is None or not value.strip():
+        return default
+    value = value.strip().upper()
+    unit = SIZE_UNITS.get(value[-2:], 1)
+    if unit > 1:
+        value = value[:-2]
+    size = int(value) * unit
+    if size < 1:
+        raise ValueError('The %s option must be a positive size: %s' % (
+            name, options[name]))
+    return size
+
+
+def get_cache_settings(buildout_directory, options):
+    """
+    Return the settings of the response cache of the restish server.
+    """
+    backend = options.get('cache-backend', 'file')
+    if backend not in CACHE_BACKENDS:
+        raise ValueError('The cache-backend option must be one of %s: %s' % (
+            ', '.join(CACHE_BACKENDS), backend))
+    path = os.path.join(buildout_directory, 'etc/restish/cache')
+    if backend == 'dbm':
+        path = os.path.join(path, 'cache.db')
+    return {'backend': backend,
+            'path': path,
+            'max_size': get_size(options, 'cache-max-size', SIZE_UNITS['GB']),
+            'ttl': get_int(options, 'cache-ttl', 3600),
+            'levels': get_int(options, 'cache-levels', 2, 0),
+            'interval': get_int(options, 'cache-eviction-interval', 600)}
+
+
+def get_cache_ttls(buildout):
+    """
+    Return the TTL of the cached responses of the projects given in the
+    project_cache_ttl section.
+    """
+    section = buildout.get('project_cache_ttl') or {}
+    ttls = {}
+    for project in section.keys():
+        ttls[project] = get_int(section, project, None)
+    return ttls
+
+
+def get_tasks(buildout_directory, cache, warming=False):
+    """
+    Return the programs supervisord starts after the servers in production,
+    with their commands and settings.
+
+    The file backend of the cache is kept within its size by a program
+    evicting responses periodically. The other backends are bounded by the
+    restish server itself. When warming, a program run once after the
+    servers started requests their expensive resources.
+    """
+    tasks = []
+    if cache['backend'] == 'file':
+        command = '%s --config %s --interval %s' % (
+            os.path.join(buildout_directory, 'bin/raisin-cache-eviction'),
+            os.path.join(buildout_directory, 'etc/restish/cache.ini'),
+            cache['interval'])
+        tasks.append(('cache_eviction', command, [('priority', 30)]))
+    if warming:
+        command = '%s --config %s' % (
+            os.path.join(buildout_directory, 'bin/raisin-cache-warming'),
+            os.path.join(buildout_directory, 'etc/restish/warm.json'))
+        tasks.append(('cache_warming', command, [('priority', 40),
+                                                 ('autorestart', 'false'),
+                                                 ('startsecs', 0),
+                                                 ('startretries', 0)]))
+    return tasks
+
+
+def get_warming_templates(options):
+    """
+    Return the templates of the paths of the resources requested to warm
+    the cache, in their order.
+    """
+    templates = options.get('cache-warming-resources')
+    if templates is None or not templates.strip():
+        return list(WARMING_TEMPLATES)
+    return templates.split()
+
+
+def get_warming_priorities(buildout):
+    """
+    Return the priority of the projects given in the project_warming
+    section.
+    """
+    section = buildout.get('project_warming') or {}
+    priorities = {}
+    for project in section.keys():
+        priorities[project] = int(section[project])
+    return priorities
+
+
+def get_log_settings(buildout, options):
+    """
+    Return the log settings of the servers in production, or None to log
+    warnings to stderr.
+
+    The levels of the loggers are given by the log_levels section, root
+    being the root logger.
+    """
+    levels = dict((buildout.get('log_levels') or {}).items())
+    for name, level in levels.items():
+        level = level.strip().upper()
+        if level not in LOG_LEVELS:
+            raise ValueError('The level of the %s logger must be one of %s: '
+                             '%s' % (name, ', '.join(LOG_LEVELS), level))
+        levels[name] = level
+    files = get_flag(options, 'log-files')
+    sampling = options.get('access-log-sampling')
+    if sampling is not None and sampling.strip():
+        sampling = float(sampling)
+        if not 0 < sampling <= 1:
+            raise ValueError('The access-log-sampling option must be between '
+                             '0 and 1: %s' % sampling)
+    else:
+        sampling = None
+    if not levels and not files and sampling is None:
+        return None
+    return {'levels': levels,
+            'files': files,
+            'max_bytes': get_size(options, 'log-max-bytes',
+                                  10 * SIZE_UNITS['MB']),
+            'backups': get_int(options, 'log-backups', 5, 0),
+            'buffer': get_int(options, 'log-buffer', 100),
+            'sampling': sampling}
+
+
+def get_filters(buildout_directory, options, log, settings=None):
+    """
+    Return the WSGI filters the requests go through in production, the
+    outermost first, each with the list of its settings.
+    """
+    filters = []
+    if log is not None and log['sampling'] is not None:
+        filters.append(('translogger',
+                        [('use', 'egg:Paste#translogger'),
+                         ('setup_console_handler', 'false'),
+                         ('logger_name', 'wsgi')]))
+    metrics = get_metrics_settings(options, settings)
+    if metrics is not None:
+        filters.append(('metrics', metrics))
+    if get_flag(options, 'http-caching'):
+        filters.append(('conditional',
+                        [('use', 'egg:raisin.recipe.server#conditional'),
+                         ('versions', os.path.join(buildout_directory,
+                                                   VERSIONS)),
+                         ('max_age', get_int(options, 'http-max-age',
+                                             HTTP_MAX_AGE, 0))]))
+    if get_flag(options, 'compression'):
+        filters.append(('compression', get_compression_settings(options)))
+    if get_flag(options, 'profiling'):
+        filters.append(('profiling', get_profiling_settings(buildout_directory,
+                                                            options)))
+    return filters
+
+
+def get_metrics_settings(options, settings=None):
+    """
+    Return the settings of the filter measuring the requests, or None when
+    the metrics option of the server part is not set.
+
+    The projects labelling the metrics are read from the shared
+    projects.ini, next to the production inis of both servers.
+    """
+    export = options.get('metrics', '').strip()
+    if not export:
+        return None
+    if export not in METRICS_EXPORTS:
+        raise ValueError('The metrics option must be one of %s: %s' % (
+            ', '.join(METRICS_EXPORTS), export))
+    if settings is None:
+        settings = get_waitress_settings(options)
+    metrics = [('use', 'egg:raisin.recipe.server#metrics'),
+               ('projects', '%(here)s/../projects/projects.ini'),
+               ('export', export),
+               ('threads', settings['threads'])]
+    if export == 'admin':
+        metrics.append(('port_offset', get_int(options, 'metrics-port-offset',
+                                               METRICS_PORT_OFFSET)))
+    else:
+        metrics.append(('statsd', options.get('metrics-statsd',
+                                              METRICS_STATSD).strip()))
+        metrics.append(('interval', get_int(options, 'metrics-interval', 10)))
+    buckets = options.get('metrics-buckets', '').split()
+    if buckets:
+        metrics.append(('buckets', ' '.join([str(int(bucket))
+                                             for bucket in buckets])))
+    routes = options.get('metrics-routes')
+    if routes is not None:
+        metrics.append(('routes', ' '.join(routes.split())))
+    return metrics
+
+
+def get_compression_settings(options):
+    """
+    Return the settings of the filter compressing the responses.
+    """
+    types = options.get('compression-types', '').split() or list(TYPES)
+    return [('use', 'egg:raisin.recipe.server#compression'),
+            ('min_size', get_size(options, 'compression-min-size', MIN_SIZE)),
+            ('types', ' '.join(types)),
+            ('level', get_compression_level(options, 'compression-level', 6))]
+
+
+def get_compression_level(options, name, default):
+    """
+    Return the value of a compression level option, from 1 to 9.
+    """
+    level = get_int(options, name, default)
+    if level > 9:
+        raise ValueError('The %s option must be at most 9: %s' % (name,
+                                                                  level))
+    return level
 
 
-def main(buildout, buildout_directory, staging):
+def get_static(options):
+    """
+    Return the application serving the static files of the restish server,
+    serving their compressed copies when compressing.
+    """
+    if get_flag(options, 'compression'):
+        return 'egg:raisin.recipe.server#static'
+    return STATIC
+
+
+def precompress_public(buildout_directory, options):
+    """
+    Compress the static files of the restish server that changed since
+    they were last compressed.
+    """
+    written, removed = precompress(os.path.join(buildout_directory, PUBLIC),
+                                   get_size(options, 'compression-min-size',
+                                            MIN_SIZE),
+                                   level=get_compression_level(
+                                       options, 'precompression-level', 9))
+    logger.info('Compressed %s static files, removed %s compressed copies' % (
+        written, removed))
+
+
+def get_profiling_settings(buildout_directory, options):
+    """
+    Return the settings of the filter profiling a sample of the requests.
+    """
+    rate = float(options.get('profiling-rate', '').strip() or PROFILING_RATE)
+    if not 0 <= rate <= 1:
+        raise ValueError('The profiling-rate option must be between 0 and 1: '
+                         '%s' % rate)
+    settings = [('use', 'egg:raisin.recipe.server#profiling'),
+                ('folder', os.path.join(buildout_directory, PROFILES)),
+                ('rate', repr(rate))]
+    prefixes = options.get('profiling-paths', '').split()
+    if prefixes:
+        settings.append(('prefixes', ' '.join(prefixes)))
+    settings.append(('interval', get_int(options, 'profiling-interval', 60)))
+    settings.append(('keep', get_int(options, 'profiling-keep', 24)))
+    return settings
+
+
+def get_flag(options, name, default=False):
+    """
+    Return the value of a true or false option.
+    """
+    value = options.get(name)
+    if value is None:
+        return default
+    value = value.strip().lower()
+    if value in ('true', 'yes', 'on', '1'):
+        return True
+    if value in ('false', 'no', 'off', '0', ''):
+        return False
+    raise ValueError('The %s option must be true or false: %s' % (name,
+                                                                  value))
+
+
+def output_paths(buildout_directory, outputs, known=()):
+    """
+    Return the paths of the outputs of a generator, expanding the patterns
+    to the files there are, together with the known paths, so that the
+    files removed since are noticed.
+    """
+    paths = set(known)
+    for output in outputs:
+        path = os.path.join(buildout_directory, output)
+        if '*' in output:
+            paths.update(glob.glob(path))
+        else:
+            paths.add(path)
+    return sorted(paths)
+
+
+def add_values(graph, context, requires):
+    """
+    Add the computation of the required values, and of the values these
+    require in turn, to the graph of tasks.
+    """
+    for name in requires:
+        if name not in graph:
+            value_requires = VALUES[name][0]
+            graph[name] = (value_requires,
+                           lambda name=name: context.compute(name))
+            add_values(graph, context, value_requires)
+
+
+def plan_generators(context, manifest, incremental=False):
+    """
+    Return the graph of the generators to run, with the values they
+    require, and the name, inputs key and outputs of each of them, for the
+    manifest.
+
+    When incremental, the generators whose inputs and outputs did not change
+    since they were last run are left out.
+    """
+    buildout_directory = context.buildout_directory
+    digests = {}
+    graph = {}
+    records = []
+    for name, requires, inputs, outputs, generator in GENERATORS:
+        if name in OPTIONAL_GENERATORS and \
+           not get_flag(context.options, OPTIONAL_GENERATORS[name]):
+            continue
+        for input_name in inputs:
+            if input_name not in digests:
+                digests[input_name] = input_digest(manifest, context,
+                                                   input_name)
+        key = inputs_key([buildout_directory] +
+                         [(i, digests[i]) for i in inputs])
+        paths = output_paths(buildout_directory, outputs,
+                             manifest.outputs(name))
+        untracked = [i for i in inputs if i in UNTRACKED_INPUTS]
+        if incremental and not untracked and \
+           manifest.is_current(name, key, paths):
+            logger.info('Skipping unchanged: %s' % name)
+            continue
+        add_values(graph, context, requires)
+        graph[name] = (requires,
+                       lambda generator=generator: generator(context))
+        records.append((name, key, outputs))
+    return graph, records
+
+
+def start_report(options):
+    """
+    Return the report of the stages of main, measuring the first one,
+    when the report option of the server part is true.
+    """
+    if not get_flag(options, 'report'):
+        return None
+    report = Report()
+    report.begin('manifest')
+    return report
+
+
+def measure_tasks(report, graph):
+    """
+    Measure each task of the graph in the report, if any.
+    """
+    if report is None:
+        return
+    report.end()
+    for name, (requires, task) in graph.items():
+        graph[name] = (requires, report.measure(name, task))
+
+
+def save_report(report, buildout_directory):
+    """
+    Log and write the report, if any.
+    """
+    if report is None:
+        return
+    report.log()
+    report.save(os.path.join(buildout_directory, REPORT))
+
+
+def run_generators(graph, options, reload_mode=None):
+    """
+    Run the tasks of the graph, and return the files written when they are
+    to be reloaded.
+    """
+    if not reload_mode:
+        run_graph(graph, get_jobs(options))
+        return []
+    track_changes()
+    try:
+        run_graph(graph, get_jobs(options))
+    finally:
+        written = stop_tracking()
+    return written
+
+
+def main(buildout, buildout_directory, staging, incremental=False,
+         options=None):
     """
     Produce the configuration files for the servers.
+
+    When incremental, the generators whose inputs and outputs did not change
+    since they were last run are skipped. The values needed by the other
+    generators are computed, and the generators run as soon as the values
+    they require are available, using as many threads as the jobs option
+    of the server part allows.
+
+    When the reload option of the server part is given, the services whose
+    files were written are then reloaded through supervisord.
     """
-    profiles = get_profiles(staging)
-    projects = get_projects(profiles)
-    projects_ini(buildout_directory, projects)
-    dbs = get_dbs(profiles)
-    databases_ini(buildout_directory, dbs)
-    project_users = get_project_users(buildout, projects)
-    pyramid_projects_ini(buildout_directory, projects, project_users)
-    parameters = get_parameters(buildout)
-    misc_parameters_ini(buildout_directory, parameters)
-    project_parameters = get_project_parameters(buildout, projects)
-    misc_project_parameters_ini(buildout_directory, project_parameters)
-    connections_mysql_ini(buildout_directory)
-    pyramid_development_ini(buildout_directory)
-    restish_development_ini(buildout_directory)
-    restish_raisin_restish_ini(buildout_directory)
-    pyramid_users_ini(buildout_directory)
-    supervisord_conf(buildout_directory, "development")
-    supervisord_conf(buildout_directory, "production")
-    var_log_folder(buildout_directory)
-    downloads(buildout, buildout_directory, dbs)
+    if options is None:
+        options = {}
+    reload_mode = options.get('reload', '').strip()
+    if reload_mode:
+        check_mode(reload_mode)
+    report = start_report(options)
+    manifest = Manifest(os.path.join(buildout_directory, MANIFEST))
+    context = Context(buildout, buildout_directory, staging, options,
+                      manifest)
+    graph, records = plan_generators(context, manifest, incremental)
+    measure_tasks(report, graph)
+    written = run_generators(graph, options, reload_mode)
+    for name, key, outputs in records:
+        manifest.record(name, key, output_paths(buildout_directory, outputs))
+    manifest.save()
+    save_report(report, buildout_directory)
+    if reload_mode:
+        reload_services(buildout_directory, written, reload_mode,
+                        options.get('supervisor-url', SUPERVISOR_URL))
@@ -0,0 +1,143 @@
+"""
+Write the SQL scripts creating the indexes on the columns the servers
+filter the RNAseqPipeline databases on.
+"""
+
+import os
+import hashlib
+import logging
+from raisin.recipe.server.output import write_file
+
+logger = logging.getLogger('raisin.recipe.server.sql')
+
+# Where the scripts are written, relative to the buildout directory
+INDEXES = 'etc/databases/indexes'
+
+# The table filtered on the parameter columns, unless the index-table option
+# of the server part says otherwise
+TABLE = 'experiments'
+
+# The most columns MySQL accepts in an index
+MAX_COLUMNS = 16
+
+# The longest name MySQL accepts for an index
+MAX_NAME = 64
+
+
+def quote_name(name):
+    """
+    Return a MySQL identifier quoted with backticks.
+    """
+    return '`%s`' % name.replace('`', '``')
+
+
+def quote_string(value):
+    """
+    Return a MySQL string literal.
+    """
+    return "'%s'" % value.replace('\\', '\\\\').replace("'", "''")
+
+
+def index_name(columns):
+    """
+    Return the name of the index on the given columns, shortened with a
+    digest when too long for MySQL.
+    """
+    name = 'raisin_%s' % '_'.join(columns)
+    if len(name) > MAX_NAME:
+        name = 'raisin_%s' % hashlib.sha1('\t'.join(columns)).hexdigest()[:16]
+    return name
+
+
+def get_indexes(parameters, project_parameters):
+    """
+    Return the list of the indexes of a project, each a list of columns.
+
+    The columns of the project parameters, in their order, make a composite
+    index. Every column of the parameters, as any of them can be filtered
+    on, has its own index, unless it leads the composite index, the columns
+    of the project first. Parameters without a column are left out.
+    """
+    columns = []
+    for parameter in list(project_parameters) + sorted(parameters.keys()):
+        if parameter not in parameters:
+            continue
+        column = parameters[parameter]['column']
+        if column and column not in columns:
+            columns.append(column)
+    composite = [parameters[parameter]['column']
+                 for parameter in project_parameters
+                 if parameter in parameters]
+    composite = [column for index, column in enumerate(composite)
+                 if column and column not in composite[:index]]
+    indexes = []
+    if len(composite) > 1:
+        indexes.append(composite[:MAX_COLUMNS])
+        columns.remove(composite[0])
+    for column in columns:
+        indexes.append([column])
+    return indexes
+
+
+def create_index(db, table, columns):
+    """
+    Return the SQL statements creating an index unless it already exists.
+    """
+    name = index_name(columns)
+    create = 'CREATE INDEX %s ON %s (%s)' % (
+        quote_name(name), quote_name(table),
+        ', '.join([quote_name(column) for column in columns]))
+    return ("SET @missing = (SELECT COUNT(*) = 0"
+            " FROM information_schema.statistics"
+            " WHERE table_schema = %s AND table_name = %s"
+            " AND index_name = %s);\n"
+            "SET @statement = IF(@missing, %s, 'DO 0');\n"
+            "PREPARE statement FROM @statement;\n"
+            "EXECUTE statement;\n"
+            "DEALLOCATE PREPARE statement;\n" % (quote_string(db),
+                                                 quote_string(table),
+                                                 quote_string(name),
+                                                 quote_string(create)))
+
+
+def indexes_sql(buildout_directory, dbs, parameters, project_parameters,
+                table=TABLE):
+    """
+    Write the script creating the indexes of the DB of every project, which
+    can be run again and again:
+
+    etc/databases/indexes/Test.sql
+
+    Like this:
+
+    USE `Test_RNAseqPipeline`;
+    SET @missing = (SELECT COUNT(*) = 0 FROM information_schema.statistics
+    ...);
+    SET @statement = IF(@missing, 'CREATE INDEX `raisin_read_length` ON
+    `experiments` (`read_length`)', 'DO 0');
+    PREPARE statement FROM @statement;
+    EXECUTE statement;
+    DEALLOCATE PREPARE statement;
+
+    The scripts of projects without indexes or no longer configured are
+    removed.
+    """
+    folder = os.path.join(buildout_directory, INDEXES)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    written = set()
+    for project_id, db, commondb in dbs:
+        indexes = get_indexes(parameters,
+                              project_parameters.get(project_id, []))
+        if not indexes:
+            continue
+        sql = ['USE %s;\n' % quote_name(db)]
+        for columns in indexes:
+            sql.append(create_index(db, table, columns))
+        name = '%s.sql' % project_id
+        written.add(name)
+        write_file(os.path.join(folder, name), ''.join(sql))
+    for name in os.listdir(folder):
+        if name.endswith('.sql') and name not in written:
+            logger.info('Removing index script: %s' % name)
+            os.remove(os.path.join(folder, name))
@@ -0,0 +1,181 @@
+"""
+Benchmark raisin.recipe.server against large synthetic staging data.
+
+Run it with:
+
+  $ ./bin/python -m raisin.recipe.server.tests.benchmark --output bench.json
+
+The timings of every benchmark are written to the output file as JSON, so
+that they can be compared between versions of the recipe.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import optparse
+from raisin.recipe.server import server
+from raisin.recipe.server.manifest import VERSION
+
+# The columns of the synthetic profiles.csv, besides the ones the recipe
+# reads, so that rows are as wide as in a real staging area
+COLUMNS = ('project_id', 'accession', 'species', 'cell', 'partition',
+           'read_length', 'paired', 'DB', 'COMMONDB')
+
+
+def write_profiles(staging, projects, rows):
+    """
+    Write a profiles.csv with the given number of rows, spread evenly over
+    the given number of projects.
+    """
+    if not os.path.exists(staging):
+        os.makedirs(staging)
+    profiles = open(os.path.join(staging, 'profiles.csv'), 'w')
+    profiles.write('\t'.join(COLUMNS) + '\n')
+    for row in xrange(rows):
+        project = 'Project%05d' % (row % projects)
+        profiles.write('\t'.join([project,
+                                  'Accession%07d' % row,
+                                  'Homo sapiens',
+                                  'Cell%03d' % (row % 997),
+                                  'Partition%02d' % (row % 13),
+                                  str(36 + row % 4 * 20),
+                                  str(row % 2),
+                                  '%s_RNAseqPipeline' % project,
+                                  '%s_RNAseqPipelineCommon' % project,
+                                  ]) + '\n')
+    profiles.close()
+
+
+def make_buildout(projects, parameters):
+    """
+    Return buildout sections with the given number of parameters, and users
+    and parameters for every other project.
+    """
+    vocabulary = {}
+    categories = {}
+    types = {}
+    columns = {}
+    for number in range(parameters):
+        key = 'parameter%04d' % number
+        vocabulary[key] = 'Parameter %s' % number
+        categories[key] = 'experiment'
+        types[key] = 'string'
+        columns[key] = key
+    project_users = {}
+    project_parameters = {}
+    for number in range(0, projects, 2):
+        project = 'Project%05d' % number
+        project_users[project] = 'user%s\nraisin' % number
+        project_parameters[project] = 'parameter0000\nparameter0001'
+    return {'parameter_vocabulary': vocabulary,
+            'parameter_categories': categories,
+            'parameter_types': types,
+            'parameter_columns': columns,
+            'project_users': project_users,
+            'project_parameters': project_parameters,
+            'project_downloads': {'path': '/data/downloads',
+                                  'url': 'http://localhost/downloads/',
+                                  'exclude_projects': 'Project00000'},
+            'project_downloads_folder': {'Project00001': 'bam'},
+            }
+
+
+def timed(timings, name, repeat, function, *args):
+    """
+    Run a function repeatedly, record its fastest run under the given name,
+    and return its result.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        result = function(*args)
+        seconds = time.time() - start
+        if best is None or seconds < best:
+            best = seconds
+    timings[name] = best
+    return result
+
+
+def run_benchmarks(folder, projects, rows, parameters, repeat=1):
+    """
+    Run the benchmarks in the given folder, and return the timings.
+    """
+    staging = os.path.join(folder, 'staging')
+    buildout_directory = os.path.join(folder, 'buildout')
+    timings = {}
+    timed(timings, 'write_profiles', 1,
+          write_profiles, staging, projects, rows)
+    buildout = make_buildout(projects, parameters)
+    profiles = timed(timings, 'get_profiles', repeat,
+                     server.get_profiles, staging)
+    dbs = timed(timings, 'get_dbs', repeat, server.get_dbs, profiles)
+    del profiles
+    timed(timings, 'scan_profiles', repeat, server.scan_profiles, staging)
+    timed(timings, 'databases_ini', repeat,
+          server.databases_ini, buildout_directory, dbs)
+    timed(timings, 'downloads', repeat,
+          server.downloads, buildout, buildout_directory, dbs)
+    shutil.rmtree(buildout_directory)
+    timed(timings, 'main', 1,
+          server.main, buildout, buildout_directory, staging)
+    timed(timings, 'main_unchanged', repeat,
+          server.main, buildout, buildout_directory, staging)
+    timed(timings, 'main_incremental', repeat,
+          server.main, buildout, buildout_directory, staging, True)
+    return timings
+
+
+def main(argv=None):
+    """
+    Run the benchmarks and write their timings to the output file.
+    """
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--projects', type='int', default=10000,
+                      help='number of projects [%default]')
+    parser.add_option('--rows', type='int', default=1000000,
+                      help='number of rows in profiles.csv [%default]')
+    parser.add_option('--parameters', type='int', default=1000,
+                      help='number of parameters [%default]')
+    parser.add_option('--repeat', type='int', default=3,
+                      help='runs of each benchmark, keeping the fastest '
+                           '[%default]')
+    parser.add_option('--output', default='benchmark.json',
+                      help='file the timings are written to [%default]')
+    parser.add_option('--quiet', action='store_true', default=False,
+                      help='do not print the timings')
+    options = parser.parse_args(argv)[0]
+    folder = tempfile.mkdtemp(prefix='raisin.recipe.server.benchmark.')
+    try:
+        timings = run_benchmarks(folder,
+                                 options.projects,
+                                 options.rows,
+                                 options.parameters,
+                                 options.repeat)
+    finally:
+        shutil.rmtree(folder)
+    results = {'version': VERSION,
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'projects': options.projects,
+               'rows': options.rows,
+               'parameters': options.parameters,
+               'repeat': options.repeat,
+               'timings': timings}
+    output = open(options.output, 'w')
+    json.dump(results, output, indent=1, sort_keys=True)
+    output.close()
+    if not options.quiet:
+        names = timings.keys()
+        names.sort()
+        for name in names:
+            print '%-20s %10.3fs' % (name, timings[name])
+        print 'Writing: %s' % options.output
+
+
+if __name__ == '__main__':
+    sys.exit(main())
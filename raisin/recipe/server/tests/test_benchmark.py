@@ -0,0 +1,40 @@
+"""
+Test for raisin.recipe.server.tests.benchmark
+"""
+
+import os
+import json
+import unittest
+from pkg_resources import get_provider
+from raisin.recipe.server.tests.benchmark import main
+
+PROVIDER = get_provider('raisin.recipe.server')
+SANDBOX = PROVIDER.get_resource_filename("", 'tests/sandbox')
+
+
+class BenchmarkTests(unittest.TestCase):
+    """
+    Test the benchmarks on a small scale
+    """
+
+    def test_main(self):
+        """
+        Test running the benchmarks and writing their timings
+        """
+        if not os.path.exists(SANDBOX):
+            os.makedirs(SANDBOX)
+        output = os.path.join(SANDBOX, 'benchmark.json')
+        main(['--projects', '10', '--rows', '100', '--parameters', '5',
+              '--repeat', '1', '--output', output, '--quiet'])
+        results = json.load(open(output))
+        self.failUnless(results['rows'] == 100, results)
+        for name in ['get_profiles', 'get_dbs', 'databases_ini', 'downloads',
+                     'main', 'main_incremental']:
+            self.failUnless(name in results['timings'], name)
+
+
+def test_suite():
+    """
+    Run the test suite
+    """
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
@@ -0,0 +1,97 @@
+"""
+Test for raisin.recipe.server.cache
+"""
+
+import os
+import shutil
+import logging
+import unittest
+from pkg_resources import get_provider
+from raisin.recipe.server.cache import cache_path
+from raisin.recipe.server.cache import evict
+from raisin.recipe.server.cache import main
+
+PROVIDER = get_provider('raisin.recipe.server')
+SANDBOX = PROVIDER.get_resource_filename("", 'tests/sandbox')
+PATH = os.path.join(SANDBOX, 'cache')
+
+
+def write(path, size, used):
+    """
+    Write a cached response of the given size, last used at the given time.
+    """
+    folder = os.path.dirname(path)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    open(path, 'w').write('x' * size)
+    os.utime(path, (used, used))
+
+
+class CacheTests(unittest.TestCase):
+    """
+    Test evicting the cached responses
+    """
+
+    def setUp(self):  # pylint: disable=C0103
+        if os.path.exists(PATH):
+            shutil.rmtree(PATH)
+
+    def test_cache_path(self):
+        """
+        Test the hashed layout of the cached responses
+        """
+        path = cache_path('/cache', 'Test', '/project/Test/reads', 2)
+        parts = path.split('/')
+        self.failUnless(parts[:3] == ['', 'cache', 'Test'], path)
+        self.failUnless(parts[3] + parts[4] == parts[5][:4], path)
+        self.failUnless(len(parts[5]) == 40, path)
+        path = cache_path('/cache', None, '/projects', 0)
+        self.failUnless(os.path.dirname(path) == '/cache/_', path)
+
+    def test_evict(self):
+        """
+        Test removing the expired responses, then the least recently used
+        """
+        root = os.path.join(PATH, 'root')
+        old = cache_path(root, 'Test', 'old')
+        short = cache_path(root, 'Short', 'short')
+        recent = cache_path(root, 'Test', 'recent')
+        unused = cache_path(root, 'Test', 'unused')
+        write(old, 10, 1000)
+        write(short, 10, 9900)
+        write(recent, 10, 9990)
+        write(unused, 10, 9950)
+        removed, size = evict(root, 15, 5000, {'Short': 50}, now=10000)
+        self.failUnless((removed, size) == (3, 10), (removed, size))
+        self.failUnless(os.path.exists(recent))
+        for path in [old, short, unused]:
+            self.failIf(os.path.exists(path), path)
+
+    def test_main(self):
+        """
+        Test evicting the responses of the cache configured in cache.ini
+        """
+        root = os.path.join(PATH, 'main')
+        path = cache_path(root, 'Test', 'old')
+        write(path, 10, 1000)
+        config = os.path.join(PATH, 'cache.ini')
+        open(config, 'w').write("[cache]\n"
+                                "backend = file\n"
+                                "path = %s\n"
+                                "max_size = 1024\n"
+                                "ttl = 60\n"
+                                "levels = 2\n\n"
+                                "[ttl]\n" % root)
+        handlers = logging.root.handlers[:]
+        try:
+            self.failUnless(main(['--config', config]) == 0)
+        finally:
+            logging.root.handlers = handlers
+        self.failIf(os.path.exists(path), path)
+
+
+def test_suite():
+    """
+    Run the test suite
+    """
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
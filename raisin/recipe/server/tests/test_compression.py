@@ -0,0 +1,196 @@
+"""
+Test for raisin.recipe.server.compression
+"""
+
+import os
+import gzip
+import shutil
+import unittest
+import cStringIO
+from pkg_resources import get_provider
+from raisin.recipe.server.compression import accepted_encodings
+from raisin.recipe.server.compression import precompress
+from raisin.recipe.server.compression import CompressionMiddleware
+from raisin.recipe.server.compression import PrecompressedStatic
+
+PROVIDER = get_provider('raisin.recipe.server')
+SANDBOX = PROVIDER.get_resource_filename("", 'tests/sandbox')
+PATH = os.path.join(SANDBOX, 'compression')
+
+# A response worth compressing
+JSON = '{"read_length": [%s]}' % ', '.join([str(n) for n in range(1000)])
+
+
+def gunzip(data):
+    """
+    Return data uncompressed with gzip.
+    """
+    return gzip.GzipFile(fileobj=cStringIO.StringIO(data)).read()
+
+
+def app(environ, start_response):
+    """
+    Answer JSON for the projects, and an image otherwise.
+    """
+    if environ['PATH_INFO'].startswith('/project'):
+        start_response('200 OK', [('Content-Type',
+                                   'application/json; charset=utf-8'),
+                                  ('Content-Length', str(len(JSON))),
+                                  ('ETag', '"v1"')])
+        return [JSON]
+    start_response('200 OK', [('Content-Type', 'image/png')])
+    return ['png' * 1000]
+
+
+class Response(object):
+    """
+    Keep the status and headers of a response.
+    """
+
+    def __call__(self, status, headers, exc_info=None):
+        self.status = status
+        self.headers = dict(headers)
+
+
+class CompressionTests(unittest.TestCase):
+    """
+    Test compressing the responses and the static files
+    """
+
+    def setUp(self):
+        if os.path.exists(PATH):
+            shutil.rmtree(PATH)
+        os.makedirs(os.path.join(PATH, 'js'))
+
+    def tearDown(self):
+        shutil.rmtree(PATH)
+
+    def test_accepted_encodings(self):
+        """
+        Test reading the Accept-Encoding header
+        """
+        self.failUnless(accepted_encodings(None) == set())
+        self.failUnless(accepted_encodings('gzip, deflate;q=0.5, br;q=0') ==
+                        set(['gzip', 'deflate']))
+
+    def test_compression_middleware(self):
+        """
+        Test compressing only the allowed types for the clients accepting
+        gzip
+        """
+        middleware = CompressionMiddleware(app)
+        response = Response()
+        environ = {'PATH_INFO': '/project/Test',
+                   'HTTP_ACCEPT_ENCODING': 'gzip'}
+        body = ''.join(middleware(environ, response))
+        self.failUnless(response.headers['Content-Encoding'] == 'gzip')
+        self.failUnless(response.headers['Vary'] == 'Accept-Encoding')
+        self.failUnless(response.headers['ETag'] == '"v1-gzip"')
+        self.failUnless('Content-Length' not in response.headers)
+        self.failUnless(gunzip(body) == JSON)
+        response = Response()
+        environ['PATH_INFO'] = '/chart.png'
+        list(middleware(environ, response))
+        self.failUnless('Content-Encoding' not in response.headers)
+        response = Response()
+        del environ['HTTP_ACCEPT_ENCODING']
+        environ['PATH_INFO'] = '/project/Test'
+        self.failUnless(middleware(environ, response) == [JSON])
+        self.failUnless('Content-Encoding' not in response.headers)
+        response = Response()
+        middleware = CompressionMiddleware(app, min_size=len(JSON) + 1)
+        environ['HTTP_ACCEPT_ENCODING'] = 'gzip'
+        self.failUnless(middleware(environ, response) == [JSON])
+        self.failUnless('Content-Encoding' not in response.headers)
+
+    def test_streaming(self):
+        """
+        Test compressing the body of a response as it is produced, and
+        sending the short ones as they are
+        """
+        produced = []
+
+        def download(environ, start_response):
+            """Answer CSV of unknown length, in several chunks."""
+            start_response('200 OK', [('Content-Type', 'text/csv')])
+            for number in range(int(environ['QUERY_STRING'])):
+                produced.append(number)
+                yield 'read_length\t%s\n' % number * 100
+
+        middleware = CompressionMiddleware(download, min_size=2048)
+        response = Response()
+        environ = {'PATH_INFO': '/download', 'QUERY_STRING': '100',
+                   'HTTP_ACCEPT_ENCODING': 'gzip'}
+        result = middleware(environ, response)
+        chunks = iter(result)
+        body = chunks.next()
+        self.failUnless(len(produced) < 100, len(produced))
+        self.failUnless(response.headers['Content-Encoding'] == 'gzip')
+        body += ''.join(chunks)
+        result.close()
+        self.failUnless(gunzip(body) == ''.join(['read_length\t%s\n' % n * 100
+                                                 for n in range(100)]))
+        response = Response()
+        environ['QUERY_STRING'] = '1'
+        body = ''.join(middleware(environ, response))
+        self.failUnless(body == 'read_length\t0\n' * 100)
+        self.failUnless('Content-Encoding' not in response.headers)
+        self.failUnless(response.headers['Content-Length'] == str(len(body)))
+
+    def test_precompress(self):
+        """
+        Test compressing the static files again only when they change, and
+        serving the compressed copies
+        """
+        path = os.path.join(PATH, 'js', 'raisin.js')
+        open(path, 'w').write(JSON)
+        open(os.path.join(PATH, 'small.css'), 'w').write('a {}')
+        open(os.path.join(PATH, 'gone.js.gz'), 'w').write('')
+        open(os.path.join(PATH, 'data.tar.gz'), 'w').write('')
+        open(os.path.join(PATH, 'reads.fastq.gz'), 'w').write('')
+        written, removed = precompress(PATH, extensions=('.js', '.css'))
+        self.failUnless(removed == 1, removed)
+        self.failUnless(written >= 1, written)
+        self.failUnless(gunzip(open(path + '.gz').read()) == JSON)
+        self.failIf(os.path.exists(os.path.join(PATH, 'small.css.gz')))
+        self.failIf(os.path.exists(os.path.join(PATH, 'gone.js.gz')))
+        self.failUnless(os.path.exists(os.path.join(PATH, 'data.tar.gz')))
+        self.failUnless(os.path.exists(os.path.join(PATH, 'reads.fastq.gz')))
+        self.failUnless(precompress(PATH, extensions=('.js',)) == (0, 0))
+        modified = os.stat(path).st_mtime + 10
+        os.utime(path, (modified, modified))
+        self.failUnless(precompress(PATH, extensions=('.js',))[0] >= 1)
+        static = PrecompressedStatic(PATH)
+        response = Response()
+        body = ''.join(static({'PATH_INFO': '/js/raisin.js',
+                               'HTTP_ACCEPT_ENCODING': 'gzip'}, response))
+        self.failUnless(response.headers['Content-Encoding'] == 'gzip')
+        self.failUnless(gunzip(body) == JSON)
+        response = Response()
+        result = static({'PATH_INFO': '/js/raisin.js'}, response)
+        body = ''.join(result)
+        result.close()
+        self.failUnless('Content-Encoding' not in response.headers)
+        self.failUnless(body == JSON)
+        modified = response.headers['Last-Modified']
+        response = Response()
+        self.failUnless(static({'PATH_INFO': '/js/raisin.js',
+                                'HTTP_IF_MODIFIED_SINCE': modified},
+                               response) == [])
+        self.failUnless(response.status == '304 Not Modified')
+        response = Response()
+        static({'PATH_INFO': '/js/raisin.js',
+                'HTTP_IF_MODIFIED_SINCE': 'Thu, 01 Jan 1970 00:00:00 GMT'},
+               response)
+        self.failUnless(response.status == '200 OK')
+        result = static({'PATH_INFO': '/js/raisin.js',
+                         'wsgi.file_wrapper': lambda f, size: (f, size)},
+                        response)
+        self.failUnless(result[0].read() == JSON and result[1] > 0)
+        result[0].close()
+        response = Response()
+        static({'PATH_INFO': '/../compression.py'}, response)
+        self.failUnless(response.status == '404 Not Found')
+        response = Response()
+        static({'PATH_INFO': '/missing.js'}, response)
+        self.failUnless(response.status == '404 Not Found')
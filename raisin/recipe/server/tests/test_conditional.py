@@ -0,0 +1,116 @@
+"""
+Test for raisin.recipe.server.conditional
+"""
+
+import os
+import time
+import shutil
+import unittest
+from pkg_resources import get_provider
+from raisin.recipe.server.conditional import get_project
+from raisin.recipe.server.conditional import ConditionalMiddleware
+
+PROVIDER = get_provider('raisin.recipe.server')
+SANDBOX = PROVIDER.get_resource_filename("", 'tests/sandbox')
+PATH = os.path.join(SANDBOX, 'conditional')
+
+
+class App(object):
+    """
+    Answer every request, counting them.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, environ, start_response):
+        self.calls += 1
+        start_response('200 OK', [('Content-Type', 'application/json')])
+        return ['{}']
+
+
+class Response(object):
+    """
+    Keep the status and headers of a response.
+    """
+
+    def __call__(self, status, headers, exc_info=None):
+        self.status = status
+        self.headers = dict(headers)
+
+
+class ConditionalTests(unittest.TestCase):
+    """
+    Test answering the conditional requests
+    """
+
+    def setUp(self):
+        if os.path.exists(PATH):
+            shutil.rmtree(PATH)
+        os.makedirs(PATH)
+        self.versions = os.path.join(PATH, 'versions.ini')
+        open(self.versions, 'w').write('[versions]\nTest = 0123456789abcdef\n')
+
+    def tearDown(self):
+        shutil.rmtree(PATH)
+
+    def test_get_project(self):
+        """
+        Test finding the project of a request
+        """
+        self.failUnless(get_project('/project/Test') == 'Test')
+        self.failUnless(get_project('/project/Test/read_length') == 'Test')
+        self.failUnless(get_project('/project/') is None)
+        self.failUnless(get_project('/static/project/Test') is None)
+
+    def test_conditional_middleware(self):
+        """
+        Test the ETags and the 304 responses, and that the ETags change
+        with the data version
+        """
+        app = App()
+        middleware = ConditionalMiddleware(app, self.versions, 60, 0)
+        response = Response()
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/project/Test'}
+        middleware(environ, response)
+        etag = response.headers['ETag']
+        self.failUnless(etag.startswith('"0123456789abcdef-'), etag)
+        self.failUnless(response.headers['Cache-Control'] == 'max-age=60')
+        environ['HTTP_IF_NONE_MATCH'] = '"other", %s' % etag
+        self.failUnless(middleware(environ, response) == [])
+        self.failUnless(response.status == '304 Not Modified')
+        self.failUnless(app.calls == 1)
+        environ['HTTP_ACCEPT'] = 'text/csv'
+        middleware(environ, response)
+        self.failUnless(response.status == '200 OK')
+        self.failUnless(response.headers['ETag'] != etag, response.headers)
+        del environ['HTTP_ACCEPT']
+        open(self.versions, 'w').write('[versions]\nTest = fedcba9876543210\n')
+        modified = time.time() + 10
+        os.utime(self.versions, (modified, modified))
+        middleware(environ, response)
+        self.failUnless(response.status == '200 OK')
+        self.failUnless(response.headers['ETag'].startswith(
+            '"fedcba9876543210-'), response.headers)
+        response = Response()
+        middleware({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/project/Other'},
+                   response)
+        self.failUnless('ETag' not in response.headers, response.headers)
+        self.failUnless(app.calls == 4)
+
+    def test_private(self):
+        """
+        Test that the responses of the servers showing the projects to their
+        users only are kept out of the shared caches
+        """
+        middleware = ConditionalMiddleware(App(), self.versions, 60, 0, True)
+        response = Response()
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/project/Test'}
+        middleware(environ, response)
+        self.failUnless(response.headers['Cache-Control'] ==
+                        'private, max-age=60', response.headers)
+        environ['HTTP_IF_NONE_MATCH'] = response.headers['ETag']
+        middleware(environ, response)
+        self.failUnless(response.status == '304 Not Modified')
+        self.failUnless(response.headers['Cache-Control'] ==
+                        'private, max-age=60', response.headers)
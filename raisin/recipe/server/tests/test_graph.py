@@ -0,0 +1,108 @@
+"""
+Test for raisin.recipe.server.graph
+"""
+
+import threading
+import unittest
+from raisin.recipe.server.graph import run_graph
+from raisin.recipe.server.graph import map_threads
+
+
+class GraphTests(unittest.TestCase):
+    """
+    Test running tasks depending on each other
+    """
+
+    def make_graph(self, log):
+        """
+        Return a graph of tasks logging their names when run.
+        """
+        lock = threading.Lock()
+
+        def task(name):
+            """Log the name of the task."""
+            lock.acquire()
+            log.append(name)
+            lock.release()
+
+        return {'profiles': ([], lambda: task('profiles')),
+                'projects': (['profiles'], lambda: task('projects')),
+                'dbs': (['profiles'], lambda: task('dbs')),
+                'projects_ini': (['projects'], lambda: task('projects_ini')),
+                'databases_ini': (['dbs'], lambda: task('databases_ini')),
+                'users_ini': ([], lambda: task('users_ini')),
+                }
+
+    def check_order(self, log):
+        """
+        Check that every task ran after the tasks it requires.
+        """
+        self.failUnless(len(log) == 6, log)
+        self.failUnless(log.index('profiles') < log.index('projects'), log)
+        self.failUnless(log.index('profiles') < log.index('dbs'), log)
+        self.failUnless(log.index('projects') < log.index('projects_ini'),
+                        log)
+        self.failUnless(log.index('dbs') < log.index('databases_ini'), log)
+
+    def test_run_graph(self):
+        """
+        Test running the tasks one after the other
+        """
+        log = []
+        run_graph(self.make_graph(log))
+        self.check_order(log)
+
+    def test_run_graph_threads(self):
+        """
+        Test running the independent tasks at the same time
+        """
+        log = []
+        run_graph(self.make_graph(log), jobs=4)
+        self.check_order(log)
+
+    def test_run_graph_error(self):
+        """
+        Test that no task depending on a failed task is run
+        """
+        log = []
+        graph = self.make_graph(log)
+        graph['projects'] = (['profiles'], lambda: {}['missing'])
+        self.assertRaises(KeyError, run_graph, graph, 4)
+        self.failIf('projects_ini' in log, log)
+
+    def test_run_graph_circular(self):
+        """
+        Test that circular requirements are detected
+        """
+        graph = {'a': (['b'], lambda: None),
+                 'b': (['a'], lambda: None)}
+        self.assertRaises(ValueError, run_graph, graph)
+
+    def test_run_graph_unknown(self):
+        """
+        Test that requiring an unknown task is detected
+        """
+        graph = {'a': (['b'], lambda: None)}
+        self.assertRaises(KeyError, run_graph, graph)
+
+    def test_map_threads(self):
+        """
+        Test calling a function on many items at the same time
+        """
+        found = map_threads(lambda x: x * 2, range(100), jobs=8)
+        self.failUnless(found == range(0, 200, 2), found)
+        self.failUnless(map_threads(lambda x: x, [], jobs=8) == [])
+
+    def test_map_threads_error(self):
+        """
+        Test that an error raised by a call is raised again
+        """
+        self.assertRaises(ZeroDivisionError, map_threads,
+                          lambda x: 1 / x, range(10), 4)
+
+
+def test_suite():
+    """
+    Run the test suite
+    """
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
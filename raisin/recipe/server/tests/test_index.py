@@ -0,0 +1,100 @@
+"""
+Test for raisin.recipe.server.index
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import unittest
+from pkg_resources import get_provider
+from raisin.recipe.server import index
+from raisin.recipe.server.index import download_index
+
+PROVIDER = get_provider('raisin.recipe.server')
+SANDBOX = PROVIDER.get_resource_filename("", 'tests/sandbox')
+PATH = os.path.join(SANDBOX, 'index')
+
+
+def write(path, content):
+    """
+    Write a file, making its folder.
+    """
+    folder = os.path.dirname(path)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    open(path, 'w').write(content)
+
+
+class IndexTests(unittest.TestCase):
+    """
+    Test indexing the files available for download
+    """
+
+    def setUp(self):  # pylint: disable=C0103
+        if os.path.exists(PATH):
+            shutil.rmtree(PATH)
+        self.folder = os.path.join(PATH, 'downloads', 'Test')
+        write(os.path.join(self.folder, 'a.txt'), 'a')
+        write(os.path.join(self.folder, 'bam', 'b.bam'), 'bb')
+        self.project_downloads = [('Test', self.folder,
+                                   'http://localhost/Test/', 'db', 'dbc')]
+        self.index_path = os.path.join(PATH,
+                                       'etc/projects/downloads/Test.json')
+        self.checksummed = []
+        self.checksum = index.checksum
+
+        def checksum(path, algorithm):
+            """Record the files checksummed."""
+            self.checksummed.append(os.path.basename(path))
+            return self.checksum(path, algorithm)
+
+        index.checksum = checksum
+
+    def tearDown(self):  # pylint: disable=C0103
+        index.checksum = self.checksum
+
+    def test_download_index(self):
+        """
+        Test indexing the files of a project
+        """
+        download_index(PATH, self.project_downloads, jobs=2)
+        found = json.load(open(self.index_path))
+        self.failUnless(found['project'] == 'Test', found)
+        self.failUnless(found['url'] == 'http://localhost/Test/', found)
+        files = [f[:2] + f[3:] for f in found['files']]
+        expected = [['a.txt', 1, 'md5', hashlib.md5('a').hexdigest()],
+                    ['bam/b.bam', 2, 'md5', hashlib.md5('bb').hexdigest()]]
+        self.failUnless(files == expected, files)
+
+    def test_download_index_incremental(self):
+        """
+        Test that only the changed files are checksummed again
+        """
+        download_index(PATH, self.project_downloads)
+        self.checksummed = []
+        write(os.path.join(self.folder, 'bam', 'b.bam'), 'bbb')
+        write(os.path.join(self.folder, 'c.txt'), 'c')
+        download_index(PATH, self.project_downloads)
+        self.checksummed.sort()
+        self.failUnless(self.checksummed == ['b.bam', 'c.txt'],
+                        self.checksummed)
+
+    def test_download_index_missing(self):
+        """
+        Test that the index is kept when the download folder is missing,
+        and removed when the project has no downloads any more
+        """
+        download_index(PATH, self.project_downloads)
+        shutil.rmtree(self.folder)
+        download_index(PATH, self.project_downloads)
+        self.failUnless(os.path.exists(self.index_path))
+        download_index(PATH, [])
+        self.failIf(os.path.exists(self.index_path))
+
+
+def test_suite():
+    """
+    Run the test suite
+    """
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
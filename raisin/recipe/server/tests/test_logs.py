@@ -0,0 +1,93 @@
+"""
+Test for raisin.recipe.server.logs
+"""
+
+import os
+import time
+import random
+import logging
+import unittest
+import logging.handlers
+from pkg_resources import get_provider
+from raisin.recipe.server.logs import QueueHandler
+from raisin.recipe.server.logs import SamplingHandler
+
+PROVIDER = get_provider('raisin.recipe.server')
+SANDBOX = PROVIDER.get_resource_filename("", 'tests/sandbox')
+
+
+class Target(logging.Handler):
+    """
+    Keep the records written.
+    """
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class LogsTests(unittest.TestCase):
+    """
+    Test the logging handlers
+    """
+
+    def test_sampling_handler(self):
+        """
+        Test keeping a sample of the records, but every error
+        """
+        random.seed(0)
+        target = Target()
+        handler = SamplingHandler(10, 0.25, target=target)
+        logger = logging.Logger('test_sampling')
+        logger.addHandler(handler)
+        for number in range(1000):
+            logger.info('request %s', number)
+        handler.flush()
+        self.failUnless(150 < len(target.records) < 350, len(target.records))
+        del target.records[:]
+        logger.info('buffered')
+        logger.error('failed')
+        handler.flush()
+        self.failUnless([record.levelno for record in target.records][-1] ==
+                        logging.ERROR, target.records)
+        handler.close()
+
+    def test_queue_handler(self):
+        """
+        Test that a single warning reaches the log file without waiting for
+        other records, and that the records beyond the capacity are dropped
+        """
+        path = os.path.join(SANDBOX, 'queue.log')
+        target = logging.handlers.RotatingFileHandler(path, 'w')
+        handler = QueueHandler(100, target=target)
+        logger = logging.Logger('test_queue')
+        logger.addHandler(handler)
+        logger.warning('slow request')
+        for _ in range(50):
+            if 'slow request' in open(path).read():
+                break
+            time.sleep(0.1)
+        self.failUnless(open(path).read() == 'slow request\n')
+        handler.close()
+        target.close()
+        os.remove(path)
+        target = Target()
+        target.lock.acquire()
+        handler = QueueHandler(1, target=target)
+        logger = logging.Logger('test_dropped')
+        logger.addHandler(handler)
+        logger.info('written')
+        while not handler.queue.empty():
+            time.sleep(0.01)
+        logger.info('queued')
+        logger.info('dropped')
+        self.failUnless(handler.dropped == 1)
+        target.lock.release()
+        handler.flush()
+        self.failUnless([record.getMessage() for record in target.records] ==
+                        ['written', 'queued', 'Dropped 1 records, the log was '
+                         'too busy'], target.records)
+        handler.close()
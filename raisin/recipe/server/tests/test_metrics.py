@@ -0,0 +1,185 @@
+"""
+Test for raisin.recipe.server.metrics
+"""
+
+import os
+import socket
+import shutil
+import urllib2
+import unittest
+from pkg_resources import get_provider
+from raisin.recipe.server.metrics import read_projects
+from raisin.recipe.server.metrics import get_labels
+from raisin.recipe.server.metrics import Metrics
+from raisin.recipe.server.metrics import StatsdClient
+from raisin.recipe.server.metrics import MetricsMiddleware
+from raisin.recipe.server.metrics import serve_metrics
+
+PROVIDER = get_provider('raisin.recipe.server')
+SANDBOX = PROVIDER.get_resource_filename("", 'tests/sandbox')
+PATH = os.path.join(SANDBOX, 'metrics')
+
+
+def app(environ, start_response):
+    """
+    Answer from the cache the requests for the Test project.
+    """
+    headers = [('Content-Type', 'text/plain')]
+    if 'Test' in environ['PATH_INFO']:
+        headers.append(('X-Cache', 'HIT'))
+    start_response('200 OK', headers)
+    return ['answer']
+
+
+def start_response(status, headers, exc_info=None):
+    """
+    Ignore the status and headers of the response.
+    """
+
+
+def serve(middleware, environ):
+    """
+    Return the body of a response, closing it as a server does.
+    """
+    result = middleware(environ, start_response)
+    try:
+        return list(result)
+    finally:
+        result.close()
+
+
+class MetricsTests(unittest.TestCase):
+    """
+    Test measuring the requests
+    """
+
+    def setUp(self):
+        if os.path.exists(PATH):
+            shutil.rmtree(PATH)
+        os.makedirs(PATH)
+
+    def tearDown(self):
+        shutil.rmtree(PATH)
+
+    def test_get_labels(self):
+        """
+        Test labelling the requests with few routes, and only the projects
+        of projects.ini
+        """
+        path = os.path.join(PATH, 'projects.ini')
+        open(path, 'w').write('[Test]\n'
+                              'projects = Test,\n'
+                              '    [[dbs]]\n'
+                              '    RNAseqPipeline = Test\n')
+        projects = read_projects(path)
+        self.failUnless(projects == set(['Test']), projects)
+        self.failUnless(get_labels('/', projects) == ('/', '_'))
+        self.failUnless(get_labels('/static/a.css', projects) ==
+                        ('/static', '_'))
+        self.failUnless(get_labels('/project/Test/read_length', projects) ==
+                        ('/project/:project/:part', 'Test'))
+        self.failUnless(get_labels('/project/Other', projects) ==
+                        ('/project/:project', '_'))
+
+    def test_get_labels_unknown(self):
+        """
+        Test that the paths outside the known routes, and the long paths,
+        share their labels
+        """
+        routes = set()
+        for number in range(100):
+            for path in ['/wp-admin/%s.php', '/.git/%s',
+                         '/project/Test/a/b/%s/c']:
+                routes.add(get_labels(path % number, set(['Test']))[0])
+        self.failUnless(routes == set(['/:other',
+                                       '/project/:project/:part/:part/:part']),
+                        routes)
+        self.failUnless(get_labels('/login', set(), ['login']) ==
+                        ('/login', '_'))
+
+    def test_metrics(self):
+        """
+        Test the latency histograms and the gauges
+        """
+        metrics = Metrics(2, [10, 100])
+        for seconds in [0.001, 0.05, 0.05, 1]:
+            metrics.begin()
+            metrics.end('/project/:project', 'Test', '200', seconds, 'hit')
+        metrics.begin()
+        text = metrics.text('restish')
+        self.failUnless('raisin_request_milliseconds_bucket{service="restish",'
+                        'route="/project/:project",project="Test",le="100"} 3'
+                        in text, text)
+        self.failUnless('raisin_request_milliseconds_bucket{service="restish",'
+                        'route="/project/:project",project="Test",'
+                        'le="+Inf"} 4' in text, text)
+        self.failUnless('raisin_cache_responses_total{service="restish",'
+                        'project="Test",cache="hit"} 4' in text, text)
+        self.failUnless('raisin_in_flight{service="restish"} 1' in text, text)
+        self.failUnless(0 < metrics.utilisation() <= 1)
+
+    def test_statsd(self):
+        """
+        Test pushing the metrics of the requests to a statsd stand-in
+        """
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(('127.0.0.1', 0))
+        receiver.settimeout(5)
+        client = StatsdClient('127.0.0.1', receiver.getsockname()[1],
+                              'raisin.restish')
+        middleware = MetricsMiddleware(app, Metrics(4), set(['Test']),
+                                       'restish', client, 0)
+        self.failUnless(serve(middleware, {'PATH_INFO': '/project/Test'}) ==
+                        ['answer'])
+        packet = receiver.recv(65536)
+        receiver.close()
+        lines = packet.split('\n')
+        self.failUnless('raisin.restish.requests.project__project.Test.'
+                        '200:1|c' in lines, lines)
+        self.failUnless('raisin.restish.cache.Test.hit:1|c' in lines, lines)
+        self.failUnless('raisin.restish.in_flight:0|g' in lines, lines)
+
+    def test_streaming(self):
+        """
+        Test that the body of the responses is streamed, the request being
+        measured once closed
+        """
+        produced = []
+
+        def download(environ, start_response):
+            """Answer a body made of several chunks."""
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            for chunk in ['a', 'b', 'c']:
+                produced.append(chunk)
+                yield chunk
+
+        metrics = Metrics(4)
+        middleware = MetricsMiddleware(download, metrics, set(), 'pyramid')
+        result = middleware({'PATH_INFO': '/download'}, start_response)
+        chunks = iter(result)
+        self.failUnless(chunks.next() == 'a')
+        self.failUnless(produced == ['a'], produced)
+        self.failUnless(metrics.in_flight == 1)
+        self.failUnless(list(chunks) == ['b', 'c'])
+        result.close()
+        result.close()
+        self.failUnless(metrics.in_flight == 0)
+        self.failUnless(metrics.requests == {('/:other', '_', '200'): 1},
+                        metrics.requests)
+
+    def test_serve_metrics(self):
+        """
+        Test serving the metrics on an admin port
+        """
+        metrics = Metrics(4)
+        middleware = MetricsMiddleware(app, metrics, set(['Test']), 'pyramid')
+        serve(middleware, {'PATH_INFO': '/project/Other/x'})
+        server = serve_metrics(metrics, 'pyramid', 0)
+        try:
+            url = 'http://127.0.0.1:%s/metrics' % server.server_address[1]
+            text = urllib2.urlopen(url, timeout=5).read()
+        finally:
+            server.shutdown()
+        self.failUnless('raisin_requests_total{service="pyramid",'
+                        'route="/project/:project/:part",project="_",'
+                        'status="200"} 1' in text, text)
@@ -0,0 +1,72 @@
+"""
+Test for raisin.recipe.server.output
+"""
+
+import os
+import unittest
+from pkg_resources import get_provider
+from raisin.recipe.server.output import write_file
+from raisin.recipe.server.output import track_changes
+from raisin.recipe.server.output import stop_tracking
+
+PROVIDER = get_provider('raisin.recipe.server')
+SANDBOX = PROVIDER.get_resource_filename("", 'tests/sandbox')
+
+
+class OutputTests(unittest.TestCase):
+    """
+    Test writing the generated files
+    """
+
+    def setUp(self):  # pylint: disable=C0103
+        self.path = os.path.join(SANDBOX, 'output', 'file.ini')
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_write_file(self):
+        """
+        Test writing a new file, creating its folder
+        """
+        self.failUnless(write_file(self.path, '[Test]\n'))
+        self.failUnless(open(self.path).read() == '[Test]\n')
+        folder = os.path.dirname(self.path)
+        self.failUnless(os.listdir(folder) == ['file.ini'], os.listdir(folder))
+
+    def test_write_file_unchanged(self):
+        """
+        Test that a file with the same content is left untouched
+        """
+        write_file(self.path, '[Test]\n')
+        os.utime(self.path, (0, 0))
+        self.failIf(write_file(self.path, '[Test]\n'))
+        self.failUnless(os.path.getmtime(self.path) == 0)
+
+    def test_write_file_changed(self):
+        """
+        Test that a file with other content is replaced, keeping its mode
+        """
+        write_file(self.path, '[Test]\n')
+        os.chmod(self.path, 0600)
+        self.failUnless(write_file(self.path, '[Other]\n'))
+        self.failUnless(open(self.path).read() == '[Other]\n')
+        self.failUnless(os.stat(self.path).st_mode & 0777 == 0600)
+
+    def test_track_changes(self):
+        """
+        Test recording the paths of the files written
+        """
+        other = os.path.join(SANDBOX, 'changes', 'other.ini')
+        write_file(other, '[Other]\n')
+        track_changes()
+        write_file(self.path, '[Test]\n')
+        write_file(other, '[Other]\n')
+        self.failUnless(stop_tracking() == set([self.path]))
+        write_file(self.path, '[Changed]\n')
+        self.failUnless(stop_tracking() == set())
+
+
+def test_suite():
+    """
+    Run the test suite
+    """
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
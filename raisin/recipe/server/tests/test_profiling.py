@@ -0,0 +1,115 @@
+"""
+Test for raisin.recipe.server.profiling
+"""
+
+import os
+import pstats
+import shutil
+import unittest
+from pkg_resources import get_provider
+from raisin.recipe.server.profiling import ProfilingMiddleware
+
+PROVIDER = get_provider('raisin.recipe.server')
+SANDBOX = PROVIDER.get_resource_filename("", 'tests/sandbox')
+PATH = os.path.join(SANDBOX, 'profiling')
+
+
+def app(environ, start_response):
+    """
+    Answer every request with the sum of the first numbers.
+    """
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [str(sum(range(1000)))]
+
+
+def start_response(status, headers):
+    """
+    Ignore the status and headers of the response.
+    """
+
+
+def serve(middleware, path):
+    """
+    Return the body of the response for a path, closing it as a server
+    does.
+    """
+    result = middleware({'PATH_INFO': path}, start_response)
+    try:
+        return list(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+
+class ProfilingTests(unittest.TestCase):
+    """
+    Test profiling a sample of the requests
+    """
+
+    def setUp(self):
+        if os.path.exists(PATH):
+            shutil.rmtree(PATH)
+
+    def tearDown(self):
+        if os.path.exists(PATH):
+            shutil.rmtree(PATH)
+
+    def test_profiling_middleware(self):
+        """
+        Test that only the sampled requests are profiled, and that the
+        oldest dumps are removed
+        """
+        middleware = ProfilingMiddleware(app, PATH, 'restish_00', rate=0,
+                                         prefixes=['/chart'], interval=3600,
+                                         keep=2)
+        self.failUnless(serve(middleware, '/project/Test') == ['499500'])
+        self.failUnless(middleware.requests == 0)
+        self.failUnless(serve(middleware, '/chart/1') == ['499500'])
+        self.failUnless(middleware.requests == 1)
+        path = middleware.dump()
+        stats = pstats.Stats(path)
+        self.failUnless([key for key in stats.stats.keys()
+                         if key[2] == 'app'], stats.stats.keys())
+        self.failUnless(middleware.dump() is None)
+        for name in ['restish_00-20121109-120000.000-000001.prof',
+                     'restish_00-20121109-130000.000-000001.prof',
+                     'pyramid_00-20121109-120000.000-000001.prof']:
+            open(os.path.join(PATH, name), 'w').close()
+        serve(middleware, '/chart/2')
+        second = middleware.dump()
+        serve(middleware, '/chart/3')
+        third = middleware.dump()
+        self.failUnless(second != third, second)
+        names = os.listdir(PATH)
+        names.sort()
+        self.failUnless(names == ['pyramid_00-20121109-120000.000-000001.prof',
+                                  os.path.basename(second),
+                                  os.path.basename(third)], names)
+
+    def test_streaming(self):
+        """
+        Test that the body of the profiled responses is streamed, and that
+        producing it is profiled
+        """
+        produced = []
+
+        def download(environ, start_response):
+            """Answer a body made of several chunks."""
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            for chunk in ['a', 'b']:
+                produced.append(chunk)
+                yield chunk
+
+        middleware = ProfilingMiddleware(download, PATH, 'pyramid_00', rate=1,
+                                         interval=3600)
+        result = middleware({'PATH_INFO': '/download'}, start_response)
+        chunks = iter(result)
+        self.failUnless(chunks.next() == 'a')
+        self.failUnless(produced == ['a'], produced)
+        self.failUnless(middleware.requests == 0)
+        self.failUnless(list(chunks) == ['b'])
+        result.close()
+        self.failUnless(middleware.requests == 1)
+        stats = pstats.Stats(middleware.dump())
+        self.failUnless([key for key in stats.stats.keys()
+                         if key[2] == 'download'], stats.stats.keys())
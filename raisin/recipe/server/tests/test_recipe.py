@@ -3,13 +3,25 @@ Test for raisin.recipe.transformation
 """
 
 import os
+import json
+import hashlib
 import unittest
 from pkg_resources import get_provider
 from raisin.recipe.server.server import get_profiles
 from raisin.recipe.server.server import get_projects
+from raisin.recipe.server.server import iter_profiles
+from raisin.recipe.server.server import scan_profiles
+from raisin.recipe.server.server import load_profiles
 from raisin.recipe.server.server import projects_ini
+from raisin.recipe.server.server import versions_ini
 from raisin.recipe.server.server import get_dbs
 from raisin.recipe.server.server import databases_ini
+from raisin.recipe.server.server import get_database_routes
+from raisin.recipe.server.server import ProjectRegistry
+from raisin.recipe.server.server import downloads
+from raisin.recipe.server.server import get_project_downloads
+from raisin.recipe.server.server import get_bundle
+from raisin.recipe.server.server import bundle_json
 from raisin.recipe.server.server import get_project_users
 from raisin.recipe.server.server import pyramid_projects_ini
 from raisin.recipe.server.server import get_parameters
@@ -17,12 +29,38 @@ from raisin.recipe.server.server import misc_parameters_ini
 from raisin.recipe.server.server import get_project_parameters
 from raisin.recipe.server.server import misc_project_parameters_ini
 from raisin.recipe.server.server import connections_mysql_ini
+from raisin.recipe.server.server import get_pool_settings
+from raisin.recipe.server.server import get_routed_connections
 from raisin.recipe.server.server import pyramid_development_ini
 from raisin.recipe.server.server import restish_development_ini
+from raisin.recipe.server.server import get_waitress_settings
+from raisin.recipe.server.server import pyramid_production_ini
+from raisin.recipe.server.server import restish_production_ini
 from raisin.recipe.server.server import restish_raisin_restish_ini
+from raisin.recipe.server.server import get_log_settings
+from raisin.recipe.server.server import get_filters
+from raisin.recipe.server.server import get_static
+from raisin.recipe.server.server import get_cache_settings
+from raisin.recipe.server.server import get_cache_ttls
+from raisin.recipe.server.server import cache_ini
+from raisin.recipe.server.server import get_tasks
+from raisin.recipe.server.server import get_warming_paths
+from raisin.recipe.server.server import warm_json
 from raisin.recipe.server.server import pyramid_users_ini
 from raisin.recipe.server.server import supervisord_conf
+from raisin.recipe.server.server import get_services
+from raisin.recipe.server.server import get_worker_ports
+from raisin.recipe.server.server import nginx_conf
+from raisin.recipe.server.server import haproxy_cfg
+from raisin.recipe.server.server import proxy_conf
+from raisin.recipe.server.server import get_proxy_includes
+from raisin.recipe.server.server import nginx_downloads_conf
+from raisin.recipe.server.server import get_pyramid_settings
+from raisin.recipe.server.server import get_groups
+from raisin.recipe.server.server import group_configs
 from raisin.recipe.server.server import var_log_folder
+from raisin.recipe.server.server import main
+from raisin.recipe.server.manifest import MANIFEST
 
 PROVIDER = get_provider('raisin.recipe.server')
 SANDBOX = PROVIDER.get_resource_filename("", 'tests/sandbox')
@@ -50,6 +88,30 @@ def files_are_equal(path):
         return True
 
 
+def make_buildout(staging):
+    """
+    Write a small profiles.csv to the staging folder and return the buildout
+    sections used by main.
+    """
+    if not os.path.exists(staging):
+        os.makedirs(staging)
+    profiles = open(os.path.join(staging, 'profiles.csv'), 'w')
+    profiles.write("project_id\tDB\tCOMMONDB\n"
+                   "Test\tTest_RNAseqPipeline\tTest_RNAseqPipelineCommon\n")
+    profiles.close()
+    return {'parameter_vocabulary': {'read_length': 'Read Length'},
+            'parameter_categories': {'read_length': 'experiment'},
+            'parameter_types': {'read_length': 'integer'},
+            'parameter_columns': {'read_length': 'read_length'},
+            'project_users': {},
+            'project_parameters': {},
+            'project_downloads': {'path': '/downloads',
+                                  'url': 'http://localhost/downloads/',
+                                  'exclude_projects': ''},
+            'project_downloads_folder': {},
+            }
+
+
 class RecipeTests(unittest.TestCase):
     """
     Test the main method in database.py
@@ -71,6 +133,112 @@ class RecipeTests(unittest.TestCase):
         expected = [{'dummy2': 'v2', 'dummy1': 'v1'}]
         self.failUnless(found == expected, found)
 
+    def test_iter_profiles(self):
+        """
+        Test streaming only the needed columns of the profiles
+        """
+        staging = SANDBOX
+        profiles_file = os.path.join(staging, 'profiles.csv')
+        profiles = open(profiles_file, 'w')
+        profiles.write("COMMONDB\tproject_id\tread_length\tDB\n"
+                       "c1\tp1\t76\td1\n"
+                       "\n"
+                       "c2\tp2\t36\td2\n")
+        profiles.close()
+        found = list(iter_profiles(staging))
+        expected = [('p1', 'd1', 'c1'), ('p2', 'd2', 'c2')]
+        self.failUnless(found == expected, found)
+
+    def test_scan_profiles(self):
+        """
+        Test getting the projects and dbs in a single pass
+        """
+        staging = SANDBOX
+        profiles_file = os.path.join(staging, 'profiles.csv')
+        profiles = open(profiles_file, 'w')
+        profiles.write("project_id\tDB\tCOMMONDB\n"
+                       "p2\td2\tc2\n"
+                       "p1\td1\tc1\n"
+                       "p2\td2\tc2\n"
+                       "p1\td1\tc1\n")
+        profiles.close()
+        projects, dbs, counts, versions = scan_profiles(staging)
+        self.failUnless(projects == ['p1', 'p2'], projects)
+        expected = [('p1', 'd1', 'c1'), ('p2', 'd2', 'c2')]
+        self.failUnless(dbs == expected, dbs)
+        self.failUnless(counts == {'p1': 2, 'p2': 2}, counts)
+        self.failUnless(len(versions['p1']) == 16, versions)
+        self.failUnless(versions['p1'] != versions['p2'], versions)
+
+    def test_profile_versions(self):
+        """
+        Test that the data version of a project only changes with its
+        profiles
+        """
+        staging = os.path.join(SANDBOX, 'versions')
+        if not os.path.exists(staging):
+            os.makedirs(staging)
+        profiles_file = os.path.join(staging, 'profiles.csv')
+
+        def get_versions(rows):
+            """Return the versions of the profiles."""
+            profiles = open(profiles_file, 'w')
+            profiles.write("project_id\tDB\tCOMMONDB\tread_length\n")
+            profiles.write(''.join(rows))
+            profiles.close()
+            return scan_profiles(staging)[3]
+
+        first = get_versions(["p1\td1\tc1\t36\n",
+                              "p2\td2\tc2\t36\n",
+                              "p1\td1\tc1\t75\n"])
+        reordered = get_versions(["p1\td1\tc1\t75\n",
+                                  "p2\td2\tc2\t36\n",
+                                  "p1\td1\tc1\t36\n"])
+        self.failUnless(first == reordered, (first, reordered))
+        changed = get_versions(["p1\td1\tc1\t36\n",
+                                "p2\td2\tc2\t76\n",
+                                "p1\td1\tc1\t75\n"])
+        self.failUnless(changed['p1'] == first['p1'], changed)
+        self.failUnless(changed['p2'] != first['p2'], changed)
+        moved = get_versions(["p1\td1\tc1\t36\n",
+                              "p2\td3\tc2\t36\n",
+                              "p1\td1\tc1\t75\n"])
+        self.failUnless(moved['p2'] != first['p2'], moved)
+        versions_ini(staging, first)
+        path = os.path.join(staging, 'etc/projects/versions.ini')
+        expected = ('[versions]\n'
+                    'p1 = %s\n'
+                    'p2 = %s\n' % (first['p1'], first['p2']))
+        self.failUnless(open(path).read() == expected, open(path).read())
+
+    def test_load_profiles(self):
+        """
+        Test caching the projects and dbs until profiles.csv changes
+        """
+        staging = os.path.join(SANDBOX, 'cache')
+        cache_path = os.path.join(staging, 'profiles.cache')
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        make_buildout(staging)
+        expected = (['Test'],
+                    [('Test', 'Test_RNAseqPipeline',
+                      'Test_RNAseqPipelineCommon')],
+                    {'Test': 1})
+        found = load_profiles(staging, cache_path, (1, 1, 'first'))
+        self.failUnless(found[:3] == expected, found)
+        self.failUnless(found[3].keys() == ['Test'], found)
+        expected = found
+        self.failUnless(os.path.exists(cache_path))
+        os.remove(os.path.join(staging, 'profiles.csv'))
+        found = load_profiles(staging, cache_path, (2, 2, 'first'))
+        self.failUnless(found == expected, found)
+        self.assertRaises(IOError, load_profiles, staging, cache_path,
+                          (1, 1, 'second'))
+        open(cache_path, 'w').write('garbage')
+        make_buildout(staging)
+        found = load_profiles(staging, cache_path, (1, 1, 'first'))
+        self.failUnless(found == expected, found)
+
     def test_get_projects(self):
         """
         Test getting the projects
@@ -110,6 +278,137 @@ class RecipeTests(unittest.TestCase):
         databases_ini(buildout_directory, dbs)
         self.failUnless(files_are_equal('etc/databases/databases.ini'))
 
+    def test_databases_ini_routes(self):
+        """
+        Test configuring the read and write connections in databases.ini
+        """
+        buildout_directory = os.path.join(SANDBOX, 'routes')
+        dbs = [('dummy', 'db1', 'db2')]
+        buildout = {'database_connections': {'raisin': 'replica',
+                                             'raisin2': ''},
+                    'database_projects': {'dummy': 'raisin',
+                                          'dummyCommon': 'raisin2'}}
+        self.failUnless(get_database_routes({}, dbs) is None)
+        databases_ini(buildout_directory, dbs,
+                      get_database_routes(buildout, dbs))
+        path = os.path.join(buildout_directory,
+                            'etc/databases/databases.ini')
+        expected = ("[dummy]\n"
+                    "connection = raisin\n"
+                    "read_connection = replica\n"
+                    "write_connection = raisin\n"
+                    "db = db1\n"
+                    "description = Contains the meta data\n\n"
+                    "[dummyCommon]\n"
+                    "connection = raisin2\n"
+                    "read_connection = raisin2\n"
+                    "write_connection = raisin2\n"
+                    "db = db2\n"
+                    "description = Contains all the statistics results\n\n")
+        self.failUnless(open(path).read() == expected, open(path).read())
+
+    def test_project_registry(self):
+        """
+        Test indexing the projects and detecting conflicting dbs
+        """
+        dbs = [('a', 'db1', 'db2'),
+               ('b', 'db3', 'db4'),
+               ('b', 'db5', 'db6')]
+        registry = ProjectRegistry(dbs)
+        self.failUnless(registry.projects == ['a', 'b'], registry.projects)
+        self.failUnless(list(registry) == dbs[:2], list(registry))
+        self.failUnless('b' in registry)
+        self.failIf('c' in registry)
+        expected = [{'project_id': 'b',
+                     'DB': 'db3',
+                     'COMMONDB': 'db4',
+                     'ignored': [('db5', 'db6')]}]
+        self.failUnless(registry.conflicts == expected, registry.conflicts)
+
+    def test_databases_ini_conflict(self):
+        """
+        Test that a project with conflicting dbs is only configured once
+        """
+        buildout_directory = SANDBOX
+        dbs = [('dummy', 'db1', 'db2'), ('dummy', 'db3', 'db4')]
+        databases_ini(buildout_directory, ProjectRegistry(dbs))
+        self.failUnless(files_are_equal('etc/databases/databases.ini'))
+
+    def test_downloads(self):
+        """
+        Test configuring the downloads.ini
+        """
+        buildout_directory = os.path.join(SANDBOX, 'downloads')
+        buildout = {'project_downloads': {'path': '/downloads',
+                                          'url': 'http://localhost/files/',
+                                          'exclude_projects': 'c\nd'},
+                    'project_downloads_folder': {'b': 'bam'}}
+        dbs = [('a', 'db1', 'db2'),
+               ('a', 'db5', 'db6'),
+               ('b', 'db3', 'db4'),
+               ('c', 'db7', 'db8')]
+        downloads(buildout, buildout_directory, ProjectRegistry(dbs))
+        path = os.path.join(buildout_directory, 'etc/projects/downloads.ini')
+        expected = ("[a]\n"
+                    "path = /downloads/a\n"
+                    "url = http://localhost/files/a/\n"
+                    "DB = db1\n"
+                    "COMMONDB = db2\n\n"
+                    "[b]\n"
+                    "path = /downloads/b/bam\n"
+                    "url = http://localhost/files/b/bam/\n"
+                    "DB = db3\n"
+                    "COMMONDB = db4\n\n")
+        found = open(path).read()
+        self.failUnless(found == expected, found)
+
+    def test_get_bundle(self):
+        """
+        Test getting the lookup tables of the bundle
+        """
+        buildout = {'project_downloads': {'path': '/downloads',
+                                          'url': 'http://localhost/files/',
+                                          'exclude_projects': 'b'},
+                    'project_downloads_folder': {}}
+        dbs = [('a', 'db1', 'db2'), ('b', 'db3', 'db4')]
+        parameters = {'read_length': {'title': 'Read Length',
+                                      'category': 'experiment',
+                                      'type': 'integer',
+                                      'column': 'readLength'}}
+        project_downloads = get_project_downloads(buildout, dbs)
+        found = get_bundle(dbs,
+                           {'a': ['anonymous'], 'b': ['raisin']},
+                           {'a': ['read_length'], 'b': ['read_length']},
+                           parameters,
+                           project_downloads)
+        self.failUnless(found['columns'] == {'read_length': 'readLength'},
+                        found['columns'])
+        expected = {'dbs': {'RNAseqPipeline': 'db1',
+                            'RNAseqPipelineCommon': 'db2'},
+                    'users': ['anonymous'],
+                    'parameters': ['read_length'],
+                    'download': {'path': '/downloads/a',
+                                 'url': 'http://localhost/files/a/'}}
+        self.failUnless(found['projects']['a'] == expected,
+                        found['projects']['a'])
+        self.failUnless(found['projects']['b']['download'] is None,
+                        found['projects']['b'])
+
+    def test_bundle_json(self):
+        """
+        Test writing the bundle with its digest
+        """
+        buildout_directory = os.path.join(SANDBOX, 'bundle')
+        bundle = {'format': 1, 'projects': {}, 'parameters': {},
+                  'columns': {}}
+        bundle_json(buildout_directory, bundle)
+        path = os.path.join(buildout_directory, 'etc/bundle.json')
+        found = json.load(open(path))
+        digest = found.pop('digest')
+        self.failUnless(found == bundle, found)
+        content = json.dumps(found, sort_keys=True, separators=(',', ':'))
+        self.failUnless(digest == hashlib.sha1(content).hexdigest(), digest)
+
     def test_get_project_users(self):
         """
         Test getting the project users
@@ -202,6 +501,66 @@ class RecipeTests(unittest.TestCase):
         connections_mysql_ini(buildout_directory)
         self.failUnless(files_are_equal('etc/connections/mysql.ini'))
 
+    def test_connections_mysql_ini_pool(self):
+        """
+        Test setting the pool settings of every connection in mysql.ini
+        """
+        buildout_directory = os.path.join(SANDBOX, 'pool')
+        services = get_services({'workers': '2'}, cpus=2)
+        settings = get_waitress_settings({}, cpus=2)
+        pool = get_pool_settings(services, settings)
+        self.failUnless(pool == {'pool_size': 4,
+                                 'max_overflow': 4,
+                                 'pool_recycle': 3600,
+                                 'connect_timeout': 10}, pool)
+        # Only the 2 restish workers connect to MySQL
+        small = get_pool_settings(services, settings,
+                                  {'max_connections': '10'})
+        self.failUnless(small['pool_size'] == 4, small)
+        self.failUnless(small['max_overflow'] == 1, small)
+        path = os.path.join(buildout_directory, 'etc/connections/mysql.ini')
+        os.makedirs(os.path.dirname(path))
+        open(path, 'w').write("# Edited\n"
+                              "[raisin]\n"
+                              "server = db.example.org\n"
+                              "pool_size = 1\n"
+                              "\n"
+                              "[archive]\n"
+                              "server = archive.example.org\n")
+        connections_mysql_ini(buildout_directory, pool,
+                              {'pool_recycle': '600',
+                               'archive.pool_size': '2'})
+        expected = ("# Edited\n"
+                    "[raisin]\n"
+                    "server = db.example.org\n"
+                    "pool_size = 4\n"
+                    "max_overflow = 4\n"
+                    "pool_recycle = 600\n"
+                    "connect_timeout = 10\n"
+                    "\n"
+                    "[archive]\n"
+                    "server = archive.example.org\n"
+                    "pool_size = 2\n"
+                    "max_overflow = 4\n"
+                    "pool_recycle = 600\n"
+                    "connect_timeout = 10\n")
+        self.failUnless(open(path).read() == expected, open(path).read())
+        connections = get_routed_connections({'database_connections': {
+            'raisin': 'raisin_replica1', 'archive': ''}})
+        self.failUnless(connections == ['archive', 'raisin',
+                                        'raisin_replica1'], connections)
+        connections_mysql_ini(buildout_directory, pool,
+                              {'pool_recycle': '600',
+                               'archive.pool_size': '2'}, connections)
+        expected += ("\n"
+                     "[raisin_replica1]\n"
+                     "# Set the server, port, user and password\n"
+                     "pool_size = 4\n"
+                     "max_overflow = 4\n"
+                     "pool_recycle = 600\n"
+                     "connect_timeout = 10\n")
+        self.failUnless(open(path).read() == expected, open(path).read())
+
     def test_pyramid_development_ini(self):
         """
         Test configuring the pyramid development.ini
@@ -218,6 +577,200 @@ class RecipeTests(unittest.TestCase):
         restish_development_ini(buildout_directory)
         self.failUnless(files_are_equal('etc/restish/development.ini'))
 
+    def test_get_waitress_settings(self):
+        """
+        Test getting the waitress settings for production
+        """
+        found = get_waitress_settings({}, cpus=8)
+        expected = {'threads': 16,
+                    'connection_limit': 400,
+                    'channel_timeout': 60,
+                    'backlog': 2048}
+        self.failUnless(found == expected, found)
+        options = {'threads': '6', 'channel-timeout': '30'}
+        found = get_waitress_settings(options, cpus=1)
+        expected = {'threads': 6,
+                    'connection_limit': 150,
+                    'channel_timeout': 30,
+                    'backlog': 1024}
+        self.failUnless(found == expected, found)
+        self.assertRaises(ValueError, get_waitress_settings,
+                          {'threads': '0'})
+
+    def test_pyramid_production_ini(self):
+        """
+        Test configuring the pyramid production.ini
+        """
+        buildout_directory = SANDBOX
+        settings = get_waitress_settings({}, cpus=2)
+        pyramid_production_ini(buildout_directory, settings)
+        self.failUnless(files_are_equal('etc/pyramid/production.ini'))
+
+    def test_restish_production_ini(self):
+        """
+        Test configuring the restish production.ini
+        """
+        buildout_directory = SANDBOX
+        settings = get_waitress_settings({}, cpus=2)
+        restish_production_ini(buildout_directory, settings)
+        self.failUnless(files_are_equal('etc/restish/production.ini'))
+
+    def test_production_ini_logging(self):
+        """
+        Test logging to rotated files in production, with a sample of the
+        requests in the access log
+        """
+        buildout_directory = os.path.join(SANDBOX, 'logging')
+        self.failUnless(get_log_settings({}, {}) is None)
+        log = get_log_settings({'log_levels': {'root': 'info',
+                                               'raisin.restish': 'debug'}},
+                               {'log-files': 'true', 'log-max-bytes': '1MB',
+                                'access-log-sampling': '0.1'})
+        self.failUnless(log['levels'] == {'root': 'INFO',
+                                          'raisin.restish': 'DEBUG'}, log)
+        self.failUnless(log['max_bytes'] == 1024 * 1024, log)
+        settings = get_waitress_settings({}, cpus=2)
+        restish_production_ini(buildout_directory, settings, log=log,
+                               filters=get_filters(buildout_directory, {},
+                                                   log))
+        path = os.path.join(buildout_directory, 'etc/restish/production.ini')
+        ini = open(path).read()
+        self.failUnless('[composite:raisin]\n' in ini, ini)
+        self.failUnless('[pipeline:main]\n'
+                        'pipeline =\n'
+                        '    translogger\n'
+                        '    raisin\n' in ini, ini)
+        self.failUnless('[logger_root]\n'
+                        'level = INFO\n'
+                        'handlers = buffer\n' in ini, ini)
+        self.failUnless("args = (os.path.join('%s/var/log', "
+                        "os.environ.get('SUPERVISOR_PROCESS_NAME', "
+                        "'restish') + '.log'), 'a', 1048576, 5)\n"
+                        % buildout_directory in ini, ini)
+        self.failUnless('class = raisin.recipe.server.logs.SamplingHandler\n'
+                        'args = (100, 0.1)\n' in ini, ini)
+        pyramid_production_ini(buildout_directory, settings, log=log,
+                               filters=get_filters(buildout_directory, {},
+                                                   log))
+        path = os.path.join(buildout_directory, 'etc/pyramid/production.ini')
+        ini = open(path).read()
+        self.failUnless(ini.startswith('[app:raisin]\n'), ini)
+        self.failUnless('[logger_raisin]\n'
+                        'level = WARN\n' in ini, ini)
+        self.failUnless('[logger_raisin.restish]\n'
+                        'level = DEBUG\n' in ini, ini)
+        self.assertRaises(ValueError, get_log_settings,
+                          {'log_levels': {'root': 'loud'}}, {})
+        self.assertRaises(ValueError, get_log_settings, {},
+                          {'access-log-sampling': '2'})
+
+    def test_production_ini_profiling(self):
+        """
+        Test profiling a sample of the requests in production
+        """
+        buildout_directory = os.path.join(SANDBOX, 'profiling')
+        self.failUnless(get_filters(buildout_directory, {}, None) == [])
+        options = {'profiling': 'true', 'profiling-rate': '0.05',
+                   'profiling-paths': '/project/Test/ /chart'}
+        filters = get_filters(buildout_directory, options, None)
+        settings = get_waitress_settings({}, cpus=2)
+        restish_production_ini(buildout_directory, settings, filters=filters)
+        path = os.path.join(buildout_directory, 'etc/restish/production.ini')
+        ini = open(path).read()
+        self.failUnless('[filter:profiling]\n'
+                        'use = egg:raisin.recipe.server#profiling\n'
+                        'folder = %s/var/profiles\n'
+                        'rate = 0.05\n'
+                        'prefixes = /project/Test/ /chart\n'
+                        'interval = 60\n'
+                        'keep = 24\n\n'
+                        '[pipeline:main]\n'
+                        'pipeline =\n'
+                        '    profiling\n'
+                        '    raisin\n' % buildout_directory in ini, ini)
+        pyramid_production_ini(buildout_directory, settings, filters=filters)
+        path = os.path.join(buildout_directory, 'etc/pyramid/production.ini')
+        ini = open(path).read()
+        self.failUnless('    profiling\n    raisin\n' in ini, ini)
+        self.assertRaises(ValueError, get_filters, buildout_directory,
+                          {'profiling': 'true', 'profiling-rate': '5'}, None)
+
+    def test_production_ini_metrics(self):
+        """
+        Test measuring the requests in production
+        """
+        buildout_directory = os.path.join(SANDBOX, 'metrics')
+        settings = get_waitress_settings({}, cpus=2)
+        filters = get_filters(buildout_directory, {'metrics': 'statsd'}, None,
+                              settings)
+        pyramid_production_ini(buildout_directory, settings, filters=filters)
+        path = os.path.join(buildout_directory, 'etc/pyramid/production.ini')
+        ini = open(path).read()
+        self.failUnless('[filter:metrics]\n'
+                        'use = egg:raisin.recipe.server#metrics\n'
+                        'projects = %(here)s/../projects/projects.ini\n'
+                        'export = statsd\n'
+                        'threads = 4\n'
+                        'statsd = 127.0.0.1:8125\n'
+                        'interval = 10\n\n' in ini, ini)
+        filters = get_filters(buildout_directory,
+                              {'metrics': 'admin', 'metrics-buckets': '10 100',
+                               'profiling': 'true'}, None, settings)
+        self.failUnless([name for name, values in filters] ==
+                        ['metrics', 'profiling'], filters)
+        self.failUnless(('port_offset', 1000) in filters[0][1], filters)
+        self.failUnless(('buckets', '10 100') in filters[0][1], filters)
+        self.assertRaises(ValueError, get_filters, buildout_directory,
+                          {'metrics': 'graphite'}, None, settings)
+
+    def test_production_ini_conditional(self):
+        """
+        Test answering the conditional requests in production
+        """
+        buildout_directory = os.path.join(SANDBOX, 'conditional')
+        filters = get_filters(buildout_directory, {'http-caching': 'true',
+                                                   'http-max-age': '60'},
+                              None)
+        settings = get_waitress_settings({}, cpus=2)
+        restish_production_ini(buildout_directory, settings, filters=filters)
+        path = os.path.join(buildout_directory, 'etc/restish/production.ini')
+        ini = open(path).read()
+        self.failUnless('[filter:conditional]\n'
+                        'use = egg:raisin.recipe.server#conditional\n'
+                        'versions = %s/etc/projects/versions.ini\n'
+                        'max_age = 60\n\n' % buildout_directory in ini, ini)
+        pyramid_production_ini(buildout_directory, settings, filters=filters)
+        path = os.path.join(buildout_directory, 'etc/pyramid/production.ini')
+        ini = open(path).read()
+        self.failUnless('max_age = 60\n'
+                        'private = true\n' in ini, ini)
+
+    def test_production_ini_compression(self):
+        """
+        Test compressing the responses and serving the compressed static
+        files in production
+        """
+        buildout_directory = os.path.join(SANDBOX, 'compression')
+        options = {'compression': 'true', 'compression-min-size': '2KB',
+                   'compression-types': 'application/json text/csv'}
+        filters = get_filters(buildout_directory, options, None)
+        settings = get_waitress_settings({}, cpus=2)
+        restish_production_ini(buildout_directory, settings, filters=filters,
+                               static=get_static(options))
+        path = os.path.join(buildout_directory, 'etc/restish/production.ini')
+        ini = open(path).read()
+        self.failUnless('[app:public]\n'
+                        'use = egg:raisin.recipe.server#static\n' in ini, ini)
+        self.failUnless('[filter:compression]\n'
+                        'use = egg:raisin.recipe.server#compression\n'
+                        'min_size = 2048\n'
+                        'types = application/json text/csv\n'
+                        'level = 6\n' in ini, ini)
+        self.failUnless(get_static({}) == 'egg:Paste#static')
+        self.assertRaises(ValueError, get_filters, buildout_directory,
+                          {'compression': 'true', 'compression-level': '10'},
+                          None)
+
     def test_restish_raisin_restish_ini(self):
         """
         Test configuring the restish raisin.restish.ini
@@ -226,6 +779,72 @@ class RecipeTests(unittest.TestCase):
         restish_raisin_restish_ini(buildout_directory)
         self.failUnless(files_are_equal('etc/restish/raisin.restish.ini'))
 
+    def test_cache_ini(self):
+        """
+        Test configuring the response cache of the restish server, and
+        evicting its responses in production
+        """
+        buildout_directory = os.path.join(SANDBOX, 'cache')
+        options = {'cache-max-size': '2MB', 'cache-levels': '3'}
+        cache = get_cache_settings(buildout_directory, options)
+        self.failUnless(cache['max_size'] == 2 * 1024 * 1024, cache)
+        ttls = get_cache_ttls({'project_cache_ttl': {'Test': '600'}})
+        cache_ini(buildout_directory, cache, ttls)
+        path = os.path.join(buildout_directory, 'etc/restish/cache.ini')
+        expected = ("[cache]\n"
+                    "backend = file\n"
+                    "path = %s/etc/restish/cache\n"
+                    "max_size = 2097152\n"
+                    "ttl = 3600\n"
+                    "levels = 3\n\n"
+                    "[ttl]\n"
+                    "Test = 600\n" % buildout_directory)
+        self.failUnless(open(path).read() == expected, open(path).read())
+        supervisord_conf(buildout_directory, 'production',
+                         get_services({}, cpus=2),
+                         get_tasks(buildout_directory, cache))
+        path = os.path.join(buildout_directory,
+                            'etc/supervisor/production.conf')
+        conf = open(path).read()
+        self.failUnless('[program:cache_eviction]\n'
+                        'command = %s/bin/raisin-cache-eviction --config '
+                        '%s/etc/restish/cache.ini --interval 600\n'
+                        % (buildout_directory, buildout_directory) in conf,
+                        conf)
+        memory = get_cache_settings(buildout_directory,
+                                    {'cache-backend': 'memory'})
+        self.failUnless(get_tasks(buildout_directory, memory) == [])
+        self.assertRaises(ValueError, get_cache_settings, buildout_directory,
+                          {'cache-backend': 'redis'})
+
+    def test_warm_json(self):
+        """
+        Test listing the resources requested to warm the cache
+        """
+        buildout_directory = os.path.join(SANDBOX, 'warm')
+        paths = get_warming_paths(['a', 'b b', 'c'],
+                                  {'a': ['read_length', 'cell']},
+                                  ['/project/%(project)s',
+                                   '/project/%(project)s/%(parameters)s'],
+                                  {'c': 1})
+        self.failUnless(paths == ['/project/c',
+                                  '/project/c/',
+                                  '/project/a',
+                                  '/project/a/read_length-cell',
+                                  '/project/b%20b',
+                                  '/project/b%20b/'], paths)
+        warm_json(buildout_directory, paths, 'http://127.0.0.1:6464', 4, 10)
+        path = os.path.join(buildout_directory, 'etc/restish/warm.json')
+        warming = json.load(open(path))
+        self.failUnless(warming['paths'] == paths, warming)
+        self.failUnless(warming['base'] == 'http://127.0.0.1:6464', warming)
+        cache = get_cache_settings(buildout_directory,
+                                   {'cache-backend': 'memory'})
+        tasks = get_tasks(buildout_directory, cache, True)
+        self.failUnless([task[0] for task in tasks] == ['cache_warming'],
+                        tasks)
+        self.failUnless(('autorestart', 'false') in tasks[0][2], tasks)
+
     def test_pyramid_users_ini(self):
         """
         Test configuring the pyramid users.ini
@@ -250,6 +869,206 @@ class RecipeTests(unittest.TestCase):
         supervisord_conf(buildout_directory, "production")
         self.failUnless(files_are_equal('etc/supervisor/production.conf'))
 
+    def test_get_services(self):
+        """
+        Test getting the ports and workers of the services
+        """
+        options = {'workers': '3', 'pyramid-workers': '5',
+                   'restish-port': '6000'}
+        found = get_services(options, cpus=8)
+        expected = {'restish': {'host': '127.0.0.1',
+                                'port': 6000,
+                                'workers': 3},
+                    'pyramid': {'host': '0.0.0.0',
+                                'port': 7777,
+                                'workers': 5}}
+        self.failUnless(found == expected, found)
+        found = get_services({}, cpus=8)
+        self.failUnless(found['restish']['workers'] == 8, found)
+
+    def test_get_services_ports(self):
+        """
+        Test that the groups leave room for the workers of the services, and
+        that the services sharing ports are refused
+        """
+        groups = [('group1', ['Test']), ('group2', ['Other'])]
+        services = get_services({}, cpus=128, groups=groups)
+        self.failUnless(services['restish_group1']['port'] == 6664, services)
+        self.failUnless(services['restish_group2']['port'] == 6864, services)
+        self.failUnless(services['pyramid_group2']['port'] == 8177, services)
+        ports = []
+        for service in services.values():
+            ports.append(service['port'])
+            ports.extend(get_worker_ports(service))
+        self.failUnless(len(ports) == len(set(ports)) == 6 + 6 * 128)
+        self.assertRaises(ValueError, get_services, {'metrics': 'admin'},
+                          cpus=128, groups=groups)
+        groups = [('group%s' % number, []) for number in range(1, 5)]
+        self.failUnless(get_services({}, cpus=16, groups=groups))
+        self.assertRaises(ValueError, get_services, {'metrics': 'admin'},
+                          cpus=16, groups=groups)
+        get_services({'metrics': 'admin', 'metrics-port-offset': '5000'},
+                     cpus=16, groups=groups)
+
+    def test_supervisord_conf_workers(self):
+        """
+        Test configuring several workers per service in supervisord.conf
+        """
+        buildout_directory = os.path.join(SANDBOX, 'workers')
+        services = get_services({'pyramid-workers': '2'}, cpus=4)
+        supervisord_conf(buildout_directory, "production", services)
+        path = os.path.join(buildout_directory,
+                            'etc/supervisor/production.conf')
+        conf = open(path).read().replace(buildout_directory, '')
+        self.failUnless("""[program:restish]
+command = /bin/pserve /etc/restish/production.ini http_port=%(process_num)s
+process_name = %(program_name)s_%(process_num)s
+numprocs = 4
+numprocs_start = 6465
+""" in conf, conf)
+        self.failUnless("""numprocs = 2
+numprocs_start = 7778
+""" in conf, conf)
+
+    def test_nginx_conf(self):
+        """
+        Test configuring nginx in front of the workers
+        """
+        buildout_directory = SANDBOX
+        settings = get_waitress_settings({}, cpus=2)
+        nginx_conf(buildout_directory, get_services({}, cpus=2), settings)
+        self.failUnless(files_are_equal('etc/nginx/raisin.conf'))
+
+    def test_haproxy_cfg(self):
+        """
+        Test configuring haproxy in front of the workers
+        """
+        buildout_directory = SANDBOX
+        settings = get_waitress_settings({}, cpus=2)
+        haproxy_cfg(buildout_directory, get_services({}, cpus=2), settings)
+        self.failUnless(files_are_equal('etc/haproxy/haproxy.cfg'))
+
+    def test_proxy_conf_unknown(self):
+        """
+        Test that an unknown proxy is refused
+        """
+        settings = get_waitress_settings({}, cpus=2)
+        self.assertRaises(ValueError, proxy_conf, SANDBOX,
+                          get_services({}, cpus=2), settings, 'apache')
+
+    def test_nginx_downloads_conf(self):
+        """
+        Test letting nginx serve the downloads authorized by the Pyramid
+        server
+        """
+        buildout_directory = os.path.join(SANDBOX, 'sendfile')
+        options = {'download-sendfile': 'on', 'download-location': 'files'}
+        nginx_downloads_conf(buildout_directory,
+                             [('a', '/downloads/a', '', 'db1', 'db2'),
+                              ('b', '/downloads/b/bam/', '', 'db3', 'db4')],
+                             '/files/')
+        path = os.path.join(buildout_directory, 'etc/nginx/downloads.conf')
+        expected = ('location /files/a/ {\n'
+                    '    internal;\n'
+                    '    alias "/downloads/a/";\n'
+                    '}\n\n'
+                    'location /files/b/ {\n'
+                    '    internal;\n'
+                    '    alias "/downloads/b/bam/";\n'
+                    '}\n\n')
+        self.failUnless(open(path).read() == expected, open(path).read())
+        settings = get_waitress_settings({}, cpus=2)
+        includes = get_proxy_includes(buildout_directory, options)
+        nginx_conf(buildout_directory, get_services({}, cpus=2), settings,
+                   includes)
+        conf = open(os.path.join(buildout_directory,
+                                 'etc/nginx/raisin.conf')).read()
+        self.failUnless('    include %s;\n' % path in conf, conf)
+        self.assertRaises(ValueError, proxy_conf, buildout_directory,
+                          get_services({}, cpus=2), settings, 'haproxy',
+                          includes)
+        pyramid_production_ini(buildout_directory, settings,
+                               get_pyramid_settings(options))
+        ini = open(os.path.join(buildout_directory,
+                                'etc/pyramid/production.ini')).read()
+        self.failUnless('raisin.downloads.sendfile_header = X-Accel-Redirect\n'
+                        'raisin.downloads.sendfile_location = /files/\n'
+                        in ini, ini)
+
+    def test_get_groups(self):
+        """
+        Test grouping the projects explicitly and by number of profiles
+        """
+        projects = ['a', 'b', 'c', 'd', 'e']
+        counts = {'a': 100, 'b': 60, 'c': 50, 'd': 10, 'e': 5}
+        buildout = {'project_groups': {'heavy': 'a unknown'}}
+        groups = get_groups(buildout, {}, projects, counts)
+        self.failUnless(groups == [('heavy', ['a'])], groups)
+        groups = get_groups(buildout, {'project-groups': '2'}, projects,
+                            counts)
+        self.failUnless(groups == [('group1', ['b', 'e']),
+                                   ('group2', ['c', 'd']),
+                                   ('heavy', ['a'])], groups)
+        self.failUnless(get_groups({}, {}, projects, counts) == [])
+
+    def test_group_configs(self):
+        """
+        Test configuring the servers of a group of projects, and routing
+        its projects to them
+        """
+        buildout_directory = os.path.join(SANDBOX, 'groups')
+        groups = [('heavy', ['a'])]
+        services = get_services({'workers': '2', 'group-workers': '1'},
+                                cpus=2, groups=groups)
+        heavy = services['restish_heavy']
+        self.failUnless(heavy == {'host': '127.0.0.1', 'port': 6564,
+                                  'workers': 1, 'projects': ['a']}, heavy)
+        settings = get_waitress_settings({}, cpus=2)
+        stale = os.path.join(buildout_directory, 'etc/groups/old')
+        os.makedirs(stale)
+        group_configs(buildout_directory, groups,
+                      [('a', 'db1', 'db2'), ('b', 'db3', 'db4')], None,
+                      {'a': ['raisin'], 'b': ['anonymous']}, services,
+                      settings)
+        self.failIf(os.path.exists(stale))
+        folder = os.path.join(buildout_directory, 'etc/groups/heavy')
+        self.failUnless(sorted(os.listdir(folder)) == ['databases.ini',
+                                                       'projects.ini',
+                                                       'pyramid.ini'])
+        databases = open(os.path.join(folder, 'databases.ini')).read()
+        self.failUnless('[a]\n' in databases and '[b]\n' not in databases,
+                        databases)
+        path = os.path.join(buildout_directory,
+                            'etc/restish/production-heavy.ini')
+        ini = open(path).read()
+        self.failUnless('projects = %(here)s/../groups/heavy/projects.ini\n'
+                        in ini, ini)
+        path = os.path.join(buildout_directory,
+                            'etc/pyramid/production-heavy.ini')
+        ini = open(path).read()
+        self.failUnless('raisin.restish = http://127.0.0.1:6564\n' in ini,
+                        ini)
+        supervisord_conf(buildout_directory, 'production', services)
+        path = os.path.join(buildout_directory,
+                            'etc/supervisor/production.conf')
+        conf = open(path).read()
+        self.failUnless('[program:restish_heavy]\n' in conf, conf)
+        self.failUnless('etc/restish/production-heavy.ini' in conf, conf)
+        nginx_conf(buildout_directory, services, settings)
+        path = os.path.join(buildout_directory, 'etc/nginx/raisin.conf')
+        conf = open(path).read()
+        self.failUnless('    location /project/a/ {\n'
+                        '        proxy_pass http://raisin_pyramid_heavy;\n'
+                        in conf, conf)
+        self.failUnless('    location = /project/a {\n' in conf, conf)
+        self.failUnless('    server 127.0.0.1:6565;\n' in conf, conf)
+        haproxy_cfg(buildout_directory, services, settings)
+        path = os.path.join(buildout_directory, 'etc/haproxy/haproxy.cfg')
+        conf = open(path).read()
+        self.failUnless('    acl heavy path_beg /project/a/\n'
+                        '    use_backend restish_heavy_workers if heavy\n'
+                        in conf, conf)
+
     def test_var_log_folder(self):
         """
         Test that the var/log folder is created
@@ -258,6 +1077,122 @@ class RecipeTests(unittest.TestCase):
         var_log_folder(SANDBOX)
         self.failUnless(os.path.exists(path))
 
+    def test_main(self):
+        """
+        Test producing all the configuration files
+        """
+        buildout_directory = os.path.join(SANDBOX, 'main')
+        staging = os.path.join(buildout_directory, 'staging')
+        buildout = make_buildout(staging)
+        main(buildout, buildout_directory, staging)
+        for path in ['etc/projects/projects.ini',
+                     'etc/databases/databases.ini',
+                     'etc/projects/downloads.ini',
+                     'etc/supervisor/production.conf',
+                     'etc/bundle.json',
+                     'etc/restish/cache.ini',
+                     'bin/raisin-cache-eviction',
+                     'var/raisin.recipe.server/manifest.json']:
+            path = os.path.join(buildout_directory, path)
+            self.failUnless(os.path.exists(path), path)
+
+    def test_main_unchanged(self):
+        """
+        Test that running again with the same inputs writes no files
+        """
+        buildout_directory = os.path.join(SANDBOX, 'unchanged')
+        staging = os.path.join(buildout_directory, 'staging')
+        buildout = make_buildout(staging)
+        main(buildout, buildout_directory, staging)
+        written = []
+        for folder, _, files in os.walk(os.path.join(buildout_directory,
+                                                     'etc')):
+            for name in files:
+                path = os.path.join(folder, name)
+                os.utime(path, (0, 0))
+                written.append(path)
+        main(buildout, buildout_directory, staging)
+        for path in written:
+            self.failUnless(os.path.getmtime(path) == 0, path)
+
+    def test_main_report(self):
+        """
+        Test measuring the stages run by main
+        """
+        buildout_directory = os.path.join(SANDBOX, 'report')
+        staging = os.path.join(buildout_directory, 'staging')
+        buildout = make_buildout(staging)
+        main(buildout, buildout_directory, staging, options={'report': 'on'})
+        path = os.path.join(buildout_directory, 'var/log/server-report.json')
+        report = json.load(open(path))
+        stages = report['stages']
+        self.failUnless(stages['profiles']['rows'] == 1, stages['profiles'])
+        self.failUnless(stages['databases_ini']['written'] == 1,
+                        stages['databases_ini'])
+        self.failUnless(stages['databases_ini']['bytes'] > 0,
+                        stages['databases_ini'])
+        self.failUnless('manifest' in stages, stages)
+        self.failUnless(report['totals']['files'] >= 13, report['totals'])
+
+    def test_main_incremental(self):
+        """
+        Test that an incremental run only regenerates the files whose
+        inputs or outputs changed
+        """
+        buildout_directory = os.path.join(SANDBOX, 'incremental')
+        staging = os.path.join(buildout_directory, 'staging')
+        buildout = make_buildout(staging)
+        main(buildout, buildout_directory, staging)
+        paths = {'parameters': 'etc/misc/parameters.ini',
+                 'databases': 'etc/databases/databases.ini',
+                 'projects': 'etc/projects/projects.ini'}
+        for name, path in paths.items():
+            paths[name] = os.path.join(buildout_directory, path)
+            os.utime(paths[name], (0, 0))
+        os.remove(paths['projects'])
+        buildout['parameter_vocabulary'] = {'read_length': 'Length'}
+        main(buildout, buildout_directory, staging, incremental=True,
+             options={'jobs': '1'})
+        self.failUnless(os.path.getmtime(paths['databases']) == 0)
+        self.failUnless(os.path.getmtime(paths['parameters']) > 0)
+        self.failUnless(os.path.exists(paths['projects']))
+        parameters = open(paths['parameters']).read()
+        self.failUnless('title = Length\n' in parameters, parameters)
+
+    def test_main_incremental_groups(self):
+        """
+        Test that an incremental run writes again the configuration of the
+        groups removed or edited since, and the connections when the groups
+        change
+        """
+        buildout_directory = os.path.join(SANDBOX, 'incremental_groups')
+        staging = os.path.join(buildout_directory, 'staging')
+        buildout = make_buildout(staging)
+        options = {'project-groups': '1'}
+        main(buildout, buildout_directory, staging, options=options)
+        pyramid = os.path.join(buildout_directory,
+                               'etc/pyramid/production-group1.ini')
+        restish = os.path.join(buildout_directory,
+                               'etc/restish/production-group1.ini')
+        mysql = os.path.join(buildout_directory, 'etc/connections/mysql.ini')
+        content = open(restish).read()
+        os.remove(pyramid)
+        open(restish, 'w').write('edited')
+        os.utime(mysql, (0, 0))
+        main(buildout, buildout_directory, staging, incremental=True,
+             options=options)
+        self.failUnless(os.path.exists(pyramid))
+        self.failUnless(open(restish).read() == content)
+        self.failUnless(os.path.getmtime(mysql) == 0)
+        manifest = os.path.join(buildout_directory, MANIFEST)
+        key = json.load(open(manifest))['generators'][
+            'connections_mysql_ini']['inputs']
+        buildout['project_groups'] = {'heavy': 'Test'}
+        main(buildout, buildout_directory, staging, incremental=True,
+             options=options)
+        self.failUnless(json.load(open(manifest))['generators'][
+            'connections_mysql_ini']['inputs'] != key)
+
 
 def test_suite():
     """
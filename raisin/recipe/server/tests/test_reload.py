@@ -0,0 +1,145 @@
+"""
+Test for raisin.recipe.server.reload
+"""
+
+import time
+import socket
+import unittest
+from raisin.recipe.server.reload import get_services
+from raisin.recipe.server.reload import reload_services
+from raisin.recipe.server.reload import wait_ready
+
+
+class Supervisor(object):
+    """
+    Record the calls to the XML-RPC interface of supervisord.
+    """
+
+    def __init__(self, running=True):
+        self.running = running
+        self.calls = []
+
+    def getState(self):  # pylint: disable=C0103
+        """Fail unless running."""
+        if not self.running:
+            raise socket.error(111, 'Connection refused')
+        return {'statename': 'RUNNING'}
+
+    def getAllProcessInfo(self):  # pylint: disable=C0103
+        """Return the processes of two restish and pyramid workers."""
+        infos = []
+        for group in ['pyramid', 'restish', 'restish_heavy']:
+            for number in [2, 1]:
+                infos.append({'group': group,
+                              'name': '%s_%s' % (group, number),
+                              'statename': 'RUNNING'})
+        infos.append({'group': 'cache_warming',
+                      'name': 'cache_warming',
+                      'statename': 'EXITED'})
+        return infos
+
+    def stopProcess(self, name, wait):  # pylint: disable=C0103
+        """Record stopping a process."""
+        self.calls.append(('stop', name, wait))
+
+    def startProcess(self, name, wait):  # pylint: disable=C0103
+        """Record starting a process."""
+        self.calls.append(('start', name, wait))
+
+
+class Proxy(object):
+    """
+    Stand for the XML-RPC server proxy of supervisord.
+    """
+
+    def __init__(self, supervisor):
+        self.supervisor = supervisor
+
+
+class ReloadTests(unittest.TestCase):
+    """
+    Test reloading the services whose files changed
+    """
+
+    def test_get_services(self):
+        """
+        Test finding the services reading the files written
+        """
+        services = get_services('/buildout',
+                                ['/buildout/etc/pyramid/projects.ini',
+                                 '/buildout/etc/restish/warm.json',
+                                 '/buildout/etc/databases/indexes/a.sql'])
+        self.failUnless(services == ['pyramid'], services)
+        services = get_services('/buildout', ['/buildout/etc/misc/a.ini'])
+        self.failUnless(services == ['restish', 'restish_*'], services)
+        services = get_services('/buildout',
+                                ['/buildout/etc/groups/heavy/projects.ini',
+                                 '/buildout/etc/restish/production-big.ini'])
+        self.failUnless(services == ['pyramid_big', 'pyramid_heavy',
+                                     'restish_big', 'restish_heavy'],
+                        services)
+        self.failUnless(get_services('/buildout', []) == [])
+        services = get_services('/buildout',
+                                ['/buildout/etc/projects/projects.ini'])
+        self.failUnless(services == ['pyramid', 'pyramid_*', 'restish',
+                                     'restish_*'], services)
+
+    def test_reload_rolling(self):
+        """
+        Test restarting the workers of a service one after the other
+        """
+        supervisor = Supervisor()
+        services = reload_services('/buildout',
+                                   ['/buildout/etc/databases/databases.ini'],
+                                   proxy=Proxy(supervisor), timeout=0)
+        self.failUnless(services == ['restish'], services)
+        self.failUnless(supervisor.calls == [
+            ('stop', 'restish:restish_1', True),
+            ('start', 'restish:restish_1', True),
+            ('stop', 'restish:restish_2', True),
+            ('start', 'restish:restish_2', True)], supervisor.calls)
+        supervisor.calls = []
+        services = reload_services('/buildout',
+                                   ['/buildout/etc/misc/parameters.ini'],
+                                   proxy=Proxy(supervisor), timeout=0)
+        self.failUnless(services == ['restish', 'restish_heavy'], services)
+        self.failUnless(len(supervisor.calls) == 8, supervisor.calls)
+
+    def test_wait_ready(self):
+        """
+        Test waiting for a restarted worker to accept connections
+        """
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        port = server.getsockname()[1]
+        self.failUnless(wait_ready('restish:restish_%s' % port, 1))
+        server.close()
+        start = time.time()
+        self.failIf(wait_ready('restish:restish_%s' % port, 0.3))
+        self.failUnless(time.time() - start >= 0.3)
+        self.failUnless(wait_ready('cache_warming:cache_warming', 1))
+
+    def test_reload_not_running(self):
+        """
+        Test that nothing is reloaded when supervisord is not running, and
+        that an unknown mode is refused, signalling the servers being one
+        as they would all stop
+        """
+        supervisor = Supervisor(running=False)
+        services = reload_services('/buildout',
+                                   ['/buildout/etc/pyramid/users.ini'],
+                                   proxy=Proxy(supervisor))
+        self.failUnless(services == [] and supervisor.calls == [])
+        self.assertRaises(ValueError, reload_services, '/buildout', [],
+                          'restart')
+        self.assertRaises(ValueError, reload_services, '/buildout',
+                          ['/buildout/etc/pyramid/users.ini'], 'signal',
+                          proxy=Proxy(Supervisor()))
+
+
+def test_suite():
+    """
+    Run the test suite
+    """
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
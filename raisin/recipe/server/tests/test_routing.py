@@ -0,0 +1,56 @@
+"""
+Test for raisin.recipe.server.routing
+"""
+
+import unittest
+from raisin.recipe.server.routing import HashRing
+from raisin.recipe.server.routing import get_connections
+from raisin.recipe.server.routing import get_routes
+
+
+class RoutingTests(unittest.TestCase):
+    """
+    Test assigning the databases to the connections
+    """
+
+    def test_hash_ring(self):
+        """
+        Test that adding a connection only moves the keys it takes over
+        """
+        keys = ['Project%04d' % number for number in range(1000)]
+        before = HashRing(['raisin', 'raisin2'])
+        after = HashRing(['raisin', 'raisin2', 'raisin3'])
+        moved = 0
+        for key in keys:
+            if before.get(key) != after.get(key):
+                self.failUnless(after.get(key) == 'raisin3', key)
+                moved += 1
+        self.failUnless(200 < moved < 500, moved)
+        self.assertRaises(ValueError, HashRing([]).get, 'Project0000')
+
+    def test_get_routes(self):
+        """
+        Test the explicit and hashed assignments, and the read replicas
+        """
+        connections = get_connections({'raisin': 'replica2 replica1',
+                                       'raisin2': ''})
+        self.failUnless(connections == {'raisin': ['replica1', 'replica2'],
+                                        'raisin2': []}, connections)
+        dbs = [('a', 'db1', 'db2'),
+               ('b', 'db3', 'db4')]
+        routes = get_routes(dbs, connections, {'a': 'raisin',
+                                               'bCommon': 'raisin2'})
+        self.failUnless(routes['a'][0] == 'raisin', routes)
+        self.failUnless(routes['a'][1] in ['replica1', 'replica2'], routes)
+        self.failUnless(routes['aCommon'][0] == 'raisin', routes)
+        self.failUnless(routes['bCommon'] == ('raisin2', 'raisin2'), routes)
+        self.failUnless(routes['b'][0] in connections, routes)
+        self.assertRaises(ValueError, get_routes, dbs, connections,
+                          {'a': 'unknown'})
+
+
+def test_suite():
+    """
+    Run the test suite
+    """
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
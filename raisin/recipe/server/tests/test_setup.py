@@ -0,0 +1,73 @@
+"""
+Test the entry points of raisin.recipe.server used by the generated
+configuration
+"""
+
+import os
+import re
+import ast
+import shutil
+import unittest
+from pkg_resources import get_provider
+from pkg_resources import EntryPoint
+from raisin.recipe.server.server import get_filters
+from raisin.recipe.server.server import get_static
+from raisin.recipe.server.server import get_waitress_settings
+from raisin.recipe.server.server import restish_production_ini
+
+PROVIDER = get_provider('raisin.recipe.server')
+SANDBOX = PROVIDER.get_resource_filename("", 'tests/sandbox')
+PATH = os.path.join(SANDBOX, 'setup')
+SETUP = os.path.join(os.path.dirname(__file__), '..', '..', '..', '..',
+                     'setup.py')
+
+# The section using each entry point of the package, and the group the
+# entry point must belong to
+USES = re.compile(r'^\[(filter|app):[^\]]+\]\n'
+                  r'use = egg:raisin\.recipe\.server#(\w+)$', re.M)
+GROUPS = {'filter': 'paste.filter_app_factory',
+          'app': 'paste.app_factory'}
+
+
+def get_entry_points():
+    """
+    Return the entry points declared in setup.py, by group.
+    """
+    tree = ast.parse(open(SETUP).read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and \
+           [target.id for target in node.targets] == ['entry_points']:
+            groups = ast.literal_eval(node.value)
+    entry_points = {}
+    for group, lines in groups.items():
+        entry_points[group] = EntryPoint.parse_map({group: lines})[group]
+    return entry_points
+
+
+class SetupTests(unittest.TestCase):
+    """
+    Test the entry points
+    """
+
+    def tearDown(self):
+        if os.path.exists(PATH):
+            shutil.rmtree(PATH)
+
+    def test_entry_points(self):
+        """
+        Test that every filter and application of the package used by the
+        production inis is declared in its group, and can be loaded
+        """
+        options = {'metrics': 'statsd', 'http-caching': 'true',
+                   'compression': 'true', 'profiling': 'true'}
+        restish_production_ini(PATH, get_waitress_settings({}, cpus=2),
+                               filters=get_filters(PATH, options, None),
+                               static=get_static(options))
+        ini = open(os.path.join(PATH, 'etc/restish/production.ini')).read()
+        uses = USES.findall(ini)
+        self.failUnless(len(uses) == 5, uses)
+        entry_points = get_entry_points()
+        for kind, name in uses:
+            group = entry_points[GROUPS[kind]]
+            self.failUnless(name in group, (kind, name))
+            self.failUnless(callable(group[name].resolve()), (kind, name))
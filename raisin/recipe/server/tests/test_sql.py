@@ -0,0 +1,87 @@
+"""
+Test for raisin.recipe.server.sql
+"""
+
+import os
+import shutil
+import unittest
+from pkg_resources import get_provider
+from raisin.recipe.server.sql import get_indexes
+from raisin.recipe.server.sql import index_name
+from raisin.recipe.server.sql import indexes_sql
+
+PROVIDER = get_provider('raisin.recipe.server')
+SANDBOX = PROVIDER.get_resource_filename("", 'tests/sandbox')
+PATH = os.path.join(SANDBOX, 'sql')
+
+PARAMETERS = {'read_length': {'column': 'readLength'},
+              'cell': {'column': 'cell'},
+              'partition': {'column': 'partition'},
+              'species': {'column': ''}}
+
+
+class SqlTests(unittest.TestCase):
+    """
+    Test writing the scripts creating the indexes
+    """
+
+    def setUp(self):  # pylint: disable=C0103
+        if os.path.exists(PATH):
+            shutil.rmtree(PATH)
+
+    def test_get_indexes(self):
+        """
+        Test the composite and single column indexes of a project
+        """
+        indexes = get_indexes(PARAMETERS, ['cell', 'read_length', 'unknown',
+                                           'species', 'cell', 'partition'])
+        self.failUnless(indexes == [['cell', 'readLength', 'partition'],
+                                    ['readLength'],
+                                    ['partition']], indexes)
+        indexes = get_indexes(PARAMETERS, ['read_length'])
+        self.failUnless(indexes == [['readLength'], ['cell'], ['partition']],
+                        indexes)
+        indexes = get_indexes(PARAMETERS, ['species'])
+        self.failUnless(indexes == [['cell'], ['partition'], ['readLength']],
+                        indexes)
+        self.failUnless(get_indexes({'species': {'column': ''}},
+                                    ['species']) == [])
+        name = index_name(['column%s' % number for number in range(10)])
+        self.failUnless(len(name) == 23, name)
+
+    def test_indexes_sql(self):
+        """
+        Test writing the script of every project, with an index on every
+        parameter column, and removing the others
+        """
+        folder = os.path.join(PATH, 'etc/databases/indexes')
+        os.makedirs(folder)
+        open(os.path.join(folder, 'Old.sql'), 'w').write('')
+        dbs = [('Test', 'Test_RNAseqPipeline', 'Test_RNAseqPipelineCommon'),
+               ('Other', 'Other_RNAseqPipeline', 'Other_Common')]
+        indexes_sql(PATH, dbs, PARAMETERS, {'Test': ['read_length', 'cell'],
+                                            'Other': ['species']})
+        self.failUnless(sorted(os.listdir(folder)) == ['Other.sql',
+                                                       'Test.sql'],
+                        os.listdir(folder))
+        sql = open(os.path.join(folder, 'Test.sql')).read()
+        self.failUnless(sql.startswith('USE `Test_RNAseqPipeline`;\n'), sql)
+        self.failUnless("WHERE table_schema = 'Test_RNAseqPipeline' "
+                        "AND table_name = 'experiments' "
+                        "AND index_name = 'raisin_readLength_cell');\n"
+                        in sql, sql)
+        self.failUnless("SET @statement = IF(@missing, 'CREATE INDEX "
+                        "`raisin_readLength_cell` ON `experiments` "
+                        "(`readLength`, `cell`)', 'DO 0');\n" in sql, sql)
+        self.failUnless("'CREATE INDEX `raisin_cell` ON `experiments` "
+                        "(`cell`)'" in sql, sql)
+        self.failUnless(sql.count('EXECUTE statement;\n') == 3, sql)
+        sql = open(os.path.join(folder, 'Other.sql')).read()
+        self.failUnless(sql.count('EXECUTE statement;\n') == 3, sql)
+
+
+def test_suite():
+    """
+    Run the test suite
+    """
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
@@ -0,0 +1,105 @@
+"""
+Test for raisin.recipe.server.warm
+"""
+
+import os
+import json
+import shutil
+import logging
+import unittest
+import threading
+import BaseHTTPServer
+from pkg_resources import get_provider
+from raisin.recipe.server.warm import warm
+from raisin.recipe.server.warm import main
+
+PROVIDER = get_provider('raisin.recipe.server')
+SANDBOX = PROVIDER.get_resource_filename("", 'tests/sandbox')
+PATH = os.path.join(SANDBOX, 'warm')
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Answer with an error for the paths containing error, and record the
+    paths requested.
+    """
+
+    def do_GET(self):  # pylint: disable=C0103
+        """Answer a request."""
+        self.server.requested.append(self.path)
+        if 'error' in self.path:
+            self.send_error(500)
+        else:
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write('warm')
+
+    def log_message(self, *args):
+        """Do not log the requests."""
+
+
+class WarmTests(unittest.TestCase):
+    """
+    Test warming the cache
+    """
+
+    def setUp(self):  # pylint: disable=C0103
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+        self.server.requested = []
+        self.base = 'http://127.0.0.1:%s' % self.server.server_port
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  args=(0.05,))
+        thread.setDaemon(True)
+        thread.start()
+
+    def tearDown(self):  # pylint: disable=C0103
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_warm(self):
+        """
+        Test requesting the resources in their order
+        """
+        urls = [self.base + '/project/%s' % number for number in range(5)]
+        self.failUnless(warm(urls, jobs=1) == (5, 0))
+        self.failUnless(self.server.requested == ['/project/%s' % number
+                                                  for number in range(5)],
+                        self.server.requested)
+
+    def test_warm_errors(self):
+        """
+        Test stopping after too many errors
+        """
+        urls = [self.base + '/error/%s' % number for number in range(5)]
+        self.failUnless(warm(urls, jobs=1, max_errors=2) == (2, 2))
+        self.failUnless(len(self.server.requested) == 2,
+                        self.server.requested)
+
+    def test_main(self):
+        """
+        Test warming the cache with the resources listed in warm.json
+        """
+        if os.path.exists(PATH):
+            shutil.rmtree(PATH)
+        os.makedirs(PATH)
+        config = os.path.join(PATH, 'warm.json')
+        json.dump({'base': self.base,
+                   'jobs': 2,
+                   'max_errors': 1,
+                   'paths': ['/project/a', '/project/b'],
+                   'timeout': 10,
+                   'wait': 10}, open(config, 'w'))
+        handlers = logging.root.handlers[:]
+        try:
+            self.failUnless(main(['--config', config]) == 0)
+        finally:
+            logging.root.handlers = handlers
+        self.failUnless('/project/b' in self.server.requested,
+                        self.server.requested)
+
+
+def test_suite():
+    """
+    Run the test suite
+    """
+    return unittest.defaultTestLoader.loadTestsFromName(__name__)
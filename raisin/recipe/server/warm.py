@@ -0,0 +1,130 @@
+"""
+Warm the response cache of the restish server after it started, by
+requesting the expensive resources of every project, the most important
+first.
+
+Run it with:
+
+  $ ./bin/raisin-cache-warming --config etc/restish/warm.json
+"""
+
+import sys
+import json
+import time
+import Queue
+import socket
+import urllib2
+import logging
+import optparse
+import threading
+
+logger = logging.getLogger('raisin.recipe.server.warm')
+
+
+def fetch(url, timeout):
+    """
+    Request a resource, reading the whole response.
+    """
+    response = urllib2.urlopen(url, timeout=timeout)
+    try:
+        while response.read(64 * 1024):
+            pass
+    finally:
+        response.close()
+
+
+def wait(url, timeout, seconds):
+    """
+    Wait until the server answers, for at most the given number of seconds.
+
+    Return True if it answered.
+    """
+    deadline = time.time() + seconds
+    while True:
+        try:
+            fetch(url, timeout)
+        except urllib2.HTTPError:
+            # The server is up, even if this resource is not
+            return True
+        except (urllib2.URLError, socket.error):
+            if time.time() >= deadline:
+                return False
+            time.sleep(1)
+        else:
+            return True
+
+
+def warm(urls, jobs=4, max_errors=10, timeout=300):
+    """
+    Request the urls in their order, with at most jobs requests at the same
+    time, and no new request once max_errors requests failed.
+
+    Return the number of requests done and the number of errors.
+    """
+    tasks = Queue.Queue()
+    for url in urls:
+        tasks.put(url)
+    lock = threading.Lock()
+    counts = {'done': 0, 'errors': 0}
+
+    def work():
+        """Request the urls left, until too many errors."""
+        while counts['errors'] < max_errors:
+            try:
+                url = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            start = time.time()
+            try:
+                fetch(url, timeout)
+            except (urllib2.URLError, socket.error), error:
+                logger.warning('Failed to warm %s: %s' % (url, error))
+                failed = 1
+            else:
+                logger.info('Warmed %s in %.1fs' % (url, time.time() - start))
+                failed = 0
+            lock.acquire()
+            try:
+                counts['done'] += 1
+                counts['errors'] += failed
+            finally:
+                lock.release()
+
+    workers = []
+    for _ in range(max(1, min(jobs, len(urls)))):
+        worker = threading.Thread(target=work)
+        worker.setDaemon(True)
+        worker.start()
+        workers.append(worker)
+    for worker in workers:
+        worker.join()
+    return counts['done'], counts['errors']
+
+
+def main(argv=None):
+    """
+    Warm the cache with the resources listed in warm.json.
+    """
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--config', default='etc/restish/warm.json',
+                      help='cache warming configuration [%default]')
+    options = parser.parse_args(argv)[0]
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    config = json.load(open(options.config))
+    if not wait(config['base'], config['timeout'], config['wait']):
+        logger.error('The server did not answer: %s' % config['base'])
+        return 1
+    done, errors = warm([config['base'] + path for path in config['paths']],
+                        config['jobs'], config['max_errors'],
+                        config['timeout'])
+    logger.info('Warmed %s of %s resources, with %s errors' % (
+        done - errors, len(config['paths']), errors))
+    if errors >= config['max_errors']:
+        logger.error('Stopped after %s errors' % errors)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
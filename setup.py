@@ -14,6 +14,17 @@ data."""
 entry_point = 'raisin.recipe.server:Recipe'
 entry_points = {"zc.buildout": [
                   "default = raisin.recipe.server:Recipe",
+               ],
+               "paste.filter_app_factory": [
+                  "metrics = raisin.recipe.server.metrics:make_filter",
+                  "conditional = "
+                  "raisin.recipe.server.conditional:make_filter",
+                  "compression = "
+                  "raisin.recipe.server.compression:make_filter",
+                  "profiling = raisin.recipe.server.profiling:make_filter",
+               ],
+               "paste.app_factory": [
+                  "static = raisin.recipe.server.compression:make_static",
                ]}
 
 setup(name='raisin.recipe.server',